@@ -0,0 +1,260 @@
+"""
+Binary AST files.
+
+write_ast(ast, stream) writes an AST (an Element tree or a ColumnarAST) in a
+compact versioned format, and load_ast(path) maps a file written that way
+into memory with mmap and reads it in place. Every process that loads the
+same file shares one copy of it in the page cache, and nothing is decoded up
+front: the columns are memoryviews of the mapping, and a name or string is only
+decoded (then kept) the first time a node asks for it. read_ast(data) does the
+same for bytes already in memory.
+
+The file is the columns of brewcolumns.ColumnarAST with the pool split up by type:
+
+    MAGIC, HEADER       version, node count, kind count, then the size of each table
+    kinds, fields, flags                            1 byte per node, padded to 4 bytes
+    first_child, next_sibling, values, offsets      int32 per node
+    ints                                            int64 per int literal
+    names, strings      offsets (uint32, one more than there are entries), then the UTF-8 bytes, padded to 4
+
+A node's value is an index into the table its kind uses: ints for int literals,
+strings for string literals and names for everything else with a value. bools
+are a flag, and so are int literals too big for 64 bits, which are kept as their
+digits in strings. Everything is little-endian.
+
+read_ast and load_ast raise ValueError for anything that isn't a whole file of
+this version: the wrong magic, another version, or a size that doesn't match
+what the header says (a truncated file).
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+
+from element import ELEM_TYPES, INT, STRING, BOOL
+from brewcolumns import ColumnarAST, VALUE_FIELDS, REF
+
+MAGIC = b"BRWINAST"
+# Bumped whenever the layout changes, or the kind codes in element.py do
+VERSION = 2
+# version, nodes, kind codes, names, names bytes, strings, strings bytes, ints
+HEADER = struct.Struct("<IIIIIIII")
+
+# flags, on top of REF
+TRUE = 2
+BIG_INT = 4
+
+INT64_RANGE = range(-2 ** 63, 2 ** 63)
+
+
+# Writes an Element tree or a ColumnarAST to a binary stream. An Element tree's source positions are kept if
+# its SourcePositions is given
+def write_ast(ast, stream, positions=None):
+    if not isinstance(ast, ColumnarAST):
+        ast = ColumnarAST.from_element(ast, positions)
+    names = StringTable()
+    strings = StringTable()
+    ints = array('q')
+    values = array('i')
+    flags = array('B')
+    for index in range(len(ast)):
+        kind = ast.kinds[index]
+        flag = ast.flags[index] & REF
+        if VALUE_FIELDS.get(kind) is None:
+            values.append(-1)
+        else:
+            value = ast.value(index)
+            if kind == BOOL:
+                values.append(-1)
+                flag |= TRUE if value else 0
+            elif kind == INT and value in INT64_RANGE:
+                values.append(len(ints))
+                ints.append(value)
+            elif kind == INT:
+                values.append(strings.add(str(value)))
+                flag |= BIG_INT
+            elif kind == STRING:
+                values.append(strings.add(value))
+            else:
+                values.append(names.add(value))
+        flags.append(flag)
+
+    count = len(ast)
+    names_data = names.encode()
+    strings_data = strings.encode()
+    stream.write(MAGIC)
+    stream.write(HEADER.pack(
+        VERSION, count, len(ELEM_TYPES), len(names), len(names_data[1]), len(strings), len(strings_data[1]), len(ints),
+    ))
+    for column in (ast.kinds, ast.fields, flags):
+        stream.write(little_endian(column))
+    position = len(MAGIC) + HEADER.size + 3 * count
+    stream.write(bytes(padding(position, 4)))
+    for column in (ast.first_child, ast.next_sibling, values, ast.offsets):
+        stream.write(little_endian(column))
+    position += padding(position, 4) + 16 * count
+    stream.write(bytes(padding(position, 8)))
+    stream.write(little_endian(ints))
+    for offsets, data in (names_data, strings_data):
+        stream.write(little_endian(offsets))
+        stream.write(data)
+        stream.write(bytes(padding(len(data), 4)))
+
+
+# The AST in a file written by write_ast, mapped rather than read
+def load_ast(path):
+    with open(path, "rb") as handle:
+        mapping = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        ast = read_ast(mapping)
+    except BaseException:
+        mapping.close()
+        raise
+    ast.mapping = mapping
+    return ast
+
+
+# The AST in bytes (or anything else with the buffer interface) written by write_ast
+def read_ast(data):
+    return MappedAST(data)
+
+
+class StringTable:
+    def __init__(self):
+        self.indexes = {}
+
+    def add(self, text):
+        index = self.indexes.get(text)
+        if index is None:
+            index = self.indexes[text] = len(self.indexes)
+        return index
+
+    def __len__(self):
+        return len(self.indexes)
+
+    # (offsets, bytes) for the file
+    def encode(self):
+        offsets = array('I', [0])
+        chunks = []
+        for text in self.indexes:
+            chunks.append(text.encode("utf-8"))
+            offsets.append(offsets[-1] + len(chunks[-1]))
+        return offsets, b"".join(chunks)
+
+
+# A ColumnarAST whose columns are views of the file's bytes. The pool is replaced by the file's tables,
+# which are decoded an entry at a time as nodes need them
+class MappedAST(ColumnarAST):
+    def __init__(self, data):
+        self.mapping = None
+        count, _, name_count, names_size, string_count, strings_size, int_count = read_header(data)
+        view = memoryview(data).cast('B')
+        position = len(MAGIC) + HEADER.size
+        self.view = view
+        self.kinds, position = column(view, position, 'B', count)
+        self.fields, position = column(view, position, 'B', count)
+        self.flags, position = column(view, position, 'B', count)
+        position += padding(position, 4)
+        self.first_child, position = column(view, position, 'i', count)
+        self.next_sibling, position = column(view, position, 'i', count)
+        self.values, position = column(view, position, 'i', count)
+        self.offsets, position = column(view, position, 'i', count)
+        position += padding(position, 8)
+        self.ints, position = column(view, position, 'q', int_count)
+        self.name_offsets, position = column(view, position, 'I', name_count + 1)
+        self.name_data = view[position:position + names_size]
+        position += names_size + padding(names_size, 4)
+        self.string_offsets, position = column(view, position, 'I', string_count + 1)
+        self.string_data = view[position:position + strings_size]
+        # index -> decoded text, for entries that have been asked for
+        self.names = {}
+        self.strings = {}
+
+    def value(self, index):
+        kind = self.kinds[index]
+        if kind == BOOL:
+            return bool(self.flags[index] & TRUE)
+        if kind == INT:
+            if self.flags[index] & BIG_INT:
+                return int(self.text(self.strings, self.string_offsets, self.string_data, self.values[index]))
+            return self.ints[self.values[index]]
+        if kind == STRING:
+            return self.text(self.strings, self.string_offsets, self.string_data, self.values[index])
+        return self.text(self.names, self.name_offsets, self.name_data, self.values[index])
+
+    @staticmethod
+    def text(decoded, offsets, data, index):
+        text = decoded.get(index)
+        if text is None:
+            text = decoded[index] = str(data[offsets[index]:offsets[index + 1]], "utf-8")
+        return text
+
+    # Lets go of the file. Views and nodes from it can't be used after this
+    def close(self):
+        columns = ('kinds', 'fields', 'flags', 'first_child', 'next_sibling', 'values', 'offsets', 'ints')
+        for name in columns + ('name_offsets', 'string_offsets', 'name_data', 'string_data', 'view'):
+            getattr(self, name).release()
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# The header's values after the version, once it's checked that data is a whole file of this version. The views
+# are let go before anything is raised, so a mapping that fails here can still be closed
+def read_header(data):
+    with memoryview(data) as raw, raw.cast('B') as view:
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError("Not a Brewin AST file")
+        if len(view) < len(MAGIC) + HEADER.size:
+            raise ValueError("Truncated AST file")
+        version, *header = HEADER.unpack_from(view, len(MAGIC))
+        if version != VERSION or header[1] != len(ELEM_TYPES):
+            raise ValueError(f"Unsupported AST file version {version}")
+        # Everything's size is in the header, so a file cut short (or with something after it) is caught here
+        # rather than read as a smaller AST
+        count, _, name_count, names_size, string_count, strings_size, int_count = header
+        size = file_size(count, int_count, name_count, names_size, string_count, strings_size)
+        if len(view) != size:
+            raise ValueError("Truncated AST file" if len(view) < size else "AST file has data past its end")
+    return header
+
+
+# How long a file with these header values is, same layout write_ast writes
+def file_size(count, int_count, name_count, names_size, string_count, strings_size):
+    position = len(MAGIC) + HEADER.size + 3 * count
+    position += padding(position, 4) + 16 * count
+    position += padding(position, 8) + 8 * int_count
+    for entries, size in ((name_count, names_size), (string_count, strings_size)):
+        position += 4 * (entries + 1) + size + padding(size, 4)
+    return position
+
+
+# A column of count items starting at position, and where the next thing starts. On big-endian machines the
+# column is copied and swapped instead of viewed
+def column(view, position, typecode, count):
+    size = array(typecode).itemsize
+    data = view[position:position + size * count]
+    if size > 1 and sys.byteorder != "little":
+        swapped = array(typecode, data.tobytes())
+        swapped.byteswap()
+        return memoryview(swapped), position + size * count
+    return data.cast(typecode), position + size * count
+
+
+def little_endian(column):
+    if column.itemsize > 1 and sys.byteorder != "little":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+# Bytes needed after position to get to a multiple of alignment
+def padding(position, alignment):
+    return -position % alignment
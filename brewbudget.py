@@ -0,0 +1,111 @@
+"""
+Step and time budgets for running Brewin programs.
+
+Interpreter(max_steps=..., deadline=...) gives every run a Budget. A step is one
+statement or expression node, but engines don't count them one by one: each loop
+iteration and each function call charges the number of nodes its condition and
+body hold, worked out once per node by Budget.cost. Every program that runs
+forever has to go around some loop or keep calling something, so charging there
+is enough to stop it, and all engines charge at the same points so a program
+stops at the same place whichever one runs it.
+
+The deadline is a time.monotonic() timestamp. Reading the clock on every charge
+would cost more than the charge itself, so steps are handed out in chunks of
+CLOCK_INTERVAL and the clock is only read when a chunk runs out. Engines do
+`budget.steps_left -= cost` and only call into the Budget once it goes negative.
+Running out raises BudgetExceeded, which isn't a Brewin error, so it's never
+mistaken for one the program itself caused.
+"""
+
+import time
+
+from intbase import InterpreterBase
+
+# Steps between looks at the clock when there's a deadline
+CLOCK_INTERVAL = 10000
+
+# Nodes whose insides are charged on their own, when the loop goes around or the lambda is called
+SEPARATELY_CHARGED = (InterpreterBase.WHILE_NODE, InterpreterBase.FUNC_NODE)
+
+
+# Raised when a program goes past its max_steps or its deadline
+class BudgetExceeded(Exception):
+    def __init__(self, reason, steps):
+        super().__init__(f"Program stopped: {reason} after {steps} steps")
+        # "max_steps" or "deadline"
+        self.reason = reason
+        self.steps = steps
+
+
+class Budget:
+    __slots__ = ('max_steps', 'deadline', 'steps_left', 'remaining', 'handed_out', 'costs')
+
+    def __init__(self, max_steps=None, deadline=None):
+        self.max_steps = max_steps
+        self.deadline = deadline
+        # node -> steps one trip through it charges
+        self.costs = {}
+        self.reset()
+
+    # Every run starts with the whole budget
+    def reset(self):
+        self.remaining = self.max_steps if self.max_steps is not None else float('inf')
+        # Steps given to chunks so far
+        self.handed_out = 0
+        # Steps left in the current chunk, what engines count down
+        self.steps_left = 0
+        self.next_chunk()
+
+    def next_chunk(self):
+        chunk = min(self.remaining, CLOCK_INTERVAL)
+        self.remaining -= chunk
+        self.handed_out += chunk
+        self.steps_left += chunk
+
+    # Steps run so far this run
+    def used(self):
+        return self.handed_out - self.steps_left
+
+    def charge(self, steps):
+        self.steps_left -= steps
+        if self.steps_left < 0:
+            self.refill()
+
+    # The current chunk ran out: stop if that was the last of the steps or the deadline's passed,
+    # otherwise start the next chunk, which pays back what was overspent first
+    def refill(self):
+        while self.steps_left < 0:
+            if self.remaining + self.steps_left < 0:
+                raise BudgetExceeded("max_steps", self.used())
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                raise BudgetExceeded("deadline", self.used())
+            self.next_chunk()
+
+    # Steps a loop iteration (condition and body) or a call (body) charges, at least one
+    def cost(self, node):
+        cost = self.costs.get(node)
+        if cost is None:
+            if node.elem_type == InterpreterBase.WHILE_NODE:
+                roots = [node.get('condition'), *(node.get('statements') or [])]
+            else:
+                roots = list(node.get('statements') or [])
+            cost = self.costs[node] = max(1, count_nodes(roots))
+        return cost
+
+
+# Statement and expression nodes under some roots, with nested loops and lambdas counted as one
+# node each. Uses a stack so deeply nested expressions don't recurse
+def count_nodes(roots):
+    count = 0
+    stack = [root for root in roots if root is not None]
+    while stack:
+        node = stack.pop()
+        count += 1
+        if node.elem_type in SEPARATELY_CHARGED:
+            continue
+        for value in node.dict.values():
+            if isinstance(value, list):
+                stack.extend(item for item in value if hasattr(item, 'elem_type'))
+            elif hasattr(value, 'elem_type'):
+                stack.append(value)
+    return count
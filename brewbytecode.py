@@ -0,0 +1,753 @@
+"""
+Stack-based bytecode backend for Brewin.
+
+BytecodeCompiler flattens the AST from parse_program into one instruction stream
+(a flat list of ints, every instruction is an opcode followed by one operand) plus
+a constant pool, with variables living in the frame slots picked by the resolver.
+BytecodeVM runs that stream in a single dispatch loop, so there are no Element.get
+lookups or recursive evaluate_expression calls at run time.
+
+Every function's code is in the same stream. CALL and RETURN switch frames with an
+explicit call stack inside the loop, so Brewin calls don't nest Python calls, and
+frames from finished calls are kept in a per-function pool for the next call.
+Lambda bodies are compiled after the named functions, and MAKE_CLOSURE only
+packs up the cells the lambda captures from the current frame.
+
+Once everything is compiled, a peephole pass fuses the instruction sequences that
+come up most in real programs (brewsuper.py mines them from v1/tests) into
+superinstructions, so `x = x + 1`, `x = 5`, `print(x)` and a loop's `i < 10` check
+are one dispatch each instead of three or four. Sequences are never fused across a
+jump target, and the pass counts what it fused for the program's fusion report.
+"""
+
+from intbase import InterpreterBase, ErrorType
+from brewresolve import resolve_program
+from brewprofile import find_frame
+from brewobjects import BrewinObject, FieldCache, FunctionValue, Cell, cell_getter, check_callable
+from brewops import (
+    BINARY_OPERATORS,
+    ARITHMETIC_OPERATORS,
+    INT_COMPARISON_OPERATORS,
+    evaluate_binary,
+    evaluate_unary,
+    convert,
+    to_string,
+    check_condition,
+)
+
+# Opcodes. The VM's dispatch loop checks them in roughly this order, so the common ones come first
+LOAD_VAR = 0        # push frame[arg]
+LOAD_CONST = 1      # push consts[arg]
+STORE_VAR = 2       # pop into frame[arg]
+JUMP_IF_FALSE = 3   # pop a condition (must be a bool), jump to arg if it's false
+JUMP = 4            # jump to arg
+ADD = 5             # ADD through GREATER_EQ pop two ints and push the result
+SUBTRACT = 6
+MULTIPLY = 7
+DIVIDE = 8
+LESS = 9
+LESS_EQ = 10
+GREATER = 11
+GREATER_EQ = 12
+BINARY = 13         # any other binary operator, consts[arg] is the operator
+NEGATE = 14
+NOT = 15
+CONVERT = 16        # consts[arg] is the type to convert to
+PRINT = 17          # pop arg values, print them joined
+DEFINE_VAR = 18     # frame[arg] = None
+INPUTI = 19         # arg is 1 if a prompt is on the stack, pushes the int read
+POP = 20
+FAIL = 21           # raise the (error type, description) stored in consts[arg]
+HALT = 22
+CALL = 23           # call functions[arg], its arguments are on the stack
+RETURN = 24         # back to the caller, leaving the value on top of the stack
+NEW_OBJECT = 25     # push a new empty object
+GET_FIELD = 26      # pop an object, push one of its fields, consts[arg] is the FieldCache for this site
+SET_FIELD = 27      # pop an object, then set a field to the value under it through the FieldCache in consts[arg]
+CHECK_CALL = 28     # the function on top of the stack has to take arg parameters
+CALL_VALUE = 29     # call the function under the arg arguments on the stack
+LOAD_CELL = 30      # push the value in the cell in frame[arg]
+STORE_CELL = 31     # pop into the cell in frame[arg]
+MAKE_CELL = 32      # frame[arg] = a cell holding frame[arg]
+MAKE_CLOSURE = 33   # consts[arg] is (function, slots, cell getter), push the function with the cells in those slots
+
+# Superinstructions, only ever made by the fusion pass. Their operands are a tuple in consts[arg]
+STORE_CONST = 34        # frame[x] = value, operands (x, value). LOAD_CONST STORE_VAR, with a DEFINE_VAR of x before it or not
+ARITH_VAR_CONST = 35    # frame[y] = frame[x] <op> value for + - *, operands (x, value, y, op, function)
+COMPARE_JUMP = 36       # jump to target unless frame[x] <op> value for < <= > >=, operands (x, value, target, op, function)
+PRINT_VAR = 37          # print frame[arg]
+RETURN_CONST = 38       # return consts[arg]
+
+# Only emitted when the interpreter has a step budget, at the top of every function and loop body
+CHARGE = 39         # take arg steps off the budget
+# Only emitted with stats on, at the start of every statement, expression and function. Last in the
+# dispatch loop, so the other opcodes don't check for it
+COUNT = 40          # consts[arg] is (counter, key), add one to counter[key]
+# Only emitted with trace_output on, and after COUNT in the dispatch loop for the same reason
+TRACE = 41          # record the statement in consts[arg] in the trace
+TRACE_WRITE = 42    # record the assignment in consts[arg] with the value on top of the stack
+
+OPCODE_NAMES = {
+    LOAD_VAR: "LOAD_VAR",
+    LOAD_CONST: "LOAD_CONST",
+    STORE_VAR: "STORE_VAR",
+    JUMP_IF_FALSE: "JUMP_IF_FALSE",
+    JUMP: "JUMP",
+    ADD: "ADD",
+    SUBTRACT: "SUBTRACT",
+    MULTIPLY: "MULTIPLY",
+    DIVIDE: "DIVIDE",
+    LESS: "LESS",
+    LESS_EQ: "LESS_EQ",
+    GREATER: "GREATER",
+    GREATER_EQ: "GREATER_EQ",
+    BINARY: "BINARY",
+    NEGATE: "NEGATE",
+    NOT: "NOT",
+    CONVERT: "CONVERT",
+    PRINT: "PRINT",
+    DEFINE_VAR: "DEFINE_VAR",
+    INPUTI: "INPUTI",
+    POP: "POP",
+    FAIL: "FAIL",
+    HALT: "HALT",
+    CALL: "CALL",
+    RETURN: "RETURN",
+    NEW_OBJECT: "NEW_OBJECT",
+    GET_FIELD: "GET_FIELD",
+    SET_FIELD: "SET_FIELD",
+    CHECK_CALL: "CHECK_CALL",
+    CALL_VALUE: "CALL_VALUE",
+    LOAD_CELL: "LOAD_CELL",
+    STORE_CELL: "STORE_CELL",
+    MAKE_CELL: "MAKE_CELL",
+    MAKE_CLOSURE: "MAKE_CLOSURE",
+    STORE_CONST: "STORE_CONST",
+    ARITH_VAR_CONST: "ARITH_VAR_CONST",
+    COMPARE_JUMP: "COMPARE_JUMP",
+    PRINT_VAR: "PRINT_VAR",
+    RETURN_CONST: "RETURN_CONST",
+    CHARGE: "CHARGE",
+    COUNT: "COUNT",
+    TRACE: "TRACE",
+    TRACE_WRITE: "TRACE_WRITE",
+}
+
+# Superinstructions whose operands are a tuple, the ones that show the first three in a listing
+TUPLE_OPERAND_OPCODES = (STORE_CONST, ARITH_VAR_CONST, COMPARE_JUMP)
+
+# Operators with their own int-only opcode, everything else goes through BINARY
+INT_OPCODES = {
+    '+': ADD,
+    '-': SUBTRACT,
+    '*': MULTIPLY,
+    '/': DIVIDE,
+    '<': LESS,
+    '<=': LESS_EQ,
+    '>': GREATER,
+    '>=': GREATER_EQ,
+}
+INT_OPCODE_OPERATORS = {opcode: op for op, opcode in INT_OPCODES.items()}
+
+# Literal nodes, nil has no 'val' so it loads None
+VALUE_NODES = (InterpreterBase.INT_NODE, InterpreterBase.STRING_NODE, InterpreterBase.BOOL_NODE, InterpreterBase.NIL_NODE)
+
+
+class BytecodeFunction:
+    def __init__(self, name, arity, frame_size):
+        self.name = name
+        self.arity = arity
+        self.frame_size = frame_size
+        # Where its code starts, filled in once it's compiled
+        self.entry = 0
+        # Frames from calls that have finished
+        self.pool = []
+        # What it is when used as a value
+        self.value = FunctionValue(name, arity, self)
+
+
+class BytecodeProgram:
+    def __init__(self, vm, code, consts, functions, fusions, positions):
+        self.vm = vm
+        self.code = code
+        self.consts = consts
+        self.functions = functions
+        # The statement each instruction came from (None for the call to main), by instruction index
+        self.positions = positions
+        # superinstruction name -> how many times the fusion pass made one
+        self.fusions = fusions
+
+    # Runs the program, starting at the top of the stream (which calls main)
+    def __call__(self):
+        self.vm.execute(self)
+
+    # Human readable listing, one instruction per line
+    def disassemble(self):
+        entries = {function.entry: function for function in self.functions}
+        lines = []
+        for pc in range(0, len(self.code), 2):
+            if pc in entries:
+                lines.append(f"{entries[pc].name}/{entries[pc].arity}:")
+            op, arg = self.code[pc], self.code[pc + 1]
+            if op in (GET_FIELD, SET_FIELD):
+                detail = f"{arg} ({self.consts[arg].name})"
+            elif op in (LOAD_CONST, BINARY, CONVERT, FAIL):
+                detail = f"{arg} ({self.consts[arg]!r})"
+            elif op == CALL:
+                detail = f"{arg} ({self.functions[arg].name}/{self.functions[arg].arity})"
+            elif op == MAKE_CLOSURE:
+                function, slots, _ = self.consts[arg]
+                detail = f"{arg} ({function.name}/{function.arity} {slots})"
+            elif op in TUPLE_OPERAND_OPCODES:
+                detail = f"{arg} {self.consts[arg][:3]!r}"
+            elif op == RETURN_CONST:
+                detail = f"{arg} ({self.consts[arg]!r})"
+            else:
+                detail = str(arg)
+            lines.append(f"{pc:4} {OPCODE_NAMES[op]:<12} {detail}")
+        return "\n".join(lines)
+
+    # Which fusions fired and how often, one superinstruction per line
+    def fusion_report(self):
+        if not self.fusions:
+            return "no superinstructions"
+        return "\n".join(f"{name:<16} {count}" for name, count in sorted(self.fusions.items(), key=lambda item: -item[1]))
+
+
+class BytecodeCompiler:
+    def __init__(self, interpreter, superinstructions=True):
+        self.interpreter = interpreter
+        # brewsuper.py turns this off to see the sequences before they're fused
+        self.superinstructions = superinstructions
+        self.code = []
+        self.consts = []
+        self.const_index = {}
+        self.fusions = {}
+        self.positions = []
+        # Statement being compiled, what emit() records for each instruction
+        self.statement = None
+
+    # Program Node
+    def compile_program(self, ast):
+        self.resolution = resolve_program(ast, self.interpreter.error)
+        # Function table, indexes into it are what CALL instructions carry
+        self.functions = []
+        self.function_index = {}
+        self.function_index_by_node = {}
+        for key, func in self.resolution.functions.items():
+            self.function_index_by_node[func] = len(self.functions)
+            self.function_index[key] = len(self.functions)
+            self.functions.append(BytecodeFunction(key[0], key[1], self.resolution.frame_size(func)))
+
+        # Same rules as Interpreter.get_main_func_node
+        if ('main', 0) in self.function_index:
+            self.emit(CALL, self.function_index[('main', 0)])
+            self.emit(POP)
+        else:
+            self.emit_fail(ErrorType.NAME_ERROR, "No main() function was found")
+        self.emit(HALT)
+
+        # Lambdas found along the way are compiled once the function they're in is done
+        self.lambdas = []
+        for key, func in self.resolution.functions.items():
+            self.compile_func(self.functions[self.function_index[key]], func)
+        while self.lambdas:
+            self.compile_func(*self.lambdas.pop())
+        if self.superinstructions:
+            self.fuse_superinstructions()
+        self.program = BytecodeProgram(
+            BytecodeVM(self.interpreter), self.code, self.consts, self.functions, self.fusions, self.positions
+        )
+        return self.program
+
+    # For the profiler: the statement of the instruction the VM in a frame stack is running
+    def locate_statement(self, frame):
+        frame = find_frame(frame, BytecodeVM.execute.__code__)
+        if frame is None:
+            return None
+        return self.program.positions[frame.f_locals['ip'] // 2]
+
+    # Function Definition Node, falling off the end returns nil
+    def compile_func(self, function, func_node):
+        function.entry = len(self.code)
+        self.emit_charge(func_node)
+        self.emit_count('calls', func_node)
+        # Parameters a lambda captures go in cells first thing
+        for slot in self.resolution.cell_params[func_node]:
+            self.emit(MAKE_CELL, slot)
+        self.compile_statements(func_node.get('statements'))
+        self.emit(LOAD_CONST, self.add_const(None))
+        self.emit(RETURN)
+
+    # Emitting helpers
+    def emit(self, op, arg=0):
+        self.code.append(op)
+        self.code.append(arg)
+        self.positions.append(self.statement)
+
+    def add_const(self, value):
+        # Pool by type too, so 1 and True never end up sharing a slot
+        key = (type(value), value)
+        if key not in self.const_index:
+            self.const_index[key] = len(self.consts)
+            self.consts.append(value)
+        return self.const_index[key]
+
+    # Steps a function call or loop iteration takes off the budget, if there is one
+    def emit_charge(self, node):
+        budget = self.interpreter.budget
+        if budget is not None:
+            self.emit(CHARGE, budget.cost(node))
+
+    # One more run of a node (or call of a function) for the interpreter's counters, if it has them
+    def emit_count(self, counter, node):
+        counts = self.interpreter.counts
+        if counts is not None:
+            self.emit(COUNT, self.add_operands((getattr(counts, counter), node)))
+
+    # A trace record for a statement (TRACE) or the value an assignment stores (TRACE_WRITE), if
+    # the interpreter is tracing
+    def emit_trace(self, op, node):
+        if self.interpreter.trace is not None:
+            self.emit(op, self.add_const(node))
+
+    # Errors the tree walker only raises when it reaches the node
+    def emit_fail(self, error_type, description):
+        self.emit(FAIL, self.add_const((error_type, description)))
+
+    # Operand tuples for superinstructions aren't pooled, since (0, 1) and (0, True) compare equal
+    def add_operands(self, operands):
+        self.consts.append(operands)
+        return len(self.consts) - 1
+
+    # Peephole pass over the whole stream. Rewrites it with superinstructions, then moves every jump
+    # target and function entry to where its instruction ended up
+    def fuse_superinstructions(self):
+        instructions = [(self.code[pc], self.code[pc + 1]) for pc in range(0, len(self.code), 2)]
+        # Anything a jump or call can land on has to stay the start of an instruction
+        targets = {arg // 2 for op, arg in instructions if op == JUMP or op == JUMP_IF_FALSE}
+        targets.update(function.entry // 2 for function in self.functions)
+
+        positions = self.positions
+        fused = []
+        # old instruction index -> new one, with an extra entry for the end of the stream
+        new_index = []
+        i = 0
+        while i < len(instructions):
+            length, instruction = self.match_superinstruction(instructions, i, targets)
+            new_index.extend([len(fused)] * length)
+            fused.append(instruction)
+            if length > 1:
+                name = OPCODE_NAMES[instruction[0]]
+                self.fusions[name] = self.fusions.get(name, 0) + 1
+            i += length
+        new_index.append(len(fused))
+
+        self.code = []
+        self.positions = []
+        for op, arg in fused:
+            if op == JUMP or op == JUMP_IF_FALSE:
+                arg = new_index[arg // 2] * 2
+            elif op == COMPARE_JUMP:
+                x, value, target, op_name, function = self.consts[arg]
+                self.consts[arg] = (x, value, new_index[target // 2] * 2, op_name, function)
+            self.code.append(op)
+            self.code.append(arg)
+        # A fused instruction is where the first one it replaced was
+        for old, new in enumerate(new_index[:-1]):
+            if len(self.positions) == new:
+                self.positions.append(positions[old])
+        for function in self.functions:
+            function.entry = new_index[function.entry // 2] * 2
+
+    # Returns (instructions used, the instruction to emit) for the sequence starting at index i
+    def match_superinstruction(self, instructions, i, targets):
+        def ops(length):
+            if i + length > len(instructions) or any(j in targets for j in range(i + 1, i + length)):
+                return None
+            return instructions[i:i + length]
+
+        window = ops(3)
+        # var x; x = <const>
+        if window and window[0][0] == DEFINE_VAR and window[1][0] == LOAD_CONST and window[2] == (STORE_VAR, window[0][1]):
+            return 3, (STORE_CONST, self.add_operands((window[0][1], self.consts[window[1][1]])))
+        window = ops(4)
+        if window and window[0][0] == LOAD_VAR and window[1][0] == LOAD_CONST:
+            op = window[2][0]
+            # x = y + <const>, including x = x + 1
+            if op in (ADD, SUBTRACT, MULTIPLY) and window[3][0] == STORE_VAR:
+                op_name = INT_OPCODE_OPERATORS[op]
+                operands = (window[0][1], self.consts[window[1][1]], window[3][1], op_name, ARITHMETIC_OPERATORS[op_name])
+                return 4, (ARITH_VAR_CONST, self.add_operands(operands))
+            # while (i < <const>), if (x >= <const>), ...
+            if LESS <= op <= GREATER_EQ and window[3][0] == JUMP_IF_FALSE:
+                op_name = INT_OPCODE_OPERATORS[op]
+                operands = (window[0][1], self.consts[window[1][1]], window[3][1], op_name, INT_COMPARISON_OPERATORS[op_name])
+                return 4, (COMPARE_JUMP, self.add_operands(operands))
+        window = ops(2)
+        if window:
+            (first, first_arg), (second, second_arg) = window
+            # x = <const>
+            if first == LOAD_CONST and second == STORE_VAR:
+                return 2, (STORE_CONST, self.add_operands((second_arg, self.consts[first_arg])))
+            # print(x)
+            if first == LOAD_VAR and second == PRINT and second_arg == 1:
+                return 2, (PRINT_VAR, first_arg)
+            # return <const>, and the return nil at the end of every function
+            if first == LOAD_CONST and second == RETURN:
+                return 2, (RETURN_CONST, first_arg)
+        return 1, instructions[i]
+
+    # Statement Nodes
+    def compile_statement(self, statement_node):
+        outer_statement = self.statement
+        self.statement = statement_node
+        self.emit_count('nodes', statement_node)
+        self.emit_trace(TRACE, statement_node)
+        kind = statement_node.elem_type
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            self.emit(DEFINE_VAR, self.resolution.slot(statement_node))
+            if self.resolution.in_cell(statement_node):
+                self.emit(MAKE_CELL, self.resolution.slot(statement_node))
+        elif kind == InterpreterBase.ASSIGNMENT_NODE:
+            self.compile_expression(statement_node.get('expression'))
+            self.emit_trace(TRACE_WRITE, statement_node)
+            field_names = self.resolution.path(statement_node)[1]
+            in_cell = self.resolution.in_cell(statement_node)
+            if field_names:
+                # a.b.c = ..., the object is a.b and the field is c
+                self.emit(LOAD_CELL if in_cell else LOAD_VAR, self.resolution.slot(statement_node))
+                for name in field_names[:-1]:
+                    self.emit(GET_FIELD, self.add_const(FieldCache(name)))
+                self.emit(SET_FIELD, self.add_const(FieldCache(field_names[-1])))
+            else:
+                self.emit(STORE_CELL if in_cell else STORE_VAR, self.resolution.slot(statement_node))
+        elif kind == InterpreterBase.FCALL_NODE:
+            self.compile_func_call_statement(statement_node)
+        elif kind == InterpreterBase.IF_NODE:
+            self.compile_if(statement_node)
+        elif kind == InterpreterBase.WHILE_NODE:
+            self.compile_while(statement_node)
+        elif kind == InterpreterBase.RETURN_NODE:
+            if statement_node.get('expression') is not None:
+                self.compile_expression(statement_node.get('expression'))
+            else:
+                self.emit(LOAD_CONST, self.add_const(None))
+            self.emit(RETURN)
+        else:
+            self.emit_fail(ErrorType.TYPE_ERROR, f"Unknown statement type: {kind}")
+        self.statement = outer_statement
+
+    def compile_statements(self, statements):
+        for statement_node in statements or []:
+            self.compile_statement(statement_node)
+
+    # Emits a jump whose target isn't known yet, returns where to patch it
+    def emit_jump(self, op):
+        self.emit(op)
+        return len(self.code) - 1
+
+    def patch_jump(self, operand_index):
+        self.code[operand_index] = len(self.code)
+
+    # If Statement
+    def compile_if(self, statement_node):
+        self.compile_expression(statement_node.get('condition'))
+        to_else = self.emit_jump(JUMP_IF_FALSE)
+        self.compile_statements(statement_node.get('statements'))
+        if statement_node.get('else_statements') is None:
+            self.patch_jump(to_else)
+            return
+        to_end = self.emit_jump(JUMP)
+        self.patch_jump(to_else)
+        self.compile_statements(statement_node.get('else_statements'))
+        self.patch_jump(to_end)
+
+    # While Statement
+    def compile_while(self, statement_node):
+        loop_start = len(self.code)
+        self.compile_expression(statement_node.get('condition'))
+        to_end = self.emit_jump(JUMP_IF_FALSE)
+        self.emit_charge(statement_node)
+        self.compile_statements(statement_node.get('statements'))
+        self.emit(JUMP, loop_start)
+        self.patch_jump(to_end)
+
+    # Function Call Statement
+    def compile_func_call_statement(self, statement_node):
+        func_name = statement_node.get('name')
+        args = statement_node.get('args') or []
+        if func_name == 'print':
+            for arg in args:
+                self.compile_expression(arg)
+            self.emit(PRINT, len(args))
+        elif func_name == 'inputi':
+            if self.compile_inputi(args):
+                self.emit(POP)
+        elif self.compile_user_call(statement_node):
+            self.emit(POP)
+
+    # Calls to user functions, returns whether a value gets pushed
+    def compile_user_call(self, call_node):
+        func_name = call_node.get('name')
+        args = call_node.get('args') or []
+        if self.resolution.is_value_call(call_node):
+            # f(...) where f is a variable, or obj.method(...). The function is found and checked first
+            self.compile_variable(call_node)
+            self.emit(CHECK_CALL, len(args))
+            for arg in args:
+                self.compile_expression(arg)
+            self.emit(CALL_VALUE, len(args))
+            return True
+        index = self.function_index.get((func_name, len(args)))
+        if index is None:
+            self.emit_fail(ErrorType.NAME_ERROR, f"Function {func_name} undefined")
+            return False
+        for arg in args:
+            self.compile_expression(arg)
+        self.emit(CALL, index)
+        return True
+
+    # Variable Expression. a.b.c pushes a and then reads each field through its own inline cache
+    def compile_variable(self, node):
+        func_node = self.resolution.function_refs.get(node)
+        if func_node is not None:
+            # A function's name used as a value
+            self.emit(LOAD_CONST, self.add_const(self.functions[self.function_index_by_node[func_node]].value))
+            return
+        self.emit(LOAD_CELL if self.resolution.in_cell(node) else LOAD_VAR, self.resolution.slot(node))
+        for name in self.resolution.path(node)[1]:
+            self.emit(GET_FIELD, self.add_const(FieldCache(name)))
+
+    # Handles user input (integer), returns whether a value gets pushed
+    def compile_inputi(self, args):
+        if len(args) > 1:
+            self.emit_fail(ErrorType.NAME_ERROR, "No inputi() function found that takes > 1 parameter")
+            return False
+        for arg in args:
+            self.compile_expression(arg)
+        self.emit(INPUTI, len(args))
+        return True
+
+    # Expression Nodes
+    def compile_expression(self, expression_node):
+        self.emit_count('nodes', expression_node)
+        kind = expression_node.elem_type
+        if kind in VALUE_NODES:
+            self.emit(LOAD_CONST, self.add_const(expression_node.get('val')))
+        elif kind == InterpreterBase.QUALIFIED_NAME_NODE:
+            self.compile_variable(expression_node)
+        elif kind in BINARY_OPERATORS:
+            self.compile_expression(expression_node.get('op1'))
+            self.compile_expression(expression_node.get('op2'))
+            if kind in INT_OPCODES:
+                self.emit(INT_OPCODES[kind])
+            else:
+                self.emit(BINARY, self.add_const(kind))
+        elif kind == InterpreterBase.NEG_NODE or kind == InterpreterBase.NOT_NODE:
+            self.compile_expression(expression_node.get('op1'))
+            self.emit(NEGATE if kind == InterpreterBase.NEG_NODE else NOT)
+        elif kind == InterpreterBase.CONVERT_NODE:
+            self.compile_expression(expression_node.get('expr'))
+            self.emit(CONVERT, self.add_const(expression_node.get('to_type')))
+        elif kind == InterpreterBase.FCALL_NODE and expression_node.get('name') == 'inputi':
+            self.compile_inputi(expression_node.get('args') or [])
+        elif kind == InterpreterBase.FCALL_NODE:
+            self.compile_user_call(expression_node)
+        elif kind == InterpreterBase.EMPTY_OBJ_NODE:
+            self.emit(NEW_OBJECT)
+        elif kind == InterpreterBase.FUNC_NODE:
+            self.compile_lambda(expression_node)
+        elif kind == InterpreterBase.CLOSURE_NODE:
+            func_node = self.resolution.function_refs[expression_node]
+            self.emit(LOAD_CONST, self.add_const(self.functions[self.function_index_by_node[func_node]].value))
+        else:
+            self.emit_fail(ErrorType.TYPE_ERROR, f"Unknown expression type: {kind}")
+
+    # Lambda Expression. The body gets its own function in the table and is compiled later
+    def compile_lambda(self, func_node):
+        function = BytecodeFunction(func_node.get('name'), len(func_node.get('args') or []), self.resolution.frame_size(func_node))
+        self.functions.append(function)
+        self.lambdas.append((function, func_node))
+        slots = tuple(slot for _, slot in self.resolution.captures[func_node])
+        self.emit(MAKE_CLOSURE, self.add_const((function, slots, cell_getter(slots))))
+
+
+class BytecodeVM:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+
+    # The dispatch loop. Everything it touches is bound to a local first
+    def execute(self, program):
+        code = program.code
+        consts = program.consts
+        error = self.interpreter.error
+        output = self.interpreter.output
+        get_input = self.interpreter.get_input
+        budget = self.interpreter.budget
+        record = self.interpreter.trace.records.append if self.interpreter.trace is not None else None
+
+        functions = program.functions
+
+        # The main call happens in the loop too, before it there's no frame or function
+        frame = None
+        function = None
+        # (return pc, caller's frame, caller's function) for every call in progress
+        calls = []
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+        while True:
+            # Where the running instruction is, for the profiler, since jumps and calls move pc before it's done
+            ip = pc
+            op = code[pc]
+            arg = code[pc + 1]
+            pc += 2
+            if op == LOAD_VAR:
+                push(frame[arg])
+            elif op == LOAD_CONST:
+                push(consts[arg])
+            elif op == STORE_VAR:
+                frame[arg] = pop()
+            elif op == JUMP_IF_FALSE:
+                condition = pop()
+                if condition is not True:
+                    if condition is not False:
+                        check_condition(condition, error)
+                    pc = arg
+            elif op == JUMP:
+                pc = arg
+            elif op == ARITH_VAR_CONST:
+                x, b, y, op_name, operation = consts[arg]
+                a = frame[x]
+                if type(a) is not int or type(b) is not int:
+                    evaluate_binary(op_name, a, b, error)
+                frame[y] = operation(a, b)
+            elif op == COMPARE_JUMP:
+                x, b, target, op_name, operation = consts[arg]
+                a = frame[x]
+                if type(a) is not int or type(b) is not int:
+                    evaluate_binary(op_name, a, b, error)
+                if not operation(a, b):
+                    pc = target
+            elif op == STORE_CONST:
+                x, value = consts[arg]
+                frame[x] = value
+            elif op <= GREATER_EQ:
+                b = pop()
+                a = pop()
+                if type(a) is not int or type(b) is not int or (op == DIVIDE and b == 0):
+                    # Raises the right error
+                    evaluate_binary(INT_OPCODE_OPERATORS[op], a, b, error)
+                if op == ADD:
+                    push(a + b)
+                elif op == SUBTRACT:
+                    push(a - b)
+                elif op == MULTIPLY:
+                    push(a * b)
+                elif op == DIVIDE:
+                    push(a / b)
+                elif op == LESS:
+                    push(a < b)
+                elif op == LESS_EQ:
+                    push(a <= b)
+                elif op == GREATER:
+                    push(a > b)
+                else:
+                    push(a >= b)
+            elif op == BINARY:
+                b = pop()
+                push(evaluate_binary(consts[arg], pop(), b, error))
+            elif op == NEGATE:
+                a = pop()
+                push(-a if type(a) is int else evaluate_unary(InterpreterBase.NEG_NODE, a, error))
+            elif op == NOT:
+                a = pop()
+                push(not a if type(a) is bool else evaluate_unary(InterpreterBase.NOT_NODE, a, error))
+            elif op == CALL:
+                callee = functions[arg]
+                pool = callee.pool
+                callee_frame = pool.pop() if pool else [None] * callee.frame_size
+                arity = callee.arity
+                if arity:
+                    callee_frame[:arity] = stack[-arity:]
+                    del stack[-arity:]
+                calls.append((pc, frame, function))
+                frame = callee_frame
+                function = callee
+                pc = callee.entry
+            elif op == RETURN:
+                function.pool.append(frame)
+                pc, frame, function = calls.pop()
+            elif op == RETURN_CONST:
+                push(consts[arg])
+                function.pool.append(frame)
+                pc, frame, function = calls.pop()
+            elif op == PRINT_VAR:
+                output(to_string(frame[arg]))
+            elif op == GET_FIELD:
+                push(consts[arg].get(pop(), error))
+            elif op == SET_FIELD:
+                obj = pop()
+                consts[arg].set(obj, pop(), error)
+            elif op == CHECK_CALL:
+                check_callable(stack[-1], arg, error)
+            elif op == CALL_VALUE:
+                callee = stack[-arg - 1].target
+                pool = callee.pool
+                callee_frame = pool.pop() if pool else [None] * callee.frame_size
+                if arg:
+                    callee_frame[:arg] = stack[-arg:]
+                # A closure's captured cells go right after its parameters
+                cells = stack[-arg - 1].cells
+                if cells:
+                    callee_frame[arg:arg + len(cells)] = cells
+                del stack[-arg - 1:]
+                calls.append((pc, frame, function))
+                frame = callee_frame
+                function = callee
+                pc = callee.entry
+            elif op == NEW_OBJECT:
+                push(BrewinObject())
+            elif op == LOAD_CELL:
+                push(frame[arg].value)
+            elif op == STORE_CELL:
+                frame[arg].value = pop()
+            elif op == MAKE_CELL:
+                frame[arg] = Cell(frame[arg])
+            elif op == MAKE_CLOSURE:
+                callee, _, get_cells = consts[arg]
+                push(FunctionValue(callee.name, callee.arity, callee, get_cells(frame)))
+            elif op == CHARGE:
+                budget.steps_left -= arg
+                if budget.steps_left < 0:
+                    budget.refill()
+            elif op == CONVERT:
+                push(convert(consts[arg], pop(), error))
+            elif op == PRINT:
+                if arg:
+                    values = stack[-arg:]
+                    del stack[-arg:]
+                    output(''.join([to_string(value) for value in values]))
+                else:
+                    output('')
+            elif op == DEFINE_VAR:
+                frame[arg] = None
+            elif op == INPUTI:
+                if arg:
+                    output(to_string(pop()))
+                push(int(get_input()))
+            elif op == POP:
+                pop()
+            elif op == FAIL:
+                error(*consts[arg])
+            elif op == HALT:
+                return
+            elif op == COUNT:
+                counter, key = consts[arg]
+                counter[key] += 1
+            elif op == TRACE:
+                record(consts[arg])
+            elif op == TRACE_WRITE:
+                record((consts[arg], stack[-1]))
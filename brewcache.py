@@ -0,0 +1,188 @@
+"""
+Caches of parsed programs, on disk and in memory.
+
+parse_program(program, cache_dir=...) looks the program up in a ParseCache
+before parsing it and stores what it parsed afterwards, so running the same
+source again (in this process or any other using the same directory) loads the
+AST instead of lexing and parsing it. Entries are brewastfile.py files named by
+the SHA-256 of the grammar signature and the source, so a change to the grammar
+just means new names, and the source positions are saved with the AST.
+
+Several processes can share a directory. An entry is written to a temporary
+file in the directory and renamed into place, so a reader sees all of an entry
+or none of it, and two processes storing the same program just replace one
+identical file with another. Reading a hit bumps its modification time, and
+after every store the least recently used entries are deleted until the
+directory is under max_bytes. A file that's gone by the time it's opened, or
+that can't be read, is a miss. The cache is only ever a shortcut, so a directory
+that can't be made or written to, or a full disk, just means nothing is stored:
+the program still gets parsed, it just isn't kept.
+
+ProgramCache is the in-memory one, an LRU the interpreter keeps parsed programs
+in for every Interpreter in the process and compiled programs in for each one
+(see interpreterv1.py). It's bounded by a number of entries and by a total
+size, which the caller gives for each entry (nodes, for ASTs), and counts its
+hits, misses and evictions. A lock covers every lookup and store, so threads
+running programs with their own Interpreters can share it.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from brewastfile import write_ast, load_ast
+
+# Bytes of entries a cache directory keeps by default
+CACHE_SIZE = 64 * 1024 * 1024
+ENTRY_SUFFIX = ".ast"
+TEMP_SUFFIX = ".tmp"
+# Temporary files older than this (seconds) were left by a writer that died, and get cleaned up
+STALE_TEMP_AGE = 3600
+
+
+class ParseCache:
+    def __init__(self, directory, signature, max_bytes=CACHE_SIZE):
+        self.directory = directory
+        self.signature = signature
+        self.max_bytes = max_bytes
+        # If it can't be made, storing fails too and every program is parsed like there was no cache
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            pass
+
+    def path(self, program):
+        digest = hashlib.sha256(self.signature.encode("utf-8"))
+        digest.update(program.encode("utf-8"))
+        return os.path.join(self.directory, digest.hexdigest() + ENTRY_SUFFIX)
+
+    # The cached AST of a program, or None. Its source positions go in positions if it's given
+    def load(self, program, positions=None):
+        path = self.path(program)
+        try:
+            with load_ast(path) as ast:
+                root = ast.to_element(positions)
+        # Missing, half deleted or not a file we can read, it's a miss either way and storing the
+        # program again replaces it. Offsets of nodes built before it failed are dropped, since those nodes are
+        # gone and their ids can come back
+        except Exception:  # pylint: disable=broad-except
+            if positions is not None:
+                positions.offsets.clear()
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return root
+
+    # Whether the program was stored. Failing to write it (no space, no permission) leaves the cache as it was
+    def store(self, program, ast, positions=None):
+        try:
+            handle, temp_path = tempfile.mkstemp(suffix=TEMP_SUFFIX, dir=self.directory)
+        except OSError:
+            return False
+        try:
+            with os.fdopen(handle, "wb") as stream:
+                write_ast(ast, stream, positions)
+            os.replace(temp_path, self.path(program))
+        except OSError:
+            remove(temp_path)
+            return False
+        except BaseException:
+            remove(temp_path)
+            raise
+        self.evict()
+        return True
+
+    # Deletes the least recently used entries until the directory is under max_bytes
+    def evict(self):
+        entries = []
+        total = 0
+        now = time.time()
+        try:
+            listing = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in listing:
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if entry.name.endswith(TEMP_SUFFIX):
+                if now - stat.st_mtime > STALE_TEMP_AGE:
+                    remove(entry.path)
+            elif entry.name.endswith(ENTRY_SUFFIX):
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            remove(path)
+            total -= size
+
+
+class ProgramCache:
+    def __init__(self, max_entries, max_size):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        # key -> (value, size), least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    # The value stored for key, or None
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    # Stores a value, then evicts the least recently used entries until the cache is within its limits.
+    # A value bigger than max_size on its own isn't kept at all
+    def put(self, key, value, size):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            if size > self.max_size:
+                return
+            self.entries[key] = (value, size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_size:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+# Another process may have deleted it already
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
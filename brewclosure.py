@@ -0,0 +1,693 @@
+"""
+Closure-compiling execution engine for Brewin.
+
+The AST is walked exactly once, at compile time, and every node is turned into a
+small Python closure that already knows what kind of node it came from. Running
+the program afterwards is just calling the closure built for main(), so none of
+the elem_type comparisons in the tree walker are repeated per execution.
+
+Statement closures return True once a return statement has run (its value is left
+in the frame's last slot) and None otherwise. Every function keeps a pool of
+frames from finished calls, so a call only allocates a frame when all the ones
+in its pool are in use further up the call stack. Lambdas are compiled like any
+other function, and evaluating one only makes a FunctionValue holding the cells
+of the variables it captured. When the profiler is on, each statement closure gets
+a copy of its code object of its own, and the profiler looks the statement up by
+the code of the frames it samples. Nothing in a closure's frame says which node it
+was made for, but this way nothing extra runs either.
+"""
+
+from intbase import InterpreterBase, ErrorType
+from brewresolve import resolve_program
+from brewobjects import BrewinObject, FieldCache, FunctionValue, Cell, cell_getter, get_cached_path, check_callable
+from brewops import (
+    INT_COMPARISON_OPERATORS,
+    EQUALITY_OPERATORS,
+    LOGICAL_OPERATORS,
+    UNARY_OPERATORS,
+    evaluate_binary,
+    evaluate_unary,
+    convert,
+    to_string,
+    check_condition,
+)
+
+
+# Literal nodes, nil has no 'val' so it compiles to None
+VALUE_NODES = (InterpreterBase.INT_NODE, InterpreterBase.STRING_NODE, InterpreterBase.BOOL_NODE, InterpreterBase.NIL_NODE)
+
+
+class ClosureCompiler:
+    def __init__(self, interpreter):
+        # Errors, output and input all go through the interpreter so behavior matches the tree walker
+        self.interpreter = interpreter
+        # What compiled code reports errors through, set per statement so errors carry its line
+        self.error = interpreter.error
+        # id of a statement closure's own code object -> its statement, only filled in when profiling. The
+        # closures keep their code objects alive as long as the compiled program is around
+        self.statement_codes = {}
+
+    # Program Node
+    def compile_program(self, ast):
+        # Returns a callable that runs the whole program
+        # Name errors come out of the resolver here, before anything runs
+        self.resolution = resolve_program(ast, self.interpreter.error)
+        # Every function gets its entry before any body is compiled, so calls can point at functions defined later
+        self.functions = {
+            key: CompiledFunction(func, self.resolution.frame_size(func)) for key, func in self.resolution.functions.items()
+        }
+        self.functions_by_node = {function.func_node: function for function in self.functions.values()}
+        for function in self.functions.values():
+            self.compile_func(function)
+        main_call = self.compile_main()
+
+        def run_program():
+            main_call(None)
+
+        return run_program
+
+    # Function Definition Node. Parameters a lambda captures are put in cells before the body runs
+    def compile_func(self, function):
+        body = self.compile_statements(function.func_node.get('statements'))
+        budget = self.interpreter.budget
+        if budget is not None:
+            body = self.charged(body, budget, budget.cost(function.func_node))
+        if self.interpreter.counts is not None:
+            body = counted(body, self.interpreter.counts.calls, function.func_node)
+        cell_params = self.resolution.cell_params[function.func_node]
+        if not cell_params:
+            function.body = body
+            return
+
+        def run_boxed(frame):
+            for slot in cell_params:
+                frame[slot] = Cell(frame[slot])
+            return body(frame)
+
+        function.body = run_boxed
+
+    # Wraps a body so it charges the budget before running, only used when the interpreter has one
+    def charged(self, body, budget, cost):
+        def run_charged(frame):
+            budget.steps_left -= cost
+            if budget.steps_left < 0:
+                budget.refill()
+            return body(frame)
+
+        return run_charged
+
+    # For the profiler: the statement the innermost statement closure in a frame stack is running
+    def locate_statement(self, frame):
+        statement_codes = self.statement_codes
+        while frame is not None:
+            statement_node = statement_codes.get(id(frame.f_code))
+            if statement_node is not None:
+                return statement_node
+            frame = frame.f_back
+        return None
+
+    # Same rules as Interpreter.get_main_func_node, but the error is raised when the program runs
+    def compile_main(self):
+        if ('main', 0) not in self.functions:
+            return self.fail(ErrorType.NAME_ERROR, "No main() function was found")
+        return self.compile_user_call(self.functions[('main', 0)], ())
+
+    # Builds a closure that reports an error once it's actually reached
+    def fail(self, error_type, description):
+        error = self.error
+
+        def raise_error(frame):
+            error(error_type, description)
+
+        return raise_error
+
+    # Statement Nodes
+    def compile_statements(self, statements):
+        if not statements:
+            return lambda frame: None
+
+        compiled = tuple(self.compile_statement(statement) for statement in statements)
+        if len(compiled) == 1:
+            return compiled[0]
+        # Short bodies (typical for loops) are unrolled so there's no for loop per iteration
+        if len(compiled) == 2:
+            first, second = compiled
+
+            def run_two(frame):
+                return first(frame) or second(frame)
+
+            return run_two
+        if len(compiled) == 3:
+            first, second, third = compiled
+
+            def run_three(frame):
+                return first(frame) or second(frame) or third(frame)
+
+            return run_three
+
+        def run_statements(frame):
+            for statement in compiled:
+                if statement(frame):
+                    return True
+
+        return run_statements
+
+    # The line is looked up here, once, so running the statement costs nothing extra
+    def compile_statement(self, statement_node):
+        outer_error = self.error
+        positions = self.interpreter.positions
+        line = positions.line(statement_node) if positions is not None else None
+        if line is not None:
+            error = self.interpreter.error
+
+            def error_on_line(error_type, description=None):
+                error(error_type, description, line)
+
+            self.error = error_on_line
+        try:
+            run = self.compile_statement_kind(statement_node)
+        finally:
+            self.error = outer_error
+        if self.interpreter.profiler is not None:
+            # Every statement gets a new closure, so giving it its own code object doesn't touch any other
+            run.__code__ = run.__code__.replace()
+            self.statement_codes[id(run.__code__)] = statement_node
+        if self.interpreter.counts is not None:
+            run = counted(run, self.interpreter.counts.nodes, statement_node)
+        if self.interpreter.trace is not None:
+            run = traced(run, self.interpreter.trace.records.append, statement_node)
+        return run
+
+    def compile_statement_kind(self, statement_node):
+        # Dispatch happens here once instead of on every execution
+        kind = statement_node.elem_type
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            return self.compile_definition(statement_node)
+        elif kind == InterpreterBase.ASSIGNMENT_NODE:
+            return self.compile_assignment(statement_node)
+        elif kind == InterpreterBase.FCALL_NODE:
+            return self.compile_func_call_statement(statement_node)
+        elif kind == InterpreterBase.IF_NODE:
+            return self.compile_if(statement_node)
+        elif kind == InterpreterBase.WHILE_NODE:
+            return self.compile_while(statement_node)
+        elif kind == InterpreterBase.RETURN_NODE:
+            return self.compile_return(statement_node)
+        return self.fail(ErrorType.TYPE_ERROR, f"Unknown statement type: {kind}")
+
+    # Variable Definition Statement
+    def compile_definition(self, statement_node):
+        slot = self.resolution.slot(statement_node)
+        if self.resolution.in_cell(statement_node):
+            # A new cell every time, so lambdas made in different loop iterations don't share the variable
+            def define_cell(frame):
+                frame[slot] = Cell()
+
+            return define_cell
+
+        def define(frame):
+            frame[slot] = None
+
+        return define
+
+    # Assignment Statement
+    def compile_assignment(self, statement_node):
+        slot = self.resolution.slot(statement_node)
+        expression = self.compile_expression(statement_node.get('expression'))
+        if self.interpreter.trace is not None:
+            expression = traced_value(expression, self.interpreter.trace.records.append, statement_node)
+        field_names = self.resolution.path(statement_node)[1]
+        if field_names:
+            return self.compile_field_assignment(statement_node, field_names, expression)
+        if self.resolution.in_cell(statement_node):
+            def assign_cell(frame):
+                frame[slot].value = expression(frame)
+
+            return assign_cell
+
+        def assign(frame):
+            frame[slot] = expression(frame)
+
+        return assign
+
+    # a.b.c = ..., sets field c on the object a.b evaluates to. Every field in the name gets its own inline cache
+    def compile_field_assignment(self, statement_node, field_names, expression):
+        slot = self.resolution.slot(statement_node)
+        path = tuple(FieldCache(name) for name in field_names[:-1])
+        cache = FieldCache(field_names[-1])
+        error = self.error
+
+        if self.resolution.in_cell(statement_node):
+            def assign_field_in_cell(frame):
+                value = expression(frame)
+                cache.set(get_cached_path(frame[slot].value, path, error), value, error)
+
+            return assign_field_in_cell
+        if not path:
+            def assign_field(frame):
+                value = expression(frame)
+                cache.set(frame[slot], value, error)
+
+            return assign_field
+
+        def assign_nested_field(frame):
+            value = expression(frame)
+            cache.set(get_cached_path(frame[slot], path, error), value, error)
+
+        return assign_nested_field
+
+    # If Statement. Condition and both bodies are compiled once, up front
+    def compile_if(self, statement_node):
+        condition = self.compile_expression(statement_node.get('condition'))
+        body = self.compile_statements(statement_node.get('statements'))
+        else_body = self.compile_statements(statement_node.get('else_statements'))
+        error = self.error
+
+        def run_if(frame):
+            value = condition(frame)
+            if value is True:
+                return body(frame)
+            elif value is False:
+                return else_body(frame)
+            check_condition(value, error)
+
+        return run_if
+
+    # While Statement. Each iteration is just the condition closure plus the body closure
+    def compile_while(self, statement_node):
+        condition = self.compile_expression(statement_node.get('condition'))
+        body = self.compile_statements(statement_node.get('statements'))
+        error = self.error
+        budget = self.interpreter.budget
+        if budget is not None:
+            body = self.charged(body, budget, budget.cost(statement_node))
+
+        def run_while(frame):
+            while True:
+                value = condition(frame)
+                if value is not True:
+                    if value is not False:
+                        check_condition(value, error)
+                    return None
+                if body(frame):
+                    return True
+
+        return run_while
+
+    # Return Statement, the value goes in the frame's last slot for the call closure to pick up
+    def compile_return(self, statement_node):
+        expression_node = statement_node.get('expression')
+        expression = self.compile_expression(expression_node) if expression_node is not None else lambda frame: None
+
+        def do_return(frame):
+            frame[-1] = expression(frame)
+            return True
+
+        return do_return
+
+    # Function Call Statement
+    def compile_func_call_statement(self, statement_node):
+        func_name = statement_node.get('name')
+        if func_name == 'print':
+            return self.compile_print(statement_node.get('args'))
+        # Anything else gives back a value, which the statement throws away
+        call = self.compile_func_call_expression(statement_node)
+
+        def call_statement(frame):
+            call(frame)
+
+        return call_statement
+
+    # Handles printing
+    def compile_print(self, args):
+        compiled_args = tuple(self.compile_expression(arg) for arg in args or [])
+        output = self.interpreter.output
+
+        def do_print(frame):
+            output(''.join([to_string(arg(frame)) for arg in compiled_args]))
+
+        return do_print
+
+    # Handles user input (integer)
+    def compile_inputi(self, args):
+        args = args or []
+        if len(args) > 1:
+            return self.fail(ErrorType.NAME_ERROR, "No inputi() function found that takes > 1 parameter")
+
+        output = self.interpreter.output
+        get_input = self.interpreter.get_input
+
+        if len(args) == 1:
+            prompt = self.compile_expression(args[0])
+
+            def do_inputi_with_prompt(frame):
+                output(to_string(prompt(frame)))
+                return int(get_input())
+
+            return do_inputi_with_prompt
+
+        def do_inputi(frame):
+            return int(get_input())
+
+        return do_inputi
+
+    # Expression Nodes
+    def compile_expression(self, expression_node):
+        if self.interpreter.counts is not None:
+            return counted(self.compile_expression_kind(expression_node), self.interpreter.counts.nodes, expression_node)
+        return self.compile_expression_kind(expression_node)
+
+    def compile_expression_kind(self, expression_node):
+        kind = expression_node.elem_type
+        if kind in VALUE_NODES:
+            value = expression_node.get('val')
+            return lambda frame: value
+        elif kind == InterpreterBase.QUALIFIED_NAME_NODE:
+            return self.compile_variable(expression_node)
+        elif kind in BINARY_OPERATORS:
+            return self.compile_binary_operator(expression_node)
+        elif kind in UNARY_OPERATORS:
+            return self.compile_unary_operator(expression_node)
+        elif kind == InterpreterBase.CONVERT_NODE:
+            return self.compile_convert(expression_node)
+        elif kind == InterpreterBase.FCALL_NODE:
+            return self.compile_func_call_expression(expression_node)
+        elif kind == InterpreterBase.EMPTY_OBJ_NODE:
+            return lambda frame: BrewinObject()
+        elif kind == InterpreterBase.FUNC_NODE:
+            return self.compile_lambda(expression_node)
+        elif kind == InterpreterBase.CLOSURE_NODE:
+            value = self.functions_by_node[self.resolution.function_refs[expression_node]].value
+            return lambda frame: value
+        return self.fail(ErrorType.TYPE_ERROR, f"Unknown expression type: {kind}")
+
+    # Variable Expression
+    def compile_variable(self, expression_node):
+        # A function's name used as a value
+        func_node = self.resolution.function_refs.get(expression_node)
+        if func_node is not None:
+            value = self.functions_by_node[func_node].value
+            return lambda frame: value
+
+        slot = self.resolution.slot(expression_node)
+        field_names = self.resolution.path(expression_node)[1]
+        if self.resolution.in_cell(expression_node):
+            return self.compile_cell_variable(slot, field_names)
+        if len(field_names) == 1:
+            cache = FieldCache(field_names[0])
+            error = self.error
+
+            def read_field(frame):
+                return cache.get(frame[slot], error)
+
+            return read_field
+        if field_names:
+            caches = tuple(FieldCache(name) for name in field_names)
+            error = self.error
+
+            def read_nested_field(frame):
+                return get_cached_path(frame[slot], caches, error)
+
+            return read_nested_field
+
+        def read_variable(frame):
+            return frame[slot]
+
+        return read_variable
+
+    # A captured variable, its slot holds the cell
+    def compile_cell_variable(self, slot, field_names):
+        if field_names:
+            caches = tuple(FieldCache(name) for name in field_names)
+            error = self.error
+
+            def read_field_in_cell(frame):
+                return get_cached_path(frame[slot].value, caches, error)
+
+            return read_field_in_cell
+
+        def read_cell(frame):
+            return frame[slot].value
+
+        return read_cell
+
+    # Lambda Expression. The body is compiled once as a function of its own, and each time the
+    # expression runs it makes one FunctionValue with the cells it captures from this frame
+    def compile_lambda(self, func_node):
+        function = CompiledFunction(func_node, self.resolution.frame_size(func_node))
+        self.compile_func(function)
+        name = function.value.name
+        arity = function.value.arity
+        slots = tuple(slot for _, slot in self.resolution.captures[func_node])
+        if not slots:
+            return lambda frame: FunctionValue(name, arity, function)
+        get_cells = cell_getter(slots)
+
+        def make_closure(frame):
+            return FunctionValue(name, arity, function, get_cells(frame))
+
+        return make_closure
+
+    # Handles binary operators, one specialized closure per operator
+    def compile_binary_operator(self, expression_node):
+        return BINARY_OPERATORS[expression_node.elem_type](
+            self.compile_expression(expression_node.get('op1')),
+            self.compile_expression(expression_node.get('op2')),
+            self.error,
+        )
+
+    # Handles - and !
+    def compile_unary_operator(self, expression_node):
+        kind = expression_node.elem_type
+        op1 = self.compile_expression(expression_node.get('op1'))
+        error = self.error
+
+        if kind == InterpreterBase.NEG_NODE:
+            def negate(frame):
+                a = op1(frame)
+                if type(a) is int:
+                    return -a
+                return evaluate_unary(kind, a, error)
+
+            return negate
+
+        def logical_not(frame):
+            a = op1(frame)
+            if type(a) is bool:
+                return not a
+            return evaluate_unary(kind, a, error)
+
+        return logical_not
+
+    # int(), str(), bool()
+    def compile_convert(self, expression_node):
+        to_type = expression_node.get('to_type')
+        expression = self.compile_expression(expression_node.get('expr'))
+        error = self.error
+
+        def do_convert(frame):
+            return convert(to_type, expression(frame), error)
+
+        return do_convert
+
+    # Function call expression
+    def compile_func_call_expression(self, expression_node):
+        func_name = expression_node.get('name')
+        args = expression_node.get('args') or []
+        if func_name == 'inputi':
+            return self.compile_inputi(args)
+        if self.resolution.is_value_call(expression_node):
+            return self.compile_value_call(expression_node, tuple(self.compile_expression(arg) for arg in args))
+        function = self.functions.get((func_name, len(args)))
+        if function is None:
+            return self.fail(ErrorType.NAME_ERROR, f"Function {func_name} undefined")
+        return self.compile_user_call(function, tuple(self.compile_expression(arg) for arg in args))
+
+    # Calls to user functions. Arguments are evaluated in the caller's frame and copied into the
+    # first slots of a frame from the callee's pool, which goes back to the pool when the call ends
+    def compile_user_call(self, function, compiled_args):
+        pool = function.pool
+        frame_size = function.frame_size
+
+        # No arguments and one argument are the common cases, so they skip building an argument list
+        if not compiled_args:
+            def call_no_args(frame):
+                callee_frame = pool.pop() if pool else [None] * frame_size
+                result = callee_frame[-1] if function.body(callee_frame) else None
+                pool.append(callee_frame)
+                return result
+
+            return call_no_args
+        if len(compiled_args) == 1:
+            (arg,) = compiled_args
+
+            def call_one_arg(frame):
+                value = arg(frame)
+                callee_frame = pool.pop() if pool else [None] * frame_size
+                callee_frame[0] = value
+                result = callee_frame[-1] if function.body(callee_frame) else None
+                pool.append(callee_frame)
+                return result
+
+            return call_one_arg
+
+        def call(frame):
+            args = [arg(frame) for arg in compiled_args]
+            callee_frame = pool.pop() if pool else [None] * frame_size
+            callee_frame[:len(args)] = args
+            # function.body is looked up per call, since it may not be compiled yet when this is built
+            result = callee_frame[-1] if function.body(callee_frame) else None
+            pool.append(callee_frame)
+            return result
+
+        return call
+
+    # f(...) where f is a variable, and obj.method(...). The function is read (through the field
+    # caches for a method) and checked before the arguments are evaluated
+    def compile_value_call(self, call_node, compiled_args):
+        callee = self.compile_variable(call_node)
+        arity = len(compiled_args)
+        error = self.error
+
+        def call_value(frame):
+            value = check_callable(callee(frame), arity, error)
+            function = value.target
+            args = [arg(frame) for arg in compiled_args]
+            pool = function.pool
+            callee_frame = pool.pop() if pool else [None] * function.frame_size
+            callee_frame[:arity] = args
+            # A closure's captured cells go right after its parameters
+            cells = value.cells
+            if cells:
+                callee_frame[arity:arity + len(cells)] = cells
+            result = callee_frame[-1] if function.body(callee_frame) else None
+            pool.append(callee_frame)
+            return result
+
+        return call_value
+
+
+# A function in the table, with the frames its finished calls left behind
+class CompiledFunction:
+    def __init__(self, func_node, num_slots):
+        self.func_node = func_node
+        self.body = None
+        self.pool = []
+        # The resolver's slots plus one at the end for the return value
+        self.frame_size = num_slots + 1
+        # What it is when used as a value
+        self.value = FunctionValue(func_node.get('name'), len(func_node.get('args') or []), self)
+
+
+# Only used with stats on: a closure wrapped so it adds one to its node's count every time it runs
+def counted(run, counter, node):
+    def run_counted(frame):
+        counter[node] += 1
+        return run(frame)
+
+    return run_counted
+
+
+# Only used with trace_output on: a statement's closure wrapped so it records the statement first
+def traced(run, record, statement_node):
+    def run_traced(frame):
+        record(statement_node)
+        return run(frame)
+
+    return run_traced
+
+
+# Only used with trace_output on: an assigned expression's closure wrapped so it records the value
+def traced_value(expression, record, statement_node):
+    def evaluate_traced(frame):
+        value = expression(frame)
+        record((statement_node, value))
+        return value
+
+    return evaluate_traced
+
+
+# Operator closures. Both operands are evaluated before any type check, same as binary_operator
+# Each one has an inline fast path for the common case and falls back to brewops for everything else
+def make_add(op1, op2, error):
+    def add(frame):
+        a = op1(frame)
+        b = op2(frame)
+        if type(a) is int and type(b) is int:
+            return a + b
+        return evaluate_binary('+', a, b, error)
+
+    return add
+
+
+def make_subtract(op1, op2, error):
+    def subtract(frame):
+        a = op1(frame)
+        b = op2(frame)
+        if type(a) is int and type(b) is int:
+            return a - b
+        return evaluate_binary('-', a, b, error)
+
+    return subtract
+
+
+def make_multiply(op1, op2, error):
+    def multiply(frame):
+        a = op1(frame)
+        b = op2(frame)
+        if type(a) is int and type(b) is int:
+            return a * b
+        return evaluate_binary('*', a, b, error)
+
+    return multiply
+
+
+def make_divide(op1, op2, error):
+    def divide(frame):
+        a = op1(frame)
+        b = op2(frame)
+        if type(a) is int and type(b) is int and b != 0:
+            return a / b
+        return evaluate_binary('/', a, b, error)
+
+    return divide
+
+
+# <, <=, >, >=
+def make_int_comparison(op):
+    compare = INT_COMPARISON_OPERATORS[op]
+
+    def make(op1, op2, error):
+        def int_comparison(frame):
+            a = op1(frame)
+            b = op2(frame)
+            if type(a) is int and type(b) is int:
+                return compare(a, b)
+            return evaluate_binary(op, a, b, error)
+
+        return int_comparison
+
+    return make
+
+
+# ==, !=, && and ||, which have no fast path worth having
+def make_generic(op):
+    def make(op1, op2, error):
+        def generic_binary(frame):
+            return evaluate_binary(op, op1(frame), op2(frame), error)
+
+        return generic_binary
+
+    return make
+
+
+BINARY_OPERATORS = {
+    '+': make_add,
+    '-': make_subtract,
+    '*': make_multiply,
+    '/': make_divide,
+}
+for op in INT_COMPARISON_OPERATORS:
+    BINARY_OPERATORS[op] = make_int_comparison(op)
+for op in EQUALITY_OPERATORS + tuple(LOGICAL_OPERATORS):
+    BINARY_OPERATORS[op] = make_generic(op)
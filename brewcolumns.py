@@ -0,0 +1,258 @@
+"""
+Struct-of-arrays ASTs.
+
+ColumnarAST.from_element(ast) packs a whole AST into parallel array.array columns,
+one entry per node, numbered in preorder (so a node's children and everything
+under them come right after it):
+
+    kinds          the node's kind code (see element.py)
+    fields         which field of its parent the node is in, as an index into the parent's field_names
+    first_child    index of the node's first child, or -1
+    next_sibling   index of the next child of the same parent, or -1
+    values         the node's name, var, val, to_type or closure name as an index into pool, or -1
+    flags          REF for a & arg
+    offsets        where the node starts in the source, or -1 (see brewpositions.py)
+
+pool holds each distinct value once, so a name used all over the program is
+stored once, and a node costs 19 bytes of columns instead of a Python object
+with its lists. Walking the program is walking ints: every node is in range(len(ast))
+and the subtree of a node is the indexes up to the next node that isn't under it.
+
+NodeView(ast, index) (ast.root() for the program) reads a node like an Element:
+elem_type, kind, get(key), dict, str() and attributes named after the fields.
+Views are made when they're asked for and compare equal when they're the same
+node, so they work as dict keys but aren't the same object twice. Engines want
+real nodes, so to_element() rebuilds the Element tree.
+"""
+
+from array import array
+from functools import partial
+
+from element import (
+    Element, Program, Arg, BinaryOperation, KIND_CLASSES, ELEM_TYPES, PROGRAM, INTERFACE, FIELD_FUNC, FIELD_VAR, FUNC,
+    ARG, ASSIGNMENT, VAR_DEF, BVAR_DEF, FCALL, QUALIFIED_NAME, INT, STRING, BOOL, CLOSURE, CONVERT,
+)
+
+# The field each kind keeps in the pool. Every other field holds nodes
+VALUE_FIELDS = {
+    INTERFACE: 'name',
+    FIELD_FUNC: 'name',
+    FIELD_VAR: 'name',
+    FUNC: 'name',
+    ARG: 'name',
+    ASSIGNMENT: 'var',
+    VAR_DEF: 'name',
+    BVAR_DEF: 'name',
+    FCALL: 'name',
+    QUALIFIED_NAME: 'name',
+    INT: 'val',
+    STRING: 'val',
+    BOOL: 'val',
+    CLOSURE: 'args',
+    CONVERT: 'to_type',
+}
+# Fields holding a list of nodes. One with no children is an empty list, except the ones the
+# parser leaves as None when they're missing
+LIST_FIELDS = frozenset(('args', 'statements', 'else_statements', 'functions', 'interfaces', 'fields', 'params'))
+MISSING_LISTS = frozenset(('else_statements', 'interfaces'))
+
+# flags
+REF = 1
+
+
+def field_names(kind):
+    return KIND_CLASSES[kind].field_names if kind < len(KIND_CLASSES) else BinaryOperation.field_names
+
+
+# Builds a node of a kind from its field values, in field_names order
+def constructor(kind):
+    if kind >= len(KIND_CLASSES):
+        return partial(BinaryOperation, ELEM_TYPES[kind])
+    if kind == PROGRAM:
+        return lambda interfaces, functions: Program(functions, interfaces)
+    return KIND_CLASSES[kind]
+
+
+# Whether each of a kind's fields holds a list of nodes
+def list_fields(kind):
+    return [key in LIST_FIELDS and key != VALUE_FIELDS.get(kind) for key in field_names(kind)]
+
+
+# kind code -> (constructor, index of the field in the pool or None, whether each field is a list,
+# whether each field starts out as an empty list rather than None)
+LAYOUTS = [
+    (
+        constructor(kind),
+        field_names(kind).index(VALUE_FIELDS[kind]) if kind in VALUE_FIELDS else None,
+        list_fields(kind),
+        [is_list and key not in MISSING_LISTS for key, is_list in zip(field_names(kind), list_fields(kind))],
+    )
+    for kind in range(len(ELEM_TYPES))
+]
+# Where ref is in an arg's fields
+REF_FIELD = Arg.field_names.index('ref')
+
+
+class ColumnarAST:
+    def __init__(self):
+        self.kinds = array('B')
+        self.fields = array('B')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        self.values = array('i')
+        self.flags = array('B')
+        self.offsets = array('i')
+        self.pool = []
+        # (type, value) -> index in pool. The type is in the key so True and 1 stay apart
+        self.pool_indexes = {}
+
+    # positions, the SourcePositions the AST was parsed with, fills in offsets
+    @classmethod
+    def from_element(cls, root, positions=None):
+        ast = cls()
+        # Index of the last child added to each node so far, for linking the next one to it
+        last_child = []
+        pending = [(root, -1, 0)]
+        while pending:
+            node, parent, field = pending.pop()
+            index = len(ast.kinds)
+            ast.kinds.append(node.kind)
+            ast.fields.append(field)
+            ast.first_child.append(-1)
+            ast.next_sibling.append(-1)
+            value_field = VALUE_FIELDS.get(node.kind)
+            ast.values.append(ast.intern(getattr(node, value_field)) if value_field is not None else -1)
+            ast.flags.append(REF if node.kind == ARG and node.ref else 0)
+            offset = positions.offset(node) if positions is not None else None
+            ast.offsets.append(offset if offset is not None else -1)
+            last_child.append(-1)
+            if parent >= 0:
+                if last_child[parent] < 0:
+                    ast.first_child[parent] = index
+                else:
+                    ast.next_sibling[last_child[parent]] = index
+                last_child[parent] = index
+
+            children = []
+            for code, key in enumerate(node.field_names):
+                if key == value_field:
+                    continue
+                value = getattr(node, key)
+                if isinstance(value, Element):
+                    children.append((value, index, code))
+                elif isinstance(value, list):
+                    children.extend((child, index, code) for child in value)
+            # Reversed, so they come off the stack in order
+            pending.extend(reversed(children))
+        return ast
+
+    def intern(self, value):
+        key = (type(value), value)
+        index = self.pool_indexes.get(key)
+        if index is None:
+            index = self.pool_indexes[key] = len(self.pool)
+            self.pool.append(value)
+        return index
+
+    def __len__(self):
+        return len(self.kinds)
+
+    # Bytes taken by the columns, not counting the pool
+    def nbytes(self):
+        columns = (self.kinds, self.fields, self.first_child, self.next_sibling, self.values, self.flags, self.offsets)
+        return sum(column.itemsize * len(column) for column in columns)
+
+    def root(self):
+        return NodeView(self, 0)
+
+    def children(self, index):
+        child = self.first_child[index]
+        while child >= 0:
+            yield child
+            child = self.next_sibling[child]
+
+    # The value of the node's VALUE_FIELDS field
+    def value(self, index):
+        return self.pool[self.values[index]]
+
+    # What node.get(key) would give for the node at index, with views for nodes
+    def field(self, index, key):
+        kind = self.kinds[index]
+        if VALUE_FIELDS.get(kind) == key:
+            return self.value(index)
+        if key == 'ref' and kind == ARG:
+            return bool(self.flags[index] & REF)
+        names = field_names(kind)
+        if key not in names:
+            return None
+        code = names.index(key)
+        found = [NodeView(self, child) for child in self.children(index) if self.fields[child] == code]
+        if key in LIST_FIELDS:
+            return found if found or key not in MISSING_LISTS else None
+        return found[0] if found else None
+
+    # The Element tree, built from the last node back so every node's children are ready before it is.
+    # Offsets are recorded in positions if it's given
+    def to_element(self, positions=None):
+        built = [None] * len(self.kinds)
+        for index in range(len(self.kinds) - 1, -1, -1):
+            kind = self.kinds[index]
+            make, value_field, lists, empty = LAYOUTS[kind]
+            values = [[] if starts_empty else None for starts_empty in empty]
+            if value_field is not None:
+                values[value_field] = self.value(index)
+            if kind == ARG:
+                values[REF_FIELD] = bool(self.flags[index] & REF)
+            child = self.first_child[index]
+            while child >= 0:
+                field = self.fields[child]
+                if lists[field]:
+                    if values[field] is None:
+                        values[field] = []
+                    values[field].append(built[child])
+                else:
+                    values[field] = built[child]
+                built[child] = None
+                child = self.next_sibling[child]
+            built[index] = make(*values)
+            if positions is not None and self.offsets[index] >= 0:
+                positions.record(built[index], self.offsets[index])
+        return built[0]
+
+
+class NodeView(Element):
+    __slots__ = ('ast', 'index')
+
+    def __init__(self, ast, index):
+        self.kind = ast.kinds[index]
+        self.ast = ast
+        self.index = index
+
+    @property
+    def elem_type(self):
+        return ELEM_TYPES[self.kind]
+
+    @property
+    def field_names(self):
+        return field_names(self.kind)
+
+    @property
+    def optional_fields(self):
+        return KIND_CLASSES[self.kind].optional_fields if self.kind < len(KIND_CLASSES) else ()
+
+    def get(self, key):
+        return self.ast.field(self.index, key)
+
+    def __getattr__(self, name):
+        if name in field_names(self.kind):
+            return self.ast.field(self.index, name)
+        raise AttributeError(name)
+
+    def children(self):
+        return [NodeView(self.ast, child) for child in self.ast.children(self.index)]
+
+    def __eq__(self, other):
+        return isinstance(other, NodeView) and other.ast is self.ast and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.ast), self.index))
@@ -0,0 +1,690 @@
+"""
+Non-recursive tree-walking engine for Brewin.
+
+IterativeWalker runs the AST directly like the default tree walker, but never
+recurses in Python. Work still to do is kept on an explicit stack of (node, task)
+pairs and intermediate values on a value stack, so nested expressions and Brewin
+function calls only make those two lists longer. Recursion depth is limited by
+memory instead of Python's recursion limit. Variables live in the frame slots
+picked by the resolver rather than in dicts looked up by name, and frames from
+finished calls are pooled per function like in the other engines. Lambdas get a
+WalkerFunction of their own, and a captured variable keeps a Cell in its slot.
+
+Nodes are dispatched on their int kind codes. The work a block puts on the stack
+(every statement with an EXEC, first statement on top) is worked out once when the
+program is set up, so entering a block or going round a loop is one list extend.
+There are two copies of the loop: run has no instrumentation at all, and
+run_instrumented counts and traces every node for stats=True and trace_output.
+compile_program picks one, so a plain run never checks whether it should count.
+"""
+
+from intbase import ErrorType
+from element import (
+    Element, ASSIGNMENT, VAR_DEF, IF, WHILE, RETURN, FCALL, QUALIFIED_NAME, INT, NIL, EMPTY_OBJ, FUNC, CLOSURE,
+    CONVERT, NEG, NOT, BINARY_KINDS,
+)
+from brewresolve import resolve_program, child_nodes
+from brewprofile import find_frame, enclosing_statements
+from brewobjects import BrewinObject, FieldCache, FunctionValue, Cell, cell_getter, get_cached_path, check_callable
+from brewops import evaluate_binary, evaluate_unary, convert, to_string, check_condition
+
+# Tasks on the work stack, each one is pushed right after the node (or other item) it works on
+EXEC = 0        # run a statement
+EVAL = 1        # evaluate an expression and push its value
+BINARY = 2      # pop two operands, push the result
+UNARY = 3       # pop an operand, push -x or !x
+CONVERT_VALUE = 4  # pop a value, push int()/str()/bool() of it
+# The item of every task that can raise a Brewin error is a node, which is how locate_statement finds the line
+ASSIGN = 5      # pop a value into the slot of an assignment
+BRANCH = 6      # pop an if's condition, queue the block that runs
+LOOP = 7        # pop a while's condition, queue the body and then the loop again
+PRINT = 8       # pop the arguments of a print and print them
+INPUTI = 9      # pop the prompt (if the call has one), push the int read
+CALL = 10       # pop the arguments, start running the function
+RETURN_VALUE = 11  # pop the return value, drop what's left of the call and go back to the caller
+END = 12        # the function ran off its end, return nil
+DISCARD = 13    # pop a value nobody needs
+SET_FIELD = 14  # pop a value into a field, the item is the assignment
+CALL_VALUE = 15 # pop the arguments and the function value under them, start running it. The item is the arity
+ASSIGN_CELL = 16  # pop a value into the cell in a slot
+TRACE_WRITE = 17  # record the assignment that's the item with the value on top of the value stack, only with trace_output on
+
+# Stands in for an operand that still has to be evaluated through the work stack
+PENDING = object()
+
+# Binary operators have the last kind codes, everything past NOT is one. The literals are INT to NIL
+ADD = BINARY_KINDS['+']
+SUBTRACT = BINARY_KINDS['-']
+MULTIPLY = BINARY_KINDS['*']
+DIVIDE = BINARY_KINDS['/']
+LESS = BINARY_KINDS['<']
+GREATER = BINARY_KINDS['>']
+
+
+# The work a block of statements puts on the stack, first statement on top
+def block_tasks(statements):
+    tasks = []
+    for statement_node in reversed(statements or []):
+        tasks.append(statement_node)
+        tasks.append(EXEC)
+    return tasks
+
+
+# A function in the table, with the frames its finished calls left behind
+class WalkerFunction:
+    def __init__(self, func_node, frame_size, cell_params):
+        self.func_node = func_node
+        self.arity = len(func_node.get('args') or [])
+        self.frame_size = frame_size
+        # Parameters some lambda captures, they go in cells when the call starts
+        self.cell_params = cell_params
+        # What a call puts on the stack: the END that returns nil if it runs off the end, under its body
+        self.tasks = [None, END] + block_tasks(func_node.get('statements'))
+        self.pool = []
+        # What the function is when it's used as a value
+        self.value = FunctionValue(func_node.get('name'), self.arity, self)
+
+
+class IterativeWalker:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+
+    # Program Node. Nothing gets compiled, this just resolves names, builds the function table and works
+    # out what every block puts on the stack
+    def compile_program(self, ast):
+        self.resolution = resolve_program(ast, self.interpreter.error)
+        self.functions = {
+            key: self.make_function(func) for key, func in self.resolution.functions.items()
+        }
+        # lambda func node -> (its function, what picks the cells it captures out of the frame)
+        self.lambdas = {
+            func: (self.make_function(func), cell_getter(tuple(slot for _, slot in captures)))
+            for func, captures in self.resolution.captures.items()
+        }
+        functions_by_node = {func: self.functions[key] for key, func in self.resolution.functions.items()}
+        # Plain variable reads by slot, and the field caches dotted reads (and calls through values)
+        # go through after reading their variable. Each site gets its own caches
+        self.var_slots = {}
+        self.field_paths = {}
+        self.field_stores = {}
+        for node, (var_name, field_names) in self.resolution.paths.items():
+            caches = tuple(FieldCache(name) for name in field_names)
+            if node.kind == ASSIGNMENT:
+                if field_names:
+                    self.field_stores[node] = (self.resolution.slot(node), self.resolution.in_cell(node), caches[:-1], caches[-1])
+            elif field_names or node.kind == FCALL or self.resolution.in_cell(node):
+                self.field_paths[node] = caches
+            else:
+                self.var_slots[node] = self.resolution.slot(node)
+        # Function names used as values
+        self.function_refs = {
+            node: functions_by_node[func].value for node, func in self.resolution.function_refs.items()
+        }
+        # while node -> what one more time round it puts on the stack: the condition and the loop again
+        # under the body. if node -> (what the if block puts on the stack, what the else block does)
+        self.loops = {}
+        self.branches = {}
+        pending = [ast]
+        while pending:
+            node = pending.pop()
+            if node.kind == WHILE:
+                self.loops[node] = [node, LOOP, node.get('condition'), EVAL] + block_tasks(node.get('statements'))
+            elif node.kind == IF:
+                self.branches[node] = (block_tasks(node.get('statements')), block_tasks(node.get('else_statements')))
+            pending.extend(child_nodes(node))
+        # node -> statement it's in, made when locate_statement first needs it
+        self.ast = ast
+        self.enclosing = None
+        instrumented = self.interpreter.counts is not None or self.interpreter.trace is not None
+        self.loop = self.run_instrumented if instrumented else self.run
+        return self.loop
+
+    # For the profiler and error lines: the statement the item the loop in a frame stack just took off
+    # the todo stack is part of. That item can be an expression
+    def locate_statement(self, frame):
+        frame = find_frame(frame, self.loop.__code__)
+        if frame is None:
+            return None
+        if self.enclosing is None:
+            self.enclosing = enclosing_statements(self.ast)
+        # The error can come before the loop takes anything off the stack
+        node = frame.f_locals.get('node')
+        # Other tasks' items are slots, functions and so on
+        return self.enclosing.get(node) if isinstance(node, Element) else None
+
+    def make_function(self, func_node):
+        return WalkerFunction(func_node, self.resolution.frame_size(func_node), self.resolution.cell_params[func_node])
+
+    # The whole program is this one loop. run_instrumented below is the same loop with counting and tracing,
+    # anything changed here needs changing there too
+    def run(self):
+        error = self.interpreter.error
+        output = self.interpreter.output
+        get_input = self.interpreter.get_input
+        slots = self.resolution.slots
+        var_slots = self.var_slots
+        field_paths = self.field_paths
+        field_stores = self.field_stores
+        function_refs = self.function_refs
+        functions = self.functions
+        lambdas = self.lambdas
+        loops = self.loops
+        branches = self.branches
+        cells = self.resolution.cells
+        budget = self.interpreter.budget
+
+        # Same rules as Interpreter.get_main_func_node
+        main = functions.get(('main', 0))
+        if main is None:
+            error(ErrorType.NAME_ERROR, "No main() function was found")
+
+        todo = [main, CALL]
+        values = []
+        push = values.append
+        pop = values.pop
+        # The running call's frame and function, and where its work starts on the todo stack
+        frame = None
+        function = None
+        base = 0
+        # (frame, function, base) of every caller
+        calls = []
+
+        while todo:
+            task = todo.pop()
+            node = todo.pop()
+
+            if task == EVAL:
+                kind = node.kind
+                if kind > NOT:
+                    op1 = node.op1
+                    op2 = node.op2
+                    # Operands that are just variables or literals are read right here, which
+                    # saves queueing two EVAL tasks for most operators in real programs
+                    slot = var_slots.get(op1)
+                    if slot is not None:
+                        a = frame[slot]
+                    elif INT <= op1.kind <= NIL:
+                        a = op1.get('val')
+                    else:
+                        a = PENDING
+                    if a is not PENDING:
+                        slot = var_slots.get(op2)
+                        if slot is not None:
+                            b = frame[slot]
+                        elif INT <= op2.kind <= NIL:
+                            b = op2.get('val')
+                        else:
+                            b = PENDING
+                        if b is not PENDING:
+                            if type(a) is int and type(b) is int and kind != DIVIDE:
+                                if kind == ADD:
+                                    push(a + b)
+                                elif kind == SUBTRACT:
+                                    push(a - b)
+                                elif kind == MULTIPLY:
+                                    push(a * b)
+                                elif kind == LESS:
+                                    push(a < b)
+                                elif kind == GREATER:
+                                    push(a > b)
+                                else:
+                                    push(evaluate_binary(node.elem_type, a, b, error))
+                            else:
+                                push(evaluate_binary(node.elem_type, a, b, error))
+                            continue
+                    todo.append(node)
+                    todo.append(BINARY)
+                    todo.append(op2)
+                    todo.append(EVAL)
+                    todo.append(op1)
+                    todo.append(EVAL)
+                elif kind == QUALIFIED_NAME:
+                    slot = var_slots.get(node)
+                    if slot is not None:
+                        push(frame[slot])
+                    elif node in field_paths:
+                        value = frame[slots[node]]
+                        if node in cells:
+                            value = value.value
+                        push(get_cached_path(value, field_paths[node], error))
+                    else:
+                        push(function_refs[node])
+                elif INT <= kind <= NIL:
+                    push(node.get('val'))
+                elif kind == FCALL:
+                    func_name = node.name
+                    args = node.args or []
+                    if func_name == 'inputi':
+                        if len(args) > 1:
+                            error(ErrorType.NAME_ERROR, "No inputi() function found that takes > 1 parameter")
+                        todo.append(len(args))
+                        todo.append(INPUTI)
+                    elif node in field_paths:
+                        # f(...) where f is a variable, or obj.method(...). The function is read and
+                        # checked before any argument is evaluated, and waits under them on the value stack
+                        callee = frame[slots[node]]
+                        if node in cells:
+                            callee = callee.value
+                        callee = get_cached_path(callee, field_paths[node], error)
+                        push(check_callable(callee, len(args), error))
+                        todo.append(len(args))
+                        todo.append(CALL_VALUE)
+                    else:
+                        # The function is looked up before any argument is evaluated, like the tree walker
+                        callee = functions.get((func_name, len(args)))
+                        if callee is None:
+                            error(ErrorType.NAME_ERROR, f"Function {func_name} undefined")
+                        todo.append(callee)
+                        todo.append(CALL)
+                    for arg in reversed(args):
+                        todo.append(arg)
+                        todo.append(EVAL)
+                elif kind == NEG or kind == NOT:
+                    todo.append(node)
+                    todo.append(UNARY)
+                    todo.append(node.op1)
+                    todo.append(EVAL)
+                elif kind == CONVERT:
+                    todo.append(node)
+                    todo.append(CONVERT_VALUE)
+                    todo.append(node.expr)
+                    todo.append(EVAL)
+                elif kind == EMPTY_OBJ:
+                    push(BrewinObject())
+                elif kind == FUNC:
+                    # A lambda, only the cells it captures come along
+                    callee, get_cells = lambdas[node]
+                    push(FunctionValue(node.name, callee.arity, callee, get_cells(frame)))
+                elif kind == CLOSURE:
+                    push(function_refs[node])
+                else:
+                    error(ErrorType.TYPE_ERROR, f"Unknown expression type: {node.elem_type}")
+
+            elif task == EXEC:
+                kind = node.kind
+                if kind == ASSIGNMENT:
+                    if node in field_stores:
+                        todo.append(node)
+                        todo.append(SET_FIELD)
+                    else:
+                        todo.append(slots[node])
+                        todo.append(ASSIGN_CELL if node in cells else ASSIGN)
+                    todo.append(node.expression)
+                    todo.append(EVAL)
+                elif kind == VAR_DEF:
+                    frame[slots[node]] = Cell() if node in cells else None
+                elif kind == IF:
+                    todo.append(node)
+                    todo.append(BRANCH)
+                    todo.append(node.condition)
+                    todo.append(EVAL)
+                elif kind == WHILE:
+                    todo.append(node)
+                    todo.append(LOOP)
+                    todo.append(node.condition)
+                    todo.append(EVAL)
+                elif kind == FCALL:
+                    if node.name == 'print':
+                        todo.append(node)
+                        todo.append(PRINT)
+                        for arg in reversed(node.args or []):
+                            todo.append(arg)
+                            todo.append(EVAL)
+                    else:
+                        # Anything else is an expression whose value gets thrown away
+                        todo.append(None)
+                        todo.append(DISCARD)
+                        todo.append(node)
+                        todo.append(EVAL)
+                elif kind == RETURN:
+                    todo.append(None)
+                    todo.append(RETURN_VALUE)
+                    if node.expression is not None:
+                        todo.append(node.expression)
+                        todo.append(EVAL)
+                    else:
+                        push(None)
+                else:
+                    error(ErrorType.TYPE_ERROR, f"Unknown statement type: {node.elem_type}")
+
+            elif task == ASSIGN:
+                frame[node] = pop()
+            elif task == LOOP:
+                condition = pop()
+                if condition is True or (condition is not False and check_condition(condition, error)):
+                    if budget is not None:
+                        budget.charge(budget.cost(node))
+                    # The body, then the condition and the loop again
+                    todo += loops[node]
+            elif task == BINARY:
+                b = pop()
+                a = pop()
+                kind = node.kind
+                if type(a) is int and type(b) is int and kind != DIVIDE:
+                    if kind == ADD:
+                        push(a + b)
+                    elif kind == SUBTRACT:
+                        push(a - b)
+                    elif kind == MULTIPLY:
+                        push(a * b)
+                    elif kind == LESS:
+                        push(a < b)
+                    elif kind == GREATER:
+                        push(a > b)
+                    else:
+                        push(evaluate_binary(node.elem_type, a, b, error))
+                else:
+                    push(evaluate_binary(node.elem_type, a, b, error))
+            elif task == BRANCH:
+                condition = pop()
+                if condition is True or (condition is not False and check_condition(condition, error)):
+                    todo += branches[node][0]
+                else:
+                    todo += branches[node][1]
+            elif task == CALL or task == CALL_VALUE:
+                captured = ()
+                if task == CALL_VALUE:
+                    arity = node
+                    value = values[-arity - 1]
+                    node = value.target
+                    captured = value.cells
+                    del values[-arity - 1]
+                else:
+                    arity = node.arity
+                pool = node.pool
+                callee_frame = pool.pop() if pool else [None] * node.frame_size
+                if arity:
+                    callee_frame[:arity] = values[-arity:]
+                    del values[-arity:]
+                # A closure's captured cells go right after its parameters
+                if captured:
+                    callee_frame[arity:arity + len(captured)] = captured
+                for slot in node.cell_params:
+                    callee_frame[slot] = Cell(callee_frame[slot])
+                if budget is not None:
+                    budget.charge(budget.cost(node.func_node))
+                calls.append((frame, function, base))
+                frame = callee_frame
+                function = node
+                base = len(todo)
+                todo += node.tasks
+            elif task == RETURN_VALUE or task == END:
+                if task == END:
+                    push(None)
+                # Whatever the call still had queued (loop checks, the END marker) goes away
+                del todo[base:]
+                function.pool.append(frame)
+                frame, function, base = calls.pop()
+            elif task == ASSIGN_CELL:
+                frame[node].value = pop()
+            elif task == UNARY:
+                push(evaluate_unary(node.elem_type, pop(), error))
+            elif task == CONVERT_VALUE:
+                push(convert(node.to_type, pop(), error))
+            elif task == PRINT:
+                count = len(node.args or [])
+                if count:
+                    printed = values[-count:]
+                    del values[-count:]
+                    output(''.join([to_string(value) for value in printed]))
+                else:
+                    output('')
+            elif task == INPUTI:
+                if node:
+                    output(to_string(pop()))
+                push(int(get_input()))
+            elif task == DISCARD:
+                pop()
+            elif task == SET_FIELD:
+                slot, in_cell, path, cache = field_stores[node]
+                value = pop()
+                obj = frame[slot].value if in_cell else frame[slot]
+                cache.set(get_cached_path(obj, path, error), value, error)
+
+    # run with every node counted (stats=True) and every statement and assignment recorded (trace_output)
+    # Nothing is read without an EVAL of its own here, so the counts come out the same as the other engines'
+    def run_instrumented(self):
+        error = self.interpreter.error
+        output = self.interpreter.output
+        get_input = self.interpreter.get_input
+        slots = self.resolution.slots
+        var_slots = self.var_slots
+        field_paths = self.field_paths
+        field_stores = self.field_stores
+        function_refs = self.function_refs
+        functions = self.functions
+        lambdas = self.lambdas
+        loops = self.loops
+        branches = self.branches
+        cells = self.resolution.cells
+        budget = self.interpreter.budget
+        # Either of these can be None, the other one is what made the run instrumented
+        counts = self.interpreter.counts
+        nodes = counts.nodes if counts is not None else None
+        record = self.interpreter.trace.records.append if self.interpreter.trace is not None else None
+
+        # Same rules as Interpreter.get_main_func_node
+        main = functions.get(('main', 0))
+        if main is None:
+            error(ErrorType.NAME_ERROR, "No main() function was found")
+
+        todo = [main, CALL]
+        values = []
+        push = values.append
+        pop = values.pop
+        # The running call's frame and function, and where its work starts on the todo stack
+        frame = None
+        function = None
+        base = 0
+        # (frame, function, base) of every caller
+        calls = []
+
+        while todo:
+            task = todo.pop()
+            node = todo.pop()
+
+            if task == EVAL:
+                kind = node.kind
+                if nodes is not None:
+                    nodes[node] += 1
+                if kind > NOT:
+                    todo.append(node)
+                    todo.append(BINARY)
+                    todo.append(node.op2)
+                    todo.append(EVAL)
+                    todo.append(node.op1)
+                    todo.append(EVAL)
+                elif kind == QUALIFIED_NAME:
+                    slot = var_slots.get(node)
+                    if slot is not None:
+                        push(frame[slot])
+                    elif node in field_paths:
+                        value = frame[slots[node]]
+                        if node in cells:
+                            value = value.value
+                        push(get_cached_path(value, field_paths[node], error))
+                    else:
+                        push(function_refs[node])
+                elif INT <= kind <= NIL:
+                    push(node.get('val'))
+                elif kind == FCALL:
+                    func_name = node.name
+                    args = node.args or []
+                    if func_name == 'inputi':
+                        if len(args) > 1:
+                            error(ErrorType.NAME_ERROR, "No inputi() function found that takes > 1 parameter")
+                        todo.append(len(args))
+                        todo.append(INPUTI)
+                    elif node in field_paths:
+                        # f(...) where f is a variable, or obj.method(...). The function is read and
+                        # checked before any argument is evaluated, and waits under them on the value stack
+                        callee = frame[slots[node]]
+                        if node in cells:
+                            callee = callee.value
+                        callee = get_cached_path(callee, field_paths[node], error)
+                        push(check_callable(callee, len(args), error))
+                        todo.append(len(args))
+                        todo.append(CALL_VALUE)
+                    else:
+                        # The function is looked up before any argument is evaluated, like the tree walker
+                        callee = functions.get((func_name, len(args)))
+                        if callee is None:
+                            error(ErrorType.NAME_ERROR, f"Function {func_name} undefined")
+                        todo.append(callee)
+                        todo.append(CALL)
+                    for arg in reversed(args):
+                        todo.append(arg)
+                        todo.append(EVAL)
+                elif kind == NEG or kind == NOT:
+                    todo.append(node)
+                    todo.append(UNARY)
+                    todo.append(node.op1)
+                    todo.append(EVAL)
+                elif kind == CONVERT:
+                    todo.append(node)
+                    todo.append(CONVERT_VALUE)
+                    todo.append(node.expr)
+                    todo.append(EVAL)
+                elif kind == EMPTY_OBJ:
+                    push(BrewinObject())
+                elif kind == FUNC:
+                    # A lambda, only the cells it captures come along
+                    callee, get_cells = lambdas[node]
+                    push(FunctionValue(node.name, callee.arity, callee, get_cells(frame)))
+                elif kind == CLOSURE:
+                    push(function_refs[node])
+                else:
+                    error(ErrorType.TYPE_ERROR, f"Unknown expression type: {node.elem_type}")
+
+            elif task == EXEC:
+                kind = node.kind
+                # Calls other than print are counted when they're evaluated
+                if nodes is not None and (kind != FCALL or node.name == 'print'):
+                    nodes[node] += 1
+                if record is not None:
+                    record(node)
+                if kind == ASSIGNMENT:
+                    if node in field_stores:
+                        todo.append(node)
+                        todo.append(SET_FIELD)
+                    else:
+                        todo.append(slots[node])
+                        todo.append(ASSIGN_CELL if node in cells else ASSIGN)
+                    if record is not None:
+                        todo.append(node)
+                        todo.append(TRACE_WRITE)
+                    todo.append(node.expression)
+                    todo.append(EVAL)
+                elif kind == VAR_DEF:
+                    frame[slots[node]] = Cell() if node in cells else None
+                elif kind == IF:
+                    todo.append(node)
+                    todo.append(BRANCH)
+                    todo.append(node.condition)
+                    todo.append(EVAL)
+                elif kind == WHILE:
+                    todo.append(node)
+                    todo.append(LOOP)
+                    todo.append(node.condition)
+                    todo.append(EVAL)
+                elif kind == FCALL:
+                    if node.name == 'print':
+                        todo.append(node)
+                        todo.append(PRINT)
+                        for arg in reversed(node.args or []):
+                            todo.append(arg)
+                            todo.append(EVAL)
+                    else:
+                        # Anything else is an expression whose value gets thrown away
+                        todo.append(None)
+                        todo.append(DISCARD)
+                        todo.append(node)
+                        todo.append(EVAL)
+                elif kind == RETURN:
+                    todo.append(None)
+                    todo.append(RETURN_VALUE)
+                    if node.expression is not None:
+                        todo.append(node.expression)
+                        todo.append(EVAL)
+                    else:
+                        push(None)
+                else:
+                    error(ErrorType.TYPE_ERROR, f"Unknown statement type: {node.elem_type}")
+
+            elif task == ASSIGN:
+                frame[node] = pop()
+            elif task == LOOP:
+                if check_condition(pop(), error):
+                    if budget is not None:
+                        budget.charge(budget.cost(node))
+                    # The body, then the condition and the loop again
+                    todo += loops[node]
+            elif task == BINARY:
+                b = pop()
+                a = pop()
+                push(evaluate_binary(node.elem_type, a, b, error))
+            elif task == BRANCH:
+                todo += branches[node][0 if check_condition(pop(), error) else 1]
+            elif task == CALL or task == CALL_VALUE:
+                captured = ()
+                if task == CALL_VALUE:
+                    arity = node
+                    value = values[-arity - 1]
+                    node = value.target
+                    captured = value.cells
+                    del values[-arity - 1]
+                else:
+                    arity = node.arity
+                pool = node.pool
+                callee_frame = pool.pop() if pool else [None] * node.frame_size
+                if arity:
+                    callee_frame[:arity] = values[-arity:]
+                    del values[-arity:]
+                # A closure's captured cells go right after its parameters
+                if captured:
+                    callee_frame[arity:arity + len(captured)] = captured
+                for slot in node.cell_params:
+                    callee_frame[slot] = Cell(callee_frame[slot])
+                if budget is not None:
+                    budget.charge(budget.cost(node.func_node))
+                if counts is not None:
+                    counts.calls[node.func_node] += 1
+                calls.append((frame, function, base))
+                frame = callee_frame
+                function = node
+                base = len(todo)
+                todo += node.tasks
+            elif task == RETURN_VALUE or task == END:
+                if task == END:
+                    push(None)
+                # Whatever the call still had queued (loop checks, the END marker) goes away
+                del todo[base:]
+                function.pool.append(frame)
+                frame, function, base = calls.pop()
+            elif task == ASSIGN_CELL:
+                frame[node].value = pop()
+            elif task == UNARY:
+                push(evaluate_unary(node.elem_type, pop(), error))
+            elif task == CONVERT_VALUE:
+                push(convert(node.to_type, pop(), error))
+            elif task == PRINT:
+                count = len(node.args or [])
+                if count:
+                    printed = values[-count:]
+                    del values[-count:]
+                    output(''.join([to_string(value) for value in printed]))
+                else:
+                    output('')
+            elif task == INPUTI:
+                if node:
+                    output(to_string(pop()))
+                push(int(get_input()))
+            elif task == DISCARD:
+                pop()
+            elif task == TRACE_WRITE:
+                record((node, values[-1]))
+            elif task == SET_FIELD:
+                slot, in_cell, path, cache = field_stores[node]
+                value = pop()
+                obj = frame[slot].value if in_cell else frame[slot]
+                cache.set(get_cached_path(obj, path, error), value, error)
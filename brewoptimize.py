@@ -0,0 +1,210 @@
+"""
+Constant folding and algebraic simplification for Brewin ASTs.
+
+Runs between parse_program and execution. Operators, - / ! and int()/str()/bool()
+whose operands are all literals are evaluated once here (with the same brewops
+code the engines use) and replaced by a literal node. Anything that would raise
+an error, like 5 / 0, is left alone so the error still happens at run time in the
+right place. Identities such as x * 1 and x + 0 are only applied when x is known
+to produce a value of the right type, since otherwise dropping the operator would
+also drop its TYPE_ERROR.
+
+The input AST isn't modified, nodes that change are rebuilt and the rest is shared.
+Rebuilt nodes and the literals that replace folded ones get the source position
+of the node they stand in for.
+"""
+
+from element import Element, Nil, Bool, Int, String, make_element
+from intbase import InterpreterBase
+from brewops import BINARY_OPERATORS, UNARY_OPERATORS, evaluate_binary, evaluate_unary, convert
+
+# Literal nodes
+VALUE_NODES = (InterpreterBase.INT_NODE, InterpreterBase.STRING_NODE, InterpreterBase.BOOL_NODE, InterpreterBase.NIL_NODE)
+
+# Expressions that always produce an int or raise
+INT_RESULT_NODES = ('+', '-', '*', InterpreterBase.NEG_NODE)
+# Expressions that always produce a bool or raise
+BOOL_RESULT_NODES = ('<', '<=', '>', '>=', '==', '!=', '&&', '||', InterpreterBase.NOT_NODE)
+
+
+# Raised instead of a Brewin error while evaluating at compile time
+class FoldError(Exception):
+    pass
+
+
+def raise_fold_error(error_type, description=None):
+    raise FoldError(description)
+
+
+def is_literal(node):
+    return node.elem_type in VALUE_NODES
+
+
+# Builds the literal node for a value, or None if Brewin has no literal for it (the floats from /)
+def make_literal(value):
+    if value is None:
+        return Nil()
+    if type(value) is bool:
+        return Bool(value)
+    if type(value) is int:
+        return Int(value)
+    if type(value) is str:
+        return String(value)
+    return None
+
+
+def is_int_expression(node):
+    kind = node.elem_type
+    if kind == InterpreterBase.INT_NODE:
+        return type(node.get('val')) is int
+    if kind == InterpreterBase.CONVERT_NODE:
+        return node.get('to_type') == "int"
+    if kind == InterpreterBase.FCALL_NODE:
+        return node.get('name') == 'inputi'
+    return kind in INT_RESULT_NODES
+
+
+def is_bool_expression(node):
+    kind = node.elem_type
+    if kind == InterpreterBase.BOOL_NODE:
+        return True
+    if kind == InterpreterBase.CONVERT_NODE:
+        return node.get('to_type') == "bool"
+    return kind in BOOL_RESULT_NODES
+
+
+# (key, index in the list or None, child) for every child Element of a node, in order
+def child_elements(node):
+    children = []
+    for key, value in node.dict.items():
+        if isinstance(value, Element):
+            children.append((key, None, value))
+        elif isinstance(value, list):
+            children.extend((key, index, item) for index, item in enumerate(value) if isinstance(item, Element))
+    return children
+
+
+def is_literal_value(node, value):
+    return is_literal(node) and type(node.get('val')) is type(value) and node.get('val') == value
+
+
+class ConstantFolder:
+    def __init__(self, positions=None):
+        # Number of nodes replaced, handy for checking the pass actually did something
+        self.folded = 0
+        self.positions = positions
+
+    # The old AST is still alive here, so the positions of the nodes that were folded away can be dropped safely
+    def fold_program(self, ast):
+        folded = self.fold(ast)
+        if self.positions is not None and self.folded:
+            self.positions.retain(folded)
+        return folded
+
+    # Folds the children first, then the node itself
+    # Done with an explicit stack rather than recursion, so very deep expressions can be folded
+    def fold(self, root):
+        # Folded results, in the order their nodes finished
+        finished = []
+        pending = [(root, False)]
+        while pending:
+            node, children_done = pending.pop()
+            children = child_elements(node)
+            if not children_done:
+                pending.append((node, True))
+                pending.extend((child, False) for _, _, child in reversed(children))
+                continue
+
+            folded_children = finished[len(finished) - len(children):]
+            del finished[len(finished) - len(children):]
+            changed = {}
+            for (key, index, old), new in zip(children, folded_children):
+                if new is old:
+                    continue
+                if index is None:
+                    changed[key] = new
+                else:
+                    if key not in changed:
+                        changed[key] = list(node.get(key))
+                    changed[key][index] = new
+            if changed:
+                rebuilt = make_element(node.elem_type, **{**node.dict, **changed})
+                if self.positions is not None:
+                    self.positions.copy(node, rebuilt)
+                node = rebuilt
+
+            replacement = self.simplify(node)
+            if replacement is not node:
+                self.folded += 1
+            finished.append(replacement)
+        return finished[0]
+
+    # Returns a simpler node that means the same thing, or the node itself
+    def simplify(self, node):
+        kind = node.elem_type
+        if kind in BINARY_OPERATORS:
+            op1 = node.get('op1')
+            op2 = node.get('op2')
+            if is_literal(op1) and is_literal(op2):
+                return self.evaluate(node, lambda: evaluate_binary(kind, op1.get('val'), op2.get('val'), raise_fold_error))
+            return self.apply_identities(node, kind, op1, op2)
+        if kind in UNARY_OPERATORS:
+            op1 = node.get('op1')
+            if is_literal(op1):
+                return self.evaluate(node, lambda: evaluate_unary(kind, op1.get('val'), raise_fold_error))
+            # --x and !!x
+            if op1.elem_type == kind:
+                inner = op1.get('op1')
+                if (kind == InterpreterBase.NEG_NODE and is_int_expression(inner)) or (
+                    kind == InterpreterBase.NOT_NODE and is_bool_expression(inner)
+                ):
+                    return inner
+            return node
+        if kind == InterpreterBase.CONVERT_NODE:
+            expr = node.get('expr')
+            if is_literal(expr):
+                return self.evaluate(node, lambda: convert(node.get('to_type'), expr.get('val'), raise_fold_error))
+        return node
+
+    # Evaluates a constant node now, unless it would raise or can't be written as a literal
+    def evaluate(self, node, compute):
+        try:
+            literal = make_literal(compute())
+        except FoldError:
+            return node
+        if literal is None:
+            return node
+        if self.positions is not None:
+            self.positions.copy(node, literal)
+        return literal
+
+    def apply_identities(self, node, kind, op1, op2):
+        if kind == '+':
+            if is_literal_value(op2, 0) and is_int_expression(op1):
+                return op1
+            if is_literal_value(op1, 0) and is_int_expression(op2):
+                return op2
+        elif kind == '-':
+            if is_literal_value(op2, 0) and is_int_expression(op1):
+                return op1
+        elif kind == '*':
+            if is_literal_value(op2, 1) and is_int_expression(op1):
+                return op1
+            if is_literal_value(op1, 1) and is_int_expression(op2):
+                return op2
+        elif kind == '&&':
+            if is_literal_value(op2, True) and is_bool_expression(op1):
+                return op1
+            if is_literal_value(op1, True) and is_bool_expression(op2):
+                return op2
+        elif kind == '||':
+            if is_literal_value(op2, False) and is_bool_expression(op1):
+                return op1
+            if is_literal_value(op1, False) and is_bool_expression(op2):
+                return op2
+        return node
+
+
+# Convenience wrapper, returns the optimized AST
+def fold_constants(ast, positions=None):
+    return ConstantFolder(positions).fold_program(ast)
@@ -1,7 +1,17 @@
-from element import Element
+from element import (
+    Program, Interface, FieldFunc, FieldVar, Func, Arg, Assignment, VarDef, BvarDef, If, While, Return, FCall,
+    QualifiedName, Int, String, Bool, Nil, EmptyObj, Closure, Convert, Neg, Not, BinaryOperation,
+)
 from brewlex import *
 from intbase import InterpreterBase
 from ply import yacc
+from brewcache import ParseCache
+from brewastfile import VERSION as AST_FILE_VERSION
+import brewlex
+import element
+import hashlib
+import sys
+import threading
 
 # Parsing rules
 
@@ -15,6 +25,22 @@ precedence = (
 )
 
 
+# Where positions are being recorded during parse_program, if anywhere
+recording = None
+# Held while parsing
+parse_lock = threading.Lock()
+
+
+# Records that a node starts where symbol index of the rule does. That's also passed up as where
+# the rule's own symbol starts, so rules with a node that starts with an expression can use it
+def located(p, node, index):
+    offset = p.lexpos(index)
+    p.set_lexpos(0, offset)
+    if recording is not None:
+        recording.record(node, offset)
+    return node
+
+
 def collapse_items(p, group_index, singleton_index):
     if len(p) == 2:
         p[0] = [p[1]]
@@ -27,9 +53,9 @@ def p_program(p):
     """program : interfaces funcs
     | funcs"""
     if len(p) == 3:
-        p[0] = Element(InterpreterBase.PROGRAM_NODE, interfaces=p[1], functions=p[2])
+        p[0] = Program(interfaces=p[1], functions=p[2])
     else:
-        p[0] = Element(InterpreterBase.PROGRAM_NODE, functions=p[1])
+        p[0] = Program(functions=p[1])
 
 def p_interfaces(p):
     """interfaces : interfaces interface
@@ -38,7 +64,7 @@ def p_interfaces(p):
 
 def p_interface(p):
     "interface : INTERFACE NAME LBRACE fields RBRACE"
-    p[0] = Element(InterpreterBase.INTERFACE_NODE, name=p[2], fields=p[4])
+    p[0] = Interface(name=p[2], fields=p[4])
 
 def p_fields(p):
     """fields : fields field
@@ -54,13 +80,13 @@ def p_field_function(p):
     """field_function : NAME LPAREN formal_args RPAREN SEMI
     | NAME LPAREN RPAREN SEMI"""
     if len(p) == 6:  # with parameters
-        p[0] = Element(InterpreterBase.FIELD_FUNC_NODE, name=p[1], params=p[3])
+        p[0] = FieldFunc(name=p[1], params=p[3])
     else:  # no parameters
-        p[0] = Element(InterpreterBase.FIELD_FUNC_NODE, name=p[1], params=[])
+        p[0] = FieldFunc(name=p[1], params=[])
 
 def p_field_variable(p):
     "field_variable : NAME SEMI"
-    p[0] = Element(InterpreterBase.FIELD_VAR_NODE, name=p[1])
+    p[0] = FieldVar(name=p[1])
 
 
 def p_funcs(p):
@@ -72,9 +98,9 @@ def p_func(p):
     """func : DEF NAME LPAREN formal_args RPAREN LBRACE statements RBRACE
     | DEF NAME LPAREN RPAREN LBRACE statements RBRACE"""
     if len(p) == 9:  # handle with 1+ formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=p[4], statements=p[7])
+        p[0] = located(p, Func(name=p[2], args=p[4], statements=p[7]), 1)
     else:  # handle no formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=[], statements=p[6])
+        p[0] = located(p, Func(name=p[2], args=[], statements=p[6]), 1)
 
 def p_formal_args(p):
     """formal_args : formal_args COMMA formal_arg
@@ -85,9 +111,9 @@ def p_formal_arg(p):
     """formal_arg : NAME
     | AMP NAME"""
     if len(p) == 2:  # NAME only
-        p[0] = Element(InterpreterBase.ARG_NODE, name=p[1], ref=False)
+        p[0] = located(p, Arg(name=p[1], ref=False), 1)
     else:  # AMP NAME
-        p[0] = Element(InterpreterBase.ARG_NODE, name=p[2], ref=True)
+        p[0] = located(p, Arg(name=p[2], ref=True), 1)
 
 def p_statements(p):
     """statements : statements statement
@@ -101,15 +127,15 @@ def p_statement___assign(p):
 
 def p_assign(p):
     "assign : qualified_name ASSIGN expression"
-    p[0] = Element("=", var=p[1], expression=p[3])
+    p[0] = located(p, Assignment(var=p[1], expression=p[3]), 1)
 
 def p_statement___fvar(p):
     "statement : VAR qualified_name_no_dot SEMI" 
-    p[0] = Element(InterpreterBase.VAR_DEF_NODE, name=p[2])
+    p[0] = located(p, VarDef(name=p[2]), 1)
 
 def p_statement___bvar(p):
     "statement : BVAR qualified_name_no_dot SEMI"    
-    p[0] = Element(InterpreterBase.BVAR_DEF_NODE, name=p[2])
+    p[0] = located(p, BvarDef(name=p[2]), 1)
 
 def p_qualified_name(p):
     """qualified_name : qualified_name DOT NAME
@@ -118,6 +144,8 @@ def p_qualified_name(p):
         p[0] = p[1] + "." + p[3]
     else:
         p[0] = p[1]
+    # Names are just strings, but calls and assignments need to know where theirs starts
+    p.set_lexpos(0, p.lexpos(1))
 
 def p_qualified_name_no_dot(p):
     """qualified_name_no_dot : NAME"""
@@ -128,23 +156,22 @@ def p_statement_if(p):
     | IF LPAREN expression RPAREN LBRACE statements RBRACE ELSE LBRACE statements RBRACE
     """
     if len(p) == 8:
-        p[0] = Element(
-            InterpreterBase.IF_NODE,
+        p[0] = If(
             condition=p[3],
             statements=p[6],
             else_statements=None,
         )
     else:
-        p[0] = Element(
-            InterpreterBase.IF_NODE,
+        p[0] = If(
             condition=p[3],
             statements=p[6],
             else_statements=p[10],
         )
+    located(p, p[0], 1)
 
 def p_statement_while(p):
     "statement : WHILE LPAREN expression RPAREN LBRACE statements RBRACE"
-    p[0] = Element(InterpreterBase.WHILE_NODE, condition=p[3], statements=p[6])
+    p[0] = located(p, While(condition=p[3], statements=p[6]), 1)
 
 
 def p_statement_expr(p):
@@ -159,30 +186,30 @@ def p_statement_return(p):
         expr = p[2]
     else:
         expr = None
-    p[0] = Element(InterpreterBase.RETURN_NODE, expression=expr)
+    p[0] = located(p, Return(expression=expr), 1)
 
 
 def p_expression_not(p):
     "expression : NOT expression"
-    p[0] = Element(InterpreterBase.NOT_NODE, op1=p[2])
+    p[0] = located(p, Not(op1=p[2]), 1)
 
 
 def p_expression_uminus(p):
     "expression : MINUS expression %prec UMINUS"
-    p[0] = Element(InterpreterBase.NEG_NODE, op1=p[2])
+    p[0] = located(p, Neg(op1=p[2]), 1)
 
 
 def p_expression_int(p):
     "expression : INT LPAREN expression RPAREN"
-    p[0] = Element(InterpreterBase.CONVERT_NODE, to_type = "int", expr=p[3])
+    p[0] = located(p, Convert(to_type = "int", expr=p[3]), 1)
 
 def p_expression_string(p):
     "expression : STR LPAREN expression RPAREN"
-    p[0] = Element(InterpreterBase.CONVERT_NODE, to_type = "str", expr=p[3])
+    p[0] = located(p, Convert(to_type = "str", expr=p[3]), 1)
 
 def p_expression_bool(p):
     "expression : BOOL LPAREN expression RPAREN"
-    p[0] = Element(InterpreterBase.CONVERT_NODE, to_type = "bool", expr=p[3])
+    p[0] = located(p, Convert(to_type = "bool", expr=p[3]), 1)
 
 def p_arith_expression_binop(p):
     """expression : expression EQ expression
@@ -195,61 +222,62 @@ def p_arith_expression_binop(p):
     | expression MINUS expression
     | expression MULTIPLY expression
     | expression DIVIDE expression"""
-    p[0] = Element(p[2], op1=p[1], op2=p[3])
+    p[0] = located(p, BinaryOperation(p[2], op1=p[1], op2=p[3]), 1)
 
 
 def p_expression_group(p):
     "expression : LPAREN expression RPAREN"
     p[0] = p[2]
+    p.set_lexpos(0, p.lexpos(1))
 
 
 def p_expression_and_or(p):
     """expression : expression OR expression
     | expression AND expression"""
-    p[0] = Element(p[2], op1=p[1], op2=p[3])
+    p[0] = located(p, BinaryOperation(p[2], op1=p[1], op2=p[3]), 1)
 
 
 def p_expression_number(p):
     "expression : NUMBER"
-    p[0] = Element(InterpreterBase.INT_NODE, val=p[1])
+    p[0] = located(p, Int(val=p[1]), 1)
 
 
 def p_expression_bool_literal(p):
     """expression : TRUE
     | FALSE"""
     bool_val = p[1] == InterpreterBase.TRUE_DEF
-    p[0] = Element(InterpreterBase.BOOL_NODE, val=bool_val)
+    p[0] = located(p, Bool(val=bool_val), 1)
 
 
 def p_expression_string_literal(p):
     "expression : STRING"
-    p[0] = Element(InterpreterBase.STRING_NODE, val=p[1])
+    p[0] = located(p, String(val=p[1]), 1)
 
 
 def p_expression_closure(p):
     "expression : CLOSURE NAME"
-    p[0] = Element(InterpreterBase.CLOSURE_NODE, args=p[2])
+    p[0] = located(p, Closure(args=p[2]), 1)
 
 def p_expression_empty_obj(p):
     "expression : AT"
-    p[0] = Element(InterpreterBase.EMPTY_OBJ_NODE)
+    p[0] = located(p, EmptyObj(), 1)
 
 def p_expression_nil(p):
     "expression : NIL"
-    p[0] = Element(InterpreterBase.NIL_NODE)
+    p[0] = located(p, Nil(), 1)
 
 def p_func_call(p):
     """expression : qualified_name LPAREN args RPAREN
     | qualified_name LPAREN RPAREN"""
     if len(p) == 5:
-        p[0] = Element(InterpreterBase.FCALL_NODE, name=p[1], args=p[3])
+        p[0] = located(p, FCall(name=p[1], args=p[3]), 1)
     else:
-        p[0] = Element(InterpreterBase.FCALL_NODE, name=p[1], args=[])
+        p[0] = located(p, FCall(name=p[1], args=[]), 1)
 
 
 def p_expression_variable(p):
     "expression : qualified_name"
-    p[0] = Element(InterpreterBase.QUALIFIED_NAME_NODE, name=p[1])
+    p[0] = located(p, QualifiedName(name=p[1]), 1)
 
 
 def p_expression_args(p):
@@ -262,9 +290,9 @@ def p_expression_lambda(p):
     """expression : LAMBDA LPAREN formal_args RPAREN LBRACE statements RBRACE
     | LAMBDA LPAREN RPAREN LBRACE statements RBRACE"""
     if len(p) == 8:
-         p[0] = Element(InterpreterBase.FUNC_NODE, name=p[1], args=p[3], statements=p[6])
+         p[0] = located(p, Func(name=p[1], args=p[3], statements=p[6]), 1)
     else:
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[1], args=[], statements=p[5])
+        p[0] = located(p, Func(name=p[1], args=[], statements=p[5]), 1)
 
 
 def p_error(p):
@@ -275,11 +303,25 @@ def p_error(p):
 
 
 # exported function
-def parse_program(program, plot = False):
-    reset_lineno()
-    ast = yacc.parse(program)
+# positions, a SourcePositions for program, gets where every node starts (see brewpositions.py)
+# cache_dir, a directory for a ParseCache, skips parsing programs that have been parsed before (see brewcache.py)
+def parse_program(program, plot = False, positions = None, cache_dir = None):
+    global recording
+    cache = ParseCache(cache_dir, GRAMMAR_SIGNATURE) if cache_dir is not None else None
+    ast = cache.load(program, positions) if cache is not None else None
     if ast is None:
-        raise SyntaxError("Syntax error")
+        # The lexer, the parser and recording are all shared, so only one thread parses at a time
+        with parse_lock:
+            reset_lineno()
+            recording = positions
+            try:
+                ast = yacc.parse(program)
+            finally:
+                recording = None
+        if ast is None:
+            raise SyntaxError("Syntax error")
+        if cache is not None:
+            cache.store(program, ast, positions)
     
     # Plot the AST if requested
     if plot:
@@ -289,5 +331,17 @@ def parse_program(program, plot = False):
     return ast
 
 
+# What the ASTs parse_program makes depend on: the lexer, the grammar, the node classes and the format they're
+# cached in. Cache entries are keyed by this as well as the source
+def grammar_signature():
+    digest = hashlib.sha256(f"{AST_FILE_VERSION}".encode())
+    for module in (brewlex, sys.modules[__name__], element):
+        with open(module.__file__, "rb") as handle:
+            digest.update(handle.read())
+    return digest.hexdigest()
+
+
+GRAMMAR_SIGNATURE = grammar_signature()
+
 # generate our parser
 yacc.yacc() # yacc.yacc(debug=True, debuglog=open("parse.log", "w"))
@@ -0,0 +1,91 @@
+"""
+Source positions for AST nodes, kept beside the AST instead of in it.
+
+parse_program(program, positions=SourcePositions(program)) records where every
+node starts as one int, its offset into the source, in a dict keyed by id(node).
+Nodes stay exactly as they were (no extra dict entries, nothing more to copy or
+compare), and parsing only does one dict store per node on top of what PLY does
+anyway. Lines and columns are worked out from the offset when someone asks, with
+a table of line starts that's built the first time it's needed.
+
+Keys are ids, so the table is only good while the AST it was filled from is
+alive. fold_constants copies positions over to the nodes it builds, then drops
+the entries of the nodes it folded away, since their ids get reused once they're
+freed. After that there's one entry per node of the folded AST that has a position.
+"""
+
+import bisect
+
+from element import Element
+
+
+class SourcePositions:
+    __slots__ = ('source', 'offsets', 'line_starts')
+
+    def __init__(self, source):
+        self.source = source
+        # id(node) -> offset of its first character in source
+        self.offsets = {}
+        self.line_starts = None
+
+    def record(self, node, offset):
+        self.offsets[id(node)] = offset
+
+    # A node made to replace another one starts where that one did
+    def copy(self, old, new):
+        offset = self.offsets.get(id(old))
+        if offset is not None:
+            self.offsets[id(new)] = offset
+
+    # Drops the entries of every node that isn't in the tree under root. Has to be called while the nodes
+    # that were replaced are still alive, or one of the tree's nodes could have the id of one of them
+    def retain(self, root):
+        offsets = {}
+        pending = [root]
+        while pending:
+            node = pending.pop()
+            offset = self.offsets.get(id(node))
+            if offset is not None:
+                offsets[id(node)] = offset
+            for key in node.field_names:
+                value = getattr(node, key)
+                if isinstance(value, Element):
+                    pending.append(value)
+                elif isinstance(value, list):
+                    pending.extend(item for item in value if isinstance(item, Element))
+        self.offsets = offsets
+
+    def offset(self, node):
+        return self.offsets.get(id(node))
+
+    # (line, column) of a node, both counting from 1, or None if it has no position
+    def position(self, node):
+        offset = self.offsets.get(id(node))
+        if offset is None:
+            return None
+        line_starts = self.line_starts
+        if line_starts is None:
+            # Built before it's stored, since interpreters in other threads can be using the same positions
+            line_starts = [0]
+            newline = self.source.find("\n")
+            while newline != -1:
+                line_starts.append(newline + 1)
+                newline = self.source.find("\n", newline + 1)
+            self.line_starts = line_starts
+        line = bisect.bisect_right(line_starts, offset)
+        return line, offset - line_starts[line - 1] + 1
+
+    def line(self, node):
+        position = self.position(node)
+        return position[0] if position is not None else None
+
+
+# The node with the latest position in the innermost frame (from frame outwards) whose locals have
+# any, for finding out what some code was working on when it raised an error
+def innermost_node(frame, positions):
+    while frame is not None:
+        nodes = [value for value in frame.f_locals.values() if isinstance(value, Element) and positions.offset(value) is not None]
+        if nodes:
+            return max(nodes, key=positions.offset)
+        frame = frame.f_back
+    return None
@@ -0,0 +1,295 @@
+"""
+Sampling profiler for Brewin programs.
+
+Interpreter(profile=True) runs a Profiler next to the program. It's a daemon thread
+that wakes up every SAMPLE_INTERVAL seconds, grabs the Python frame stack of the
+thread running the program with sys._current_frames(), and asks the engine which
+Brewin statement that stack is in the middle of (every engine has a
+locate_statement(frame) for this). The program itself doesn't count or record
+anything, so profiling only costs what the sampler thread takes, which is small
+since it's asleep almost all the time. Python only switches threads every
+sys.getswitchinterval() seconds (5ms by default) while the program is running, so
+samples don't come any faster than that whatever the interval, and SAMPLE_INTERVAL
+is the same 5ms.
+
+When the run ends, get_profile() on the interpreter returns a Profile with the
+samples per statement. Its report() adds them up per function too and lists the
+hottest of both, with the line each one starts on when the run had source
+positions (see brewpositions.py).
+
+    python brewprofile.py program.br [--engine=<name>] [--interval=<seconds>] [--top=<n>]
+"""
+
+import sys
+import threading
+from collections import Counter
+
+from intbase import InterpreterBase
+
+# Seconds between samples
+SAMPLE_INTERVAL = 0.005
+# Rows report() shows in each table
+REPORT_LIMIT = 10
+# Longest a statement gets in the report before it's cut off
+DESCRIPTION_WIDTH = 60
+
+
+class Profiler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.thread = None
+
+    # Starts sampling the thread that calls this. locate maps that thread's innermost Python frame
+    # to the statement being run, or None
+    def start(self, locate):
+        self.locate = locate
+        self.counts = Counter()
+        self.samples = 0
+        self.target = threading.get_ident()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, name="brewin-profiler", daemon=True)
+        self.thread.start()
+
+    # Stops sampling and returns what was collected for the program with this AST (and these positions)
+    def stop(self, ast, positions=None):
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        return Profile(self.counts, self.samples, self.interval, ast, positions)
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            if frame is None:
+                continue
+            self.samples += 1
+            # The program keeps running while we look at its frames, so a frame can be half set up.
+            # A sample we can't place is just left out
+            try:
+                statement = self.locate(frame)
+            except Exception:  # pylint: disable=broad-except
+                statement = None
+            if statement is not None:
+                self.counts[statement] += 1
+
+
+# Innermost Python frame running some code, or None
+def find_frame(frame, code):
+    while frame is not None:
+        if frame.f_code is code:
+            return frame
+        frame = frame.f_back
+    return None
+
+
+class Profile:
+    def __init__(self, counts, samples, interval, ast, positions=None):
+        # statement node -> samples taken while it ran
+        self.counts = counts
+        # All samples, including ones that didn't land on a statement (parsing, compiling, ...)
+        self.samples = samples
+        self.interval = interval
+        self.owners = function_owners(ast)
+        self.positions = positions
+
+    # Samples per function, keyed by its func node
+    def functions(self):
+        totals = Counter()
+        for statement, count in self.counts.items():
+            totals[self.owners.get(statement)] += count
+        return totals
+
+    # Samples per source line, for statements that have one
+    def lines(self):
+        totals = Counter()
+        if self.positions is not None:
+            for statement, count in self.counts.items():
+                line = self.positions.line(statement)
+                if line is not None:
+                    totals[line] += count
+        return totals
+
+    # Where a statement or function is, for the report
+    def location(self, node):
+        line = self.positions.line(node) if self.positions is not None and node is not None else None
+        return f"line {line}" if line is not None else ""
+
+    # The hottest functions and statements, as a table for people
+    def report(self, limit=REPORT_LIMIT):
+        lines = [f"{self.samples} samples, one every {self.interval * 1000:g}ms"]
+        if not self.samples:
+            return lines[0]
+        lines.append("Functions:")
+        for func_node, count in self.functions().most_common(limit):
+            lines.append(f"  {count / self.samples:6.1%}  {function_label(func_node):<16} {self.location(func_node)}")
+        lines.append("Statements:")
+        for statement, count in self.counts.most_common(limit):
+            owner = function_label(self.owners.get(statement))
+            lines.append(f"  {count / self.samples:6.1%}  {owner:<16} {self.location(statement):<10} {describe(statement)}")
+        return "\n".join(lines)
+
+
+# statement node -> the func node (named function or lambda) it's directly in
+def function_owners(ast):
+    owners = {}
+    stack = list(ast.get('functions') or [])
+    while stack:
+        func_node = stack.pop()
+        statements = list(func_node.get('statements') or [])
+        while statements:
+            node = statements.pop()
+            owners[node] = func_node
+            statements.extend(node.get('statements') or [])
+            statements.extend(node.get('else_statements') or [])
+            stack.extend(lambdas_in(node))
+    return owners
+
+
+# Lambdas in a statement's expressions, not counting ones inside other lambdas or nested blocks
+def lambdas_in(statement):
+    found = []
+    stack = [statement.get(key) for key in ('expression', 'condition')]
+    stack.extend(statement.get('args') or [])
+    while stack:
+        node = stack.pop()
+        if node is None:
+            continue
+        if node.elem_type == InterpreterBase.FUNC_NODE:
+            found.append(node)
+            continue
+        stack.extend(children(node))
+    return found
+
+
+# Every statement and expression node -> the statement it's part of, a statement is part of itself.
+# For engines whose frames only show the node they're on, which can be an expression
+def enclosing_statements(ast):
+    enclosing = {}
+    statements = []
+    for func_node in ast.get('functions') or []:
+        statements.extend(func_node.get('statements') or [])
+    while statements:
+        statement = statements.pop()
+        enclosing[statement] = statement
+        statements.extend(statement.get('statements') or [])
+        statements.extend(statement.get('else_statements') or [])
+        stack = [statement.get(key) for key in ('expression', 'condition')]
+        stack.extend(statement.get('args') or [])
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            enclosing[node] = statement
+            if node.elem_type == InterpreterBase.FUNC_NODE:
+                statements.extend(node.get('statements') or [])
+                continue
+            stack.extend(children(node))
+    return enclosing
+
+
+# An expression's operands and arguments. closure f keeps the function's name in 'args', so that one has none
+def children(node):
+    if node.elem_type == InterpreterBase.CLOSURE_NODE:
+        return []
+    return [node.get('op1'), node.get('op2'), node.get('expr'), *(node.get('args') or [])]
+
+
+def function_label(func_node):
+    if func_node is None:
+        return "?"
+    return f"{func_node.get('name')}/{len(func_node.get('args') or [])}"
+
+
+# A statement as a line of Brewin, close enough to find it in the source
+def describe(statement):
+    kind = statement.elem_type
+    if kind == InterpreterBase.VAR_DEF_NODE:
+        text = f"var {statement.get('name')};"
+    elif kind == InterpreterBase.ASSIGNMENT_NODE:
+        text = f"{statement.get('var')} = {unparse(statement.get('expression'))};"
+    elif kind == InterpreterBase.FCALL_NODE:
+        text = f"{unparse(statement)};"
+    elif kind == InterpreterBase.IF_NODE:
+        text = f"if ({unparse(statement.get('condition'))}) {{"
+    elif kind == InterpreterBase.WHILE_NODE:
+        text = f"while ({unparse(statement.get('condition'))}) {{"
+    elif kind == InterpreterBase.RETURN_NODE:
+        expression = statement.get('expression')
+        text = "return;" if expression is None else f"return {unparse(expression)};"
+    else:
+        text = kind
+    if len(text) > DESCRIPTION_WIDTH:
+        text = text[:DESCRIPTION_WIDTH - 3] + "..."
+    return text
+
+
+# An expression as Brewin source. Past a few levels of nesting it's just ...
+def unparse(node, depth=0):
+    if depth > 4:
+        return "..."
+    kind = node.elem_type
+    if kind == InterpreterBase.INT_NODE:
+        return str(node.get('val'))
+    if kind == InterpreterBase.STRING_NODE:
+        return f'"{node.get("val")}"'
+    if kind == InterpreterBase.BOOL_NODE:
+        return "true" if node.get('val') else "false"
+    if kind == InterpreterBase.NIL_NODE:
+        return "nil"
+    if kind == InterpreterBase.QUALIFIED_NAME_NODE:
+        return node.get('name')
+    if kind == InterpreterBase.EMPTY_OBJ_NODE:
+        return "@"
+    if kind == InterpreterBase.CLOSURE_NODE:
+        return f"closure {node.get('args')}"
+    if kind == InterpreterBase.FUNC_NODE:
+        return f"{node.get('name')}(...) {{ ... }}"
+    if kind == InterpreterBase.FCALL_NODE:
+        return f"{node.get('name')}({', '.join(unparse(arg, depth + 1) for arg in node.get('args') or [])})"
+    if kind == InterpreterBase.CONVERT_NODE:
+        return f"{node.get('to_type')}({unparse(node.get('expr'), depth + 1)})"
+    if kind == InterpreterBase.NEG_NODE:
+        return f"-{operand(node.get('op1'), depth + 1)}"
+    if kind == InterpreterBase.NOT_NODE:
+        return f"!{operand(node.get('op1'), depth + 1)}"
+    return f"{operand(node.get('op1'), depth + 1)} {kind} {operand(node.get('op2'), depth + 1)}"
+
+
+# One side of a binary operator, in parentheses if it's another binary operator
+def operand(node, depth):
+    if node.get('op2') is not None:
+        return f"({unparse(node, depth)})"
+    return unparse(node, depth)
+
+
+def main(argv):
+    # Imported here since the interpreter imports this module
+    from interpreterv1 import Interpreter
+
+    options = {"engine": "tree", "interval": str(SAMPLE_INTERVAL), "top": str(REPORT_LIMIT)}
+    files = []
+    for arg in argv:
+        if arg.startswith("--") and "=" in arg:
+            name, value = arg[2:].split("=", 1)
+            options[name] = value
+        else:
+            files.append(arg)
+    if len(files) != 1:
+        print(__doc__.strip().splitlines()[-1].strip(), file=sys.stderr)
+        return 2
+    with open(files[0], encoding="utf-8") as handle:
+        program = handle.read()
+    interpreter = Interpreter(engine=options["engine"], profile=float(options["interval"]))
+    try:
+        interpreter.run(program)
+    finally:
+        # The report goes to stderr so it doesn't get mixed into the program's output. A program that failed
+        # before it started running (a syntax error, an undefined name) has no profile, only its error
+        profile = interpreter.get_profile()
+        if profile is not None:
+            print(profile.report(int(options["top"])), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
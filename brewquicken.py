@@ -0,0 +1,95 @@
+"""
+Adaptive quickening of binary operators for the tree walker.
+
+Every binary operator node gets a BinarySite (kept in the node's site slot) the
+first time it runs. While the
+site is warming up, operands go through brewops.evaluate_binary like always, and
+the site counts how many times in a row both operands had the same type. Once
+that's happened QUICKEN_AFTER times for a type that has a specialized handler
+for the operator (int/int for arithmetic and comparisons, str/str and bool/bool
+for equality, bool/bool for && and ||), the site quickens: it remembers that
+type as its guard and the plain Python operator as its handler. From then on
+the caller checks the guard inline and calls the handler directly, with no
+operator dispatch and no type checks beyond the guard.
+
+The guard and handler are one tuple, replaced whole, because parsed programs
+are shared by every Interpreter in the process and so are their sites: a thread
+reading quick gets a guard and the handler that goes with it, never a guard
+from one state and a handler from another. The warm-up counters aren't worth
+locking, a lost update just means quickening a little later.
+
+If the operands stop matching the guard the site deoptimizes back to the generic
+path and starts counting again. A site that has deoptimized MAX_DEOPTS times is
+left generic for good, so operators that really are polymorphic don't keep
+flipping back and forth.
+"""
+
+import operator
+
+from brewops import evaluate_binary
+
+# Same-typed operand pairs in a row before a site quickens
+QUICKEN_AFTER = 8
+# Deoptimizations before a site gives up on quickening
+MAX_DEOPTS = 4
+
+# (operator, operand type) -> handler that needs no checks once both operands are that type
+# / isn't in here since dividing by 0 still needs its check
+SPECIALIZED_OPERATORS = {
+    ('+', int): operator.add,
+    ('-', int): operator.sub,
+    ('*', int): operator.mul,
+    ('<', int): operator.lt,
+    ('<=', int): operator.le,
+    ('>', int): operator.gt,
+    ('>=', int): operator.ge,
+    ('==', int): operator.eq,
+    ('!=', int): operator.ne,
+    ('==', str): operator.eq,
+    ('!=', str): operator.ne,
+    ('==', bool): operator.eq,
+    ('!=', bool): operator.ne,
+    ('&&', bool): operator.and_,
+    ('||', bool): operator.or_,
+}
+
+
+# (guard, handler) of a site that hasn't quickened
+GENERIC = (None, None)
+
+
+class BinarySite:
+    __slots__ = ('op', 'quick', 'warm_type', 'count', 'deopts')
+
+    def __init__(self, op):
+        self.op = op
+        # (operand type the handler is specialized for, handler). The type is None until the site quickens,
+        # and since no value's type is None the inline guard check simply fails until then
+        self.quick = GENERIC
+        # Type seen in a row while warming up, and how many times
+        self.warm_type = None
+        self.count = 0
+        self.deopts = 0
+
+    # The slow path, for when the inline guard check failed
+    def evaluate(self, a, b, error):
+        if self.quick is not GENERIC:
+            self.deoptimize()
+        operand_type = type(a)
+        if self.deopts < MAX_DEOPTS and operand_type is type(b) and (self.op, operand_type) in SPECIALIZED_OPERATORS:
+            if operand_type is self.warm_type:
+                self.count += 1
+            else:
+                self.warm_type = operand_type
+                self.count = 1
+            if self.count >= QUICKEN_AFTER:
+                self.quick = (operand_type, SPECIALIZED_OPERATORS[(self.op, operand_type)])
+        else:
+            self.count = 0
+        return evaluate_binary(self.op, a, b, error)
+
+    def deoptimize(self):
+        self.quick = GENERIC
+        self.warm_type = None
+        self.count = 0
+        self.deopts += 1
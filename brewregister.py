@@ -0,0 +1,671 @@
+"""
+Register-based VM backend for Brewin.
+
+RegisterCompiler assigns every variable, constant and expression temporary a
+numbered register at compile time (variables simply use their resolver slots).
+Instructions name their operand registers directly, so `a = (b + 1) - c` is two
+instructions that read b, the constant and c straight out of the frame instead of
+pushing and popping a value stack. Each function has its own frame layout, and a
+call takes a frame from the function's pool of finished ones, only copying its
+template when the pool is empty. CALL and RETURN switch frames inside the dispatch
+loop, so Brewin calls don't nest Python calls. A variable a lambda captures keeps
+a Cell in its register, and the lambda's frame gets the cells it captured right
+after its parameters.
+
+Frame layout: [parameters and variables][constants][temporaries]
+"""
+
+from intbase import InterpreterBase, ErrorType
+from element import Element
+from brewresolve import resolve_program
+from brewprofile import find_frame
+from brewobjects import BrewinObject, FieldCache, FunctionValue, Cell, cell_getter, check_callable
+from brewops import BINARY_OPERATORS, evaluate_binary, evaluate_unary, convert, to_string, check_condition
+
+# Opcodes, every instruction is a tuple (op, a, b, c, d)
+ADD = 0             # reg[a] = reg[b] + reg[c], ADD through GREATER_EQ only take ints
+SUBTRACT = 1
+MULTIPLY = 2
+DIVIDE = 3
+LESS = 4
+LESS_EQ = 5
+GREATER = 6
+GREATER_EQ = 7
+JUMP_IF_FALSE = 8   # jump to b if reg[a] is false (it must be a bool)
+JUMP = 9            # jump to a
+BINARY = 10         # reg[a] = reg[b] <operator d> reg[c] for every other binary operator
+NEGATE = 11         # reg[a] = -reg[b]
+NOT = 12            # reg[a] = !reg[b]
+CONVERT = 13        # reg[a] = c(reg[b]), c is the type to convert to
+MOVE = 14           # reg[a] = reg[b]
+DEFINE = 15         # reg[a] = None
+PRINT = 16          # print the registers in tuple a
+INPUTI = 17         # reg[a] = int read from input, after printing reg[b] if b >= 0
+FAIL = 18           # raise the (error type, description) in a
+HALT = 19
+CALL = 20           # reg[a] = functions[b](the registers in tuple c)
+RETURN = 21         # return reg[a] to the caller
+NEW_OBJECT = 22     # reg[a] = a new empty object
+GET_FIELD = 23      # reg[a] = reg[b].field, c is the FieldCache for this site
+SET_FIELD = 24      # reg[a].field = reg[c], b is the FieldCache for this site
+CHECK_CALL = 25     # reg[a] has to be a function taking b parameters
+CALL_VALUE = 26     # reg[a] = the function in reg[b](the registers in tuple c)
+LOAD_CELL = 27      # reg[a] = the value in the cell in reg[b]
+STORE_CELL = 28     # the cell in reg[a] gets reg[b]
+MAKE_CELL = 29      # reg[a] = a cell holding reg[a]
+MAKE_CLOSURE = 30   # reg[a] = function b as a value, with the cells c picks out of the frame
+CHARGE = 31         # take a steps off the budget, only emitted when the interpreter has one
+COUNT = 32          # a[b] += 1, a is one of the interpreter's counters. Only emitted with stats on, and
+                    # last in the dispatch loop so the other opcodes don't check for it
+TRACE = 33          # a(b), a records statement b in the trace. Only emitted with trace_output on, after COUNT
+TRACE_WRITE = 34    # a((b, reg[c])), records that assignment b stores reg[c]
+
+OPCODE_NAMES = {
+    ADD: "ADD",
+    SUBTRACT: "SUBTRACT",
+    MULTIPLY: "MULTIPLY",
+    DIVIDE: "DIVIDE",
+    LESS: "LESS",
+    LESS_EQ: "LESS_EQ",
+    GREATER: "GREATER",
+    GREATER_EQ: "GREATER_EQ",
+    JUMP_IF_FALSE: "JUMP_IF_FALSE",
+    JUMP: "JUMP",
+    BINARY: "BINARY",
+    NEGATE: "NEGATE",
+    NOT: "NOT",
+    CONVERT: "CONVERT",
+    MOVE: "MOVE",
+    DEFINE: "DEFINE",
+    PRINT: "PRINT",
+    INPUTI: "INPUTI",
+    FAIL: "FAIL",
+    HALT: "HALT",
+    CALL: "CALL",
+    RETURN: "RETURN",
+    NEW_OBJECT: "NEW_OBJECT",
+    GET_FIELD: "GET_FIELD",
+    SET_FIELD: "SET_FIELD",
+    CHECK_CALL: "CHECK_CALL",
+    CALL_VALUE: "CALL_VALUE",
+    LOAD_CELL: "LOAD_CELL",
+    STORE_CELL: "STORE_CELL",
+    MAKE_CELL: "MAKE_CELL",
+    MAKE_CLOSURE: "MAKE_CLOSURE",
+    CHARGE: "CHARGE",
+    COUNT: "COUNT",
+    TRACE: "TRACE",
+    TRACE_WRITE: "TRACE_WRITE",
+}
+
+# Operators with their own int-only opcode, everything else goes through BINARY
+INT_OPCODES = {
+    '+': ADD,
+    '-': SUBTRACT,
+    '*': MULTIPLY,
+    '/': DIVIDE,
+    '<': LESS,
+    '<=': LESS_EQ,
+    '>': GREATER,
+    '>=': GREATER_EQ,
+}
+INT_OPCODE_OPERATORS = {opcode: op for op, opcode in INT_OPCODES.items()}
+
+# Literal nodes, nil has no 'val' so it's the constant None
+VALUE_NODES = (InterpreterBase.INT_NODE, InterpreterBase.STRING_NODE, InterpreterBase.BOOL_NODE, InterpreterBase.NIL_NODE)
+
+
+class RegisterFunction:
+    def __init__(self, name, arity):
+        self.name = name
+        self.arity = arity
+        # Filled in once it's compiled
+        self.entry = 0
+        self.frame_template = []
+        # What the function is when it's used as a value
+        self.value = FunctionValue(name, arity, self)
+        # Frames from calls that have finished, constants are still in place
+        self.pool = []
+
+
+class RegisterProgram:
+    def __init__(self, vm, code, functions, positions):
+        self.vm = vm
+        self.code = code
+        self.functions = functions
+        # The statement each instruction came from (None for the call to main)
+        self.positions = positions
+
+    # Runs the program, starting at the top of the code (which calls main)
+    def __call__(self):
+        self.vm.execute(self)
+
+    # Human readable listing, one instruction per line
+    def disassemble(self):
+        entries = {function.entry: function for function in self.functions}
+        lines = []
+        for pc, (op, a, b, c, d) in enumerate(self.code):
+            if pc in entries:
+                lines.append(f"{entries[pc].name}/{entries[pc].arity}:")
+            if op in (COUNT, TRACE, TRACE_WRITE):
+                # The counter or the trace itself would be a wall of text
+                lines.append(f"{pc:4} {OPCODE_NAMES[op]:<12} {b.elem_type} {c}")
+            else:
+                lines.append(f"{pc:4} {OPCODE_NAMES[op]:<12} {a} {b} {c} {d}")
+        return "\n".join(lines)
+
+
+class RegisterCompiler:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.code = []
+        self.positions = []
+        # Statement being compiled, what emit() records for each instruction
+        self.statement = None
+
+    # Program Node
+    def compile_program(self, ast):
+        self.resolution = resolve_program(ast, self.interpreter.error)
+        # Function table, indexes into it are what CALL instructions carry
+        self.functions = []
+        self.function_index = {}
+        self.function_index_by_node = {}
+        for key, func in self.resolution.functions.items():
+            self.function_index[key] = len(self.functions)
+            self.function_index_by_node[func] = len(self.functions)
+            self.functions.append(RegisterFunction(*key))
+
+        # Same rules as Interpreter.get_main_func_node. The main call's result goes in the only
+        # register of the frame the VM starts in
+        if ('main', 0) in self.function_index:
+            self.emit(CALL, 0, self.function_index[('main', 0)], ())
+        else:
+            self.emit(FAIL, (ErrorType.NAME_ERROR, "No main() function was found"))
+        self.emit(HALT)
+
+        # Lambdas found along the way are compiled once the function they're in is done
+        self.lambdas = []
+        for key, func in self.resolution.functions.items():
+            self.compile_func(self.functions[self.function_index[key]], func)
+        while self.lambdas:
+            self.compile_func(*self.lambdas.pop())
+        self.program = RegisterProgram(RegisterVM(self.interpreter), self.code, self.functions, self.positions)
+        return self.program
+
+    # For the profiler: the statement of the instruction the VM in a frame stack is running
+    def locate_statement(self, frame):
+        frame = find_frame(frame, RegisterVM.execute.__code__)
+        if frame is None:
+            return None
+        return self.program.positions[frame.f_locals['ip']]
+
+    # Function Definition Node, falling off the end returns nil
+    def compile_func(self, function, func_node):
+        statements = func_node.get('statements') or []
+
+        # Parameters and variables get the first registers, then constants, then temporaries
+        self.num_vars = self.resolution.frame_size(func_node)
+        self.constants = []
+        self.const_registers = {}
+        self.const_register(None)
+        self.collect_constants(statements)
+        self.first_temp = self.num_vars + len(self.constants)
+        self.next_temp = self.first_temp
+        self.max_temp = self.first_temp
+
+        function.entry = len(self.code)
+        self.emit_charge(func_node)
+        self.emit_count('calls', func_node)
+        # Parameters a lambda captures go in cells first thing
+        for slot in self.resolution.cell_params[func_node]:
+            self.emit(MAKE_CELL, slot)
+        self.compile_statements(statements)
+        self.emit(RETURN, self.const_register(None))
+        function.frame_template = [None] * self.num_vars + self.constants + [None] * (self.max_temp - self.first_temp)
+
+    # Constants get registers up front so the frame template can hold their values. Function
+    # names used as values are constants too
+    def collect_constants(self, nodes):
+        for node in nodes:
+            if node.elem_type in VALUE_NODES:
+                self.const_register(node.get('val'))
+            elif node in self.resolution.function_refs:
+                self.const_register(self.function_value(node))
+            if node.elem_type == InterpreterBase.FUNC_NODE:
+                # A lambda's body is a function of its own with its own constants
+                continue
+            for value in node.dict.values():
+                if isinstance(value, Element):
+                    self.collect_constants([value])
+                elif isinstance(value, list):
+                    self.collect_constants([child for child in value if isinstance(child, Element)])
+
+    def function_value(self, node):
+        return self.functions[self.function_index_by_node[self.resolution.function_refs[node]]].value
+
+    def const_register(self, value):
+        key = (type(value), value)
+        if key not in self.const_registers:
+            self.const_registers[key] = self.num_vars + len(self.constants)
+            self.constants.append(value)
+        return self.const_registers[key]
+
+    # Temporaries are handed out like a stack and released once their value has been used
+    def allocate_temp(self):
+        register = self.next_temp
+        self.next_temp += 1
+        self.max_temp = max(self.max_temp, self.next_temp)
+        return register
+
+    def release_temps(self, mark):
+        self.next_temp = mark
+
+    def emit(self, op, a=0, b=0, c=0, d=0):
+        self.code.append((op, a, b, c, d))
+        self.positions.append(self.statement)
+
+    # Statement Nodes
+    def compile_statement(self, statement_node):
+        outer_statement = self.statement
+        self.statement = statement_node
+        self.emit_count('nodes', statement_node)
+        self.emit_trace(statement_node)
+        kind = statement_node.elem_type
+        mark = self.next_temp
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            self.emit(DEFINE, self.resolution.slot(statement_node))
+            if self.resolution.in_cell(statement_node):
+                self.emit(MAKE_CELL, self.resolution.slot(statement_node))
+        elif kind == InterpreterBase.ASSIGNMENT_NODE:
+            field_names = self.resolution.path(statement_node)[1]
+            if field_names:
+                self.compile_field_assignment(statement_node, field_names)
+            elif self.resolution.in_cell(statement_node):
+                value = self.compile_expression(statement_node.get('expression'))
+                self.emit_trace(statement_node, value)
+                self.emit(STORE_CELL, self.resolution.slot(statement_node), value)
+            else:
+                self.compile_expression(statement_node.get('expression'), self.resolution.slot(statement_node))
+                self.emit_trace(statement_node, self.resolution.slot(statement_node))
+        elif kind == InterpreterBase.FCALL_NODE:
+            self.compile_func_call(statement_node, None, True)
+        elif kind == InterpreterBase.IF_NODE:
+            self.compile_if(statement_node)
+        elif kind == InterpreterBase.WHILE_NODE:
+            self.compile_while(statement_node)
+        elif kind == InterpreterBase.RETURN_NODE:
+            expression_node = statement_node.get('expression')
+            if expression_node is not None:
+                self.emit(RETURN, self.compile_expression(expression_node))
+            else:
+                self.emit(RETURN, self.const_register(None))
+        else:
+            self.emit(FAIL, (ErrorType.TYPE_ERROR, f"Unknown statement type: {kind}"))
+        self.release_temps(mark)
+        self.statement = outer_statement
+
+    def compile_statements(self, statements):
+        for statement_node in statements or []:
+            self.compile_statement(statement_node)
+
+    # a.b.c = ..., the value is computed first, then the object a.b is looked up and its field c set
+    def compile_field_assignment(self, statement_node, field_names):
+        value = self.compile_expression(statement_node.get('expression'))
+        self.emit_trace(statement_node, value)
+        obj = self.compile_field_path(self.variable_register(statement_node), field_names[:-1], None)
+        self.emit(SET_FIELD, obj, FieldCache(field_names[-1]), value)
+
+    # Reads the fields in names one after the other starting from a register, returns the register with the result
+    def compile_field_path(self, source, names, target):
+        if not names:
+            if target is not None and target != source:
+                self.emit(MOVE, target, source)
+                return target
+            return source
+        if target is None:
+            target = self.allocate_temp()
+        for name in names:
+            self.emit(GET_FIELD, target, source, FieldCache(name))
+            source = target
+        return target
+
+    # Steps a function call or loop iteration takes off the budget, at the top of its body
+    def emit_charge(self, node):
+        budget = self.interpreter.budget
+        if budget is not None:
+            self.emit(CHARGE, budget.cost(node))
+
+    # One more run of a node (or call of a function) for the interpreter's counters, if it has them
+    def emit_count(self, counter, node):
+        counts = self.interpreter.counts
+        if counts is not None:
+            self.emit(COUNT, getattr(counts, counter), node)
+
+    # A trace record for a statement, or with value_register for the value an assignment stores, if
+    # the interpreter is tracing
+    def emit_trace(self, node, value_register=None):
+        trace = self.interpreter.trace
+        if trace is None:
+            return
+        if value_register is None:
+            self.emit(TRACE, trace.records.append, node)
+        else:
+            self.emit(TRACE_WRITE, trace.records.append, node, value_register)
+
+    # Jumps are emitted with a placeholder target and patched once it's known
+    def patch_jump(self, pc):
+        op, a, b, c, d = self.code[pc]
+        if op == JUMP:
+            self.code[pc] = (op, len(self.code), b, c, d)
+        else:
+            self.code[pc] = (op, a, len(self.code), c, d)
+
+    # If Statement
+    def compile_if(self, statement_node):
+        mark = self.next_temp
+        condition = self.compile_expression(statement_node.get('condition'))
+        self.release_temps(mark)
+        to_else = len(self.code)
+        self.emit(JUMP_IF_FALSE, condition)
+        self.compile_statements(statement_node.get('statements'))
+        if statement_node.get('else_statements') is None:
+            self.patch_jump(to_else)
+            return
+        to_end = len(self.code)
+        self.emit(JUMP)
+        self.patch_jump(to_else)
+        self.compile_statements(statement_node.get('else_statements'))
+        self.patch_jump(to_end)
+
+    # While Statement
+    def compile_while(self, statement_node):
+        loop_start = len(self.code)
+        mark = self.next_temp
+        condition = self.compile_expression(statement_node.get('condition'))
+        self.release_temps(mark)
+        to_end = len(self.code)
+        self.emit(JUMP_IF_FALSE, condition)
+        self.emit_charge(statement_node)
+        self.compile_statements(statement_node.get('statements'))
+        self.emit(JUMP, loop_start)
+        self.patch_jump(to_end)
+
+    # Function calls. Statement-level calls throw the result away
+    def compile_func_call(self, call_node, target, is_statement=False):
+        func_name = call_node.get('name')
+        args = call_node.get('args') or []
+        if func_name == 'print' and is_statement:
+            registers = tuple(self.compile_expression(arg) for arg in args)
+            self.emit(PRINT, registers)
+            return None
+        if func_name == 'inputi':
+            if len(args) > 1:
+                self.emit(FAIL, (ErrorType.NAME_ERROR, "No inputi() function found that takes > 1 parameter"))
+                return target
+            prompt = self.compile_expression(args[0]) if args else -1
+            if target is None:
+                target = self.allocate_temp()
+            self.emit(INPUTI, target, prompt)
+            return target
+        if self.resolution.is_value_call(call_node):
+            return self.compile_value_call(call_node, target)
+        index = self.function_index.get((func_name, len(args)))
+        if index is None:
+            self.emit(FAIL, (ErrorType.NAME_ERROR, f"Function {func_name} undefined"))
+            return target
+        # The callee copies its arguments out before the result is written, so the target can reuse their temps
+        mark = self.next_temp
+        registers = tuple(self.compile_expression(arg) for arg in args)
+        self.release_temps(mark)
+        if target is None:
+            target = self.allocate_temp()
+        self.emit(CALL, target, index, registers)
+        return target
+
+    # f(...) where f is a variable, or obj.method(...). The function is found and checked before
+    # the arguments are evaluated
+    def compile_value_call(self, call_node, target):
+        args = call_node.get('args') or []
+        mark = self.next_temp
+        callee = self.compile_variable(call_node, None)
+        self.emit(CHECK_CALL, callee, len(args))
+        registers = tuple(self.compile_expression(arg) for arg in args)
+        self.release_temps(mark)
+        if target is None:
+            target = self.allocate_temp()
+        self.emit(CALL_VALUE, target, callee, registers)
+        return target
+
+    # Variable Expression, a.b.c reads a and then each field through its own inline cache
+    def compile_variable(self, node, target):
+        if node in self.resolution.function_refs:
+            source = self.const_register(self.function_value(node))
+            if target is not None:
+                self.emit(MOVE, target, source)
+                return target
+            return source
+        return self.compile_field_path(self.variable_register(node, target), self.resolution.path(node)[1], target)
+
+    # The register a variable's value is in. A captured variable's value is loaded out of its cell
+    # first, into target if there is one
+    def variable_register(self, node, target=None):
+        slot = self.resolution.slot(node)
+        if not self.resolution.in_cell(node):
+            return slot
+        register = target if target is not None else self.allocate_temp()
+        self.emit(LOAD_CELL, register, slot)
+        return register
+
+    # Lambda Expression. The body gets its own function in the table and is compiled later
+    def compile_lambda(self, func_node, target):
+        function = RegisterFunction(func_node.get('name'), len(func_node.get('args') or []))
+        self.functions.append(function)
+        self.lambdas.append((function, func_node))
+        slots = tuple(slot for _, slot in self.resolution.captures[func_node])
+        if target is None:
+            target = self.allocate_temp()
+        self.emit(MAKE_CLOSURE, target, function, cell_getter(slots))
+        return target
+
+    # Expression Nodes. Returns the register holding the value, which is target if one was given
+    def compile_expression(self, expression_node, target=None):
+        self.emit_count('nodes', expression_node)
+        kind = expression_node.elem_type
+        if kind in VALUE_NODES:
+            source = self.const_register(expression_node.get('val'))
+            if target is not None:
+                self.emit(MOVE, target, source)
+                return target
+            return source
+        elif kind == InterpreterBase.QUALIFIED_NAME_NODE:
+            return self.compile_variable(expression_node, target)
+        elif kind in BINARY_OPERATORS:
+            return self.compile_binary_operator(expression_node, target)
+        elif kind == InterpreterBase.NEG_NODE or kind == InterpreterBase.NOT_NODE:
+            op = NEGATE if kind == InterpreterBase.NEG_NODE else NOT
+            return self.compile_unary(op, expression_node.get('op1'), target)
+        elif kind == InterpreterBase.CONVERT_NODE:
+            return self.compile_unary(CONVERT, expression_node.get('expr'), target, expression_node.get('to_type'))
+        elif kind == InterpreterBase.FCALL_NODE:
+            result = self.compile_func_call(expression_node, target)
+            return result if result is not None else self.allocate_temp()
+        elif kind == InterpreterBase.EMPTY_OBJ_NODE:
+            if target is None:
+                target = self.allocate_temp()
+            self.emit(NEW_OBJECT, target)
+            return target
+        elif kind == InterpreterBase.FUNC_NODE:
+            return self.compile_lambda(expression_node, target)
+        elif kind == InterpreterBase.CLOSURE_NODE:
+            source = self.const_register(self.function_value(expression_node))
+            if target is not None:
+                self.emit(MOVE, target, source)
+                return target
+            return source
+        self.emit(FAIL, (ErrorType.TYPE_ERROR, f"Unknown expression type: {kind}"))
+        return target if target is not None else self.allocate_temp()
+
+    # Handles binary operators straight between registers
+    def compile_binary_operator(self, expression_node, target):
+        kind = expression_node.elem_type
+        mark = self.next_temp
+        op1 = self.compile_expression(expression_node.get('op1'))
+        op2 = self.compile_expression(expression_node.get('op2'))
+        self.release_temps(mark)
+        if target is None:
+            target = self.allocate_temp()
+        if kind in INT_OPCODES:
+            self.emit(INT_OPCODES[kind], target, op1, op2)
+        else:
+            self.emit(BINARY, target, op1, op2, kind)
+        return target
+
+    # -, ! and conversions, extra is the type for CONVERT
+    def compile_unary(self, op, operand_node, target, extra=0):
+        mark = self.next_temp
+        operand = self.compile_expression(operand_node)
+        self.release_temps(mark)
+        if target is None:
+            target = self.allocate_temp()
+        if op == CONVERT:
+            self.emit(CONVERT, target, operand, extra)
+        else:
+            self.emit(op, target, operand)
+        return target
+
+
+class RegisterVM:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+
+    # The dispatch loop
+    def execute(self, program):
+        code = program.code
+        error = self.interpreter.error
+        output = self.interpreter.output
+        get_input = self.interpreter.get_input
+        budget = self.interpreter.budget
+
+        functions = program.functions
+
+        # The frame main's result goes into, there's no function running yet
+        reg = [None]
+        function = None
+        # (return pc, caller's frame, caller's function, register for the result) for every call in progress
+        calls = []
+        pc = 0
+        while True:
+            # Where the running instruction is, for the profiler, since jumps and calls move pc before it's done
+            ip = pc
+            op, a, b, c, d = code[pc]
+            pc += 1
+            if op <= GREATER_EQ:
+                x = reg[b]
+                y = reg[c]
+                if type(x) is not int or type(y) is not int or (op == DIVIDE and y == 0):
+                    # Raises the right error
+                    evaluate_binary(INT_OPCODE_OPERATORS[op], x, y, error)
+                if op == ADD:
+                    reg[a] = x + y
+                elif op == SUBTRACT:
+                    reg[a] = x - y
+                elif op == MULTIPLY:
+                    reg[a] = x * y
+                elif op == DIVIDE:
+                    reg[a] = x / y
+                elif op == LESS:
+                    reg[a] = x < y
+                elif op == LESS_EQ:
+                    reg[a] = x <= y
+                elif op == GREATER:
+                    reg[a] = x > y
+                else:
+                    reg[a] = x >= y
+            elif op == JUMP_IF_FALSE:
+                condition = reg[a]
+                if condition is not True:
+                    if condition is not False:
+                        check_condition(condition, error)
+                    pc = b
+            elif op == JUMP:
+                pc = a
+            elif op == BINARY:
+                reg[a] = evaluate_binary(d, reg[b], reg[c], error)
+            elif op == NEGATE:
+                x = reg[b]
+                reg[a] = -x if type(x) is int else evaluate_unary(InterpreterBase.NEG_NODE, x, error)
+            elif op == NOT:
+                x = reg[b]
+                reg[a] = not x if type(x) is bool else evaluate_unary(InterpreterBase.NOT_NODE, x, error)
+            elif op == CALL:
+                callee = functions[b]
+                pool = callee.pool
+                callee_reg = pool.pop() if pool else callee.frame_template[:]
+                for i, r in enumerate(c):
+                    callee_reg[i] = reg[r]
+                calls.append((pc, reg, function, a))
+                reg = callee_reg
+                function = callee
+                pc = callee.entry
+            elif op == RETURN:
+                value = reg[a]
+                function.pool.append(reg)
+                pc, reg, function, target = calls.pop()
+                reg[target] = value
+            elif op == GET_FIELD:
+                reg[a] = c.get(reg[b], error)
+            elif op == SET_FIELD:
+                b.set(reg[a], reg[c], error)
+            elif op == CHECK_CALL:
+                check_callable(reg[a], b, error)
+            elif op == CALL_VALUE:
+                value = reg[b]
+                callee = value.target
+                pool = callee.pool
+                callee_reg = pool.pop() if pool else callee.frame_template[:]
+                for i, r in enumerate(c):
+                    callee_reg[i] = reg[r]
+                # A closure's captured cells go right after its parameters
+                cells = value.cells
+                if cells:
+                    callee_reg[len(c):len(c) + len(cells)] = cells
+                calls.append((pc, reg, function, a))
+                reg = callee_reg
+                function = callee
+                pc = callee.entry
+            elif op == NEW_OBJECT:
+                reg[a] = BrewinObject()
+            elif op == LOAD_CELL:
+                reg[a] = reg[b].value
+            elif op == STORE_CELL:
+                reg[a].value = reg[b]
+            elif op == MAKE_CELL:
+                reg[a] = Cell(reg[a])
+            elif op == MAKE_CLOSURE:
+                reg[a] = FunctionValue(b.name, b.arity, b, c(reg))
+            elif op == CHARGE:
+                budget.steps_left -= a
+                if budget.steps_left < 0:
+                    budget.refill()
+            elif op == CONVERT:
+                reg[a] = convert(c, reg[b], error)
+            elif op == MOVE:
+                reg[a] = reg[b]
+            elif op == DEFINE:
+                reg[a] = None
+            elif op == PRINT:
+                output(''.join([to_string(reg[r]) for r in a]))
+            elif op == INPUTI:
+                if b >= 0:
+                    output(to_string(reg[b]))
+                reg[a] = int(get_input())
+            elif op == FAIL:
+                error(*a)
+            elif op == HALT:
+                return
+            elif op == COUNT:
+                a[b] += 1
+            elif op == TRACE:
+                a(b)
+            elif op == TRACE_WRITE:
+                a((b, reg[c]))
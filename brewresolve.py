@@ -0,0 +1,354 @@
+"""
+Name resolution pass for Brewin.
+
+Runs over the AST before anything executes. Every variable definition gets an
+integer frame slot, and every assignment and read is mapped to the slot of the
+definition it refers to, so engines can keep variables in a plain list instead of
+a dict keyed by name. Undefined and duplicate names are reported here, with the
+same error types the interpreter raises for them, before the program starts.
+
+It also builds the function table, keyed by (name, arity) since Brewin functions
+are overloaded by their number of parameters, so calls never search the program.
+Dotted names are split here once, and names that aren't variables but do name a
+(not overloaded) function are recorded as references to it.
+
+Lambdas are resolved as functions with their own frames. Their free variables
+(names the body uses that belong to an enclosing function) are found first, and
+only those are captured. A captured variable lives in a Cell, both in the frame
+that defines it and in every closure that captured it, so they all share it. In
+the lambda's frame the captured cells come right after the parameters, which
+makes a closure flat: it holds the cells it needs and nothing else.
+"""
+
+from element import Element, FUNC, ASSIGNMENT, VAR_DEF, IF, WHILE, RETURN, FCALL, QUALIFIED_NAME, CLOSURE
+from intbase import ErrorType
+
+# Calls to these never go through a variable or the function table
+BUILTIN_FUNCTIONS = ('print', 'inputi')
+
+# Work on the stacks free_names and Resolver use instead of recursing, so blocks and lambdas nested any
+# depth are fine. Each is a (task, node) pair
+STATEMENTS = 0  # a block, which is a scope of its own
+STATEMENT = 1
+EXPRESSION = 2
+PARAMETERS = 3  # start the scope of a lambda's parameters (free_names only)
+END_SCOPE = 4   # a block (or a lambda's parameters) ended, the Resolver's node is the block's first slot
+END_FUNC = 5    # a function's body ended, the node is (func node, the enclosing function's state or None)
+
+
+# The nodes right under a node, in field order
+def child_nodes(node):
+    children = []
+    for key in node.field_names:
+        value = getattr(node, key)
+        if isinstance(value, Element):
+            children.append(value)
+        elif isinstance(value, list):
+            children.extend(child for child in value if isinstance(child, Element))
+    return children
+
+
+# A variable definition (or parameter), in_cell is set once some lambda captures it
+class Variable:
+    __slots__ = ('slot', 'in_cell')
+
+    def __init__(self, slot, in_cell=False):
+        self.slot = slot
+        self.in_cell = in_cell
+
+
+class Resolution:
+    def __init__(self):
+        # vardef, assignment and qname nodes -> slot of the variable they refer to (a for a.b.c)
+        self.slots = {}
+        # func node -> number of slots its frame needs, parameters take the first ones
+        self.frame_sizes = {}
+        # (name, arity) -> func node
+        self.functions = {}
+        # qname, assignment and variable-call fcall nodes -> (variable name, tuple of field names after it)
+        self.paths = {}
+        # qname nodes that name a function instead of a variable, and closure nodes -> its func node
+        self.function_refs = {}
+        # nodes from slots whose variable lives in a Cell, because some lambda captured it
+        self.cells = set()
+        # lambda func node -> (name, slot in the enclosing frame) of every variable it captures, in the
+        # order their cells go into the lambda's frame after its parameters
+        self.captures = {}
+        # func node -> slots of the parameters that have to be put in cells when it's called
+        self.cell_params = {}
+
+    def slot(self, node):
+        return self.slots[node]
+
+    def frame_size(self, func_node):
+        return self.frame_sizes[func_node]
+
+    # a.b.c -> ('a', ('b', 'c')), a -> ('a', ())
+    def path(self, node):
+        return self.paths[node]
+
+    # fcall nodes whose function comes out of a variable (or a field of one) rather than the function table
+    def is_value_call(self, node):
+        return node in self.paths
+
+    # Whether the variable a node refers to (or defines) is kept in a Cell
+    def in_cell(self, node):
+        return node in self.cells
+
+
+# Names a lambda's body reads or assigns that aren't its own parameters or variables, in the order
+# they're first used. Blocks are scoped the same way the resolver scopes them. A nested lambda's body
+# is walked in place with its parameters as one more scope, since whatever it uses that's neither its
+# own nor in scope here is free here too
+def free_names(func_node):
+    free = []
+    scopes = []
+
+    def use(name):
+        if not any(name in scope for scope in scopes) and name not in free:
+            free.append(name)
+
+    pending = [(END_SCOPE, None), (STATEMENTS, func_node.get('statements')), (PARAMETERS, func_node)]
+    while pending:
+        task, node = pending.pop()
+        if task == EXPRESSION:
+            kind = node.kind
+            if kind == QUALIFIED_NAME:
+                use(node.get('name').split('.')[0])
+                continue
+            if kind == FUNC:
+                pending.append((END_SCOPE, None))
+                pending.append((STATEMENTS, node.get('statements')))
+                pending.append((PARAMETERS, node))
+                continue
+            if kind == FCALL and node.get('name') not in BUILTIN_FUNCTIONS:
+                use(node.get('name').split('.')[0])
+            pending.extend((EXPRESSION, child) for child in reversed(child_nodes(node)))
+        elif task == STATEMENT:
+            kind = node.kind
+            if kind == VAR_DEF:
+                scopes[-1].add(node.get('name'))
+            elif kind == ASSIGNMENT:
+                use(node.get('var').split('.')[0])
+                pending.append((EXPRESSION, node.get('expression')))
+            elif kind == IF or kind == WHILE:
+                if node.get('else_statements') is not None:
+                    pending.append((STATEMENTS, node.get('else_statements')))
+                pending.append((STATEMENTS, node.get('statements')))
+                pending.append((EXPRESSION, node.get('condition')))
+            elif kind == RETURN:
+                if node.get('expression') is not None:
+                    pending.append((EXPRESSION, node.get('expression')))
+            else:
+                pending.append((EXPRESSION, node))
+        elif task == STATEMENTS:
+            scopes.append(set())
+            pending.append((END_SCOPE, None))
+            pending.extend((STATEMENT, statement_node) for statement_node in reversed(node or []))
+        elif task == PARAMETERS:
+            scopes.append({arg_node.get('name') for arg_node in node.get('args') or []})
+        else:
+            scopes.pop()
+    return free
+
+
+class Resolver:
+    def __init__(self, error):
+        # Called as error(ErrorType, description), normally InterpreterBase.error
+        self.error = error
+        self.resolution = Resolution()
+        self.pending = []
+
+    # Program Node
+    def resolve_program(self, ast):
+        funcs = [func for func in ast.get('functions') or [] if func.kind == FUNC]
+        # The whole table is built first, so a function can call ones defined after it
+        for func in funcs:
+            key = (func.get('name'), len(func.get('args') or []))
+            if key in self.resolution.functions:
+                self.error(ErrorType.NAME_ERROR, f"Function {key[0]} with {key[1]} parameters already defined")
+            self.resolution.functions[key] = func
+        # name -> every func node with that name, for using functions as values
+        self.functions_by_name = {}
+        for func in funcs:
+            self.functions_by_name.setdefault(func.get('name'), []).append(func)
+        # Every reference to a variable with its Variable, and every function's parameters. Which
+        # variables are in cells is only known once all of their lambdas have been seen
+        self.references = []
+        self.params = []
+        for func in funcs:
+            self.resolve_func(func)
+            self.resolve_pending()
+        for node, variable in self.references:
+            if variable.in_cell:
+                self.resolution.cells.add(node)
+        for func, params in self.params:
+            self.resolution.cell_params[func] = tuple(variable.slot for variable in params if variable.in_cell)
+        return self.resolution
+
+    # Works through the pending stack, in the order recursion would have gone
+    def resolve_pending(self):
+        pending = self.pending
+        while pending:
+            task, node = pending.pop()
+            if task == EXPRESSION:
+                self.resolve_expression(node)
+            elif task == STATEMENT:
+                self.resolve_statement(node)
+            elif task == STATEMENTS:
+                self.resolve_statements(node)
+            elif task == END_SCOPE:
+                # The block's slots are free again
+                self.scopes.pop()
+                self.next_slot = node
+            else:
+                func_node, state = node
+                self.resolution.frame_sizes[func_node] = self.max_slots
+                if state is not None:
+                    self.scopes, self.next_slot, self.max_slots = state
+
+    # Function Definition Node, each function gets its own frame
+    # Parameters are an outer scope of their own, so the body can shadow them. A lambda's captured
+    # variables are one more scope outside that. state is what to go back to once the body's done
+    def resolve_func(self, func_node, captured=None, state=None):
+        params = {}
+        for slot, arg_node in enumerate(func_node.get('args') or []):
+            if arg_node.get('name') in params:
+                self.error(ErrorType.NAME_ERROR, f"Parameter {arg_node.get('name')} already defined")
+            params[arg_node.get('name')] = Variable(slot)
+        self.params.append((func_node, list(params.values())))
+        self.scopes = [params]
+        self.next_slot = len(params)
+        if captured:
+            self.scopes.insert(0, {name: Variable(len(params) + index, True) for index, name in enumerate(captured)})
+            self.next_slot += len(captured)
+        self.max_slots = self.next_slot
+        self.pending.append((END_FUNC, (func_node, state)))
+        self.pending.append((STATEMENTS, func_node.get('statements')))
+
+    # Lambda Expression. The variables it captures are marked as living in cells, then its body is
+    # resolved like a function of its own and the enclosing function carries on where it was
+    def resolve_lambda(self, func_node):
+        captures = []
+        for name in free_names(func_node):
+            variable = self.lookup(name)
+            if variable is not None:
+                variable.in_cell = True
+                captures.append((name, variable.slot))
+        self.resolution.captures[func_node] = tuple(captures)
+        state = (self.scopes, self.next_slot, self.max_slots)
+        self.resolve_func(func_node, [name for name, slot in captures], state)
+
+    # Closure Expression, closure f is the function f as a value
+    def resolve_closure(self, node):
+        name = node.get('args')
+        funcs = self.functions_by_name.get(name)
+        if not funcs:
+            self.error(ErrorType.NAME_ERROR, f"Function {name} undefined")
+        if len(funcs) > 1:
+            self.error(ErrorType.NAME_ERROR, f"Function {name} is overloaded, so it can't be used as a value")
+        self.resolution.function_refs[node] = funcs[0]
+
+    # Records what a node refers to, returns its slot
+    def refer(self, node, variable):
+        self.references.append((node, variable))
+        self.resolution.slots[node] = variable.slot
+        return variable.slot
+
+    # Each statement list is a scope, and its slots are free again once it ends
+    def resolve_statements(self, statements):
+        self.scopes.append({})
+        self.pending.append((END_SCOPE, self.next_slot))
+        self.pending.extend((STATEMENT, statement_node) for statement_node in reversed(statements or []))
+
+    def lookup(self, var_name):
+        for scope in reversed(self.scopes):
+            if var_name in scope:
+                return scope[var_name]
+        return None
+
+    # Statement Nodes. Blocks and expressions under a statement go on the pending stack
+    def resolve_statement(self, statement_node):
+        kind = statement_node.kind
+        if kind == VAR_DEF:
+            var_name = statement_node.get('name')
+            scope = self.scopes[-1]
+            if var_name in scope:
+                self.error(ErrorType.NAME_ERROR, f"Variable {var_name} already defined")
+            scope[var_name] = Variable(self.next_slot)
+            self.refer(statement_node, scope[var_name])
+            self.next_slot += 1
+            self.max_slots = max(self.max_slots, self.next_slot)
+        elif kind == ASSIGNMENT:
+            # The target is checked before the expression, same order the interpreter uses
+            # For a.b = ... that's the variable a, fields are only known at run time
+            target_var_name, *field_names = statement_node.get('var').split('.')
+            variable = self.lookup(target_var_name)
+            if variable is None:
+                self.error(ErrorType.NAME_ERROR, f"Variable {target_var_name} not defined")
+            self.refer(statement_node, variable)
+            self.resolution.paths[statement_node] = (target_var_name, tuple(field_names))
+            self.pending.append((EXPRESSION, statement_node.get('expression')))
+        elif kind == IF or kind == WHILE:
+            # Condition first, then each body in its own scope
+            if statement_node.get('else_statements') is not None:
+                self.pending.append((STATEMENTS, statement_node.get('else_statements')))
+            self.pending.append((STATEMENTS, statement_node.get('statements')))
+            self.pending.append((EXPRESSION, statement_node.get('condition')))
+        elif kind == RETURN:
+            if statement_node.get('expression') is not None:
+                self.pending.append((EXPRESSION, statement_node.get('expression')))
+        else:
+            self.pending.append((EXPRESSION, statement_node))
+
+    # Expression Nodes, anything that isn't a variable just has its children resolved after it
+    def resolve_expression(self, node):
+        kind = node.kind
+        if kind == QUALIFIED_NAME:
+            self.resolve_name(node)
+            return
+        if kind == FUNC:
+            self.resolve_lambda(node)
+            return
+        if kind == CLOSURE:
+            self.resolve_closure(node)
+            return
+        if kind == FCALL:
+            self.resolve_call(node)
+        self.pending.extend((EXPRESSION, child) for child in reversed(child_nodes(node)))
+
+    # Variables (and a.b.c, which reads variable a) come first, then functions used as values
+    def resolve_name(self, node):
+        var_name, *field_names = node.get('name').split('.')
+        variable = self.lookup(var_name)
+        if variable is not None:
+            self.refer(node, variable)
+            self.resolution.paths[node] = (var_name, tuple(field_names))
+            return
+        funcs = self.functions_by_name.get(var_name)
+        if funcs and not field_names:
+            if len(funcs) > 1:
+                self.error(ErrorType.NAME_ERROR, f"Function {var_name} is overloaded, so it can't be used as a value")
+            self.resolution.function_refs[node] = funcs[0]
+            return
+        self.error(ErrorType.NAME_ERROR, f"Variable {var_name} undefined")
+
+    # f(...) goes through the function table unless f is a variable, and a.b.m(...) always calls the
+    # function in field m. Missing table entries are only reported when the call runs, like before
+    def resolve_call(self, node):
+        name = node.get('name')
+        if name in BUILTIN_FUNCTIONS:
+            return
+        var_name, *field_names = name.split('.')
+        variable = self.lookup(var_name)
+        if variable is None:
+            if field_names:
+                self.error(ErrorType.NAME_ERROR, f"Variable {var_name} undefined")
+            return
+        self.refer(node, variable)
+        self.resolution.paths[node] = (var_name, tuple(field_names))
+
+
+# Convenience wrapper, resolves the whole program or raises the first name error through error()
+def resolve_program(ast, error):
+    return Resolver(error).resolve_program(ast)
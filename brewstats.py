@@ -0,0 +1,161 @@
+"""
+Execution counters for Brewin programs.
+
+Interpreter(stats=True) counts how many times every statement and expression node
+runs and how many times every function is called. The counting goes in when a
+program is set up for its engine: the tree walker swaps counting versions of its
+dispatch methods in on the instance, the closure compiler wraps the closures it
+builds, the VMs get COUNT instructions and the transpiler writes the counts into
+the Python it generates. Without stats=True none of that is there, so a normal
+run doesn't pay anything for it. The iterative walker has nothing to build, so it
+runs an instrumented copy of its loop instead of the plain one.
+
+Everything else is worked out from the node counts after the run. get_stats()
+adds them up into operations by kind, variable reads and writes, print and
+inputi calls, and calls and statements per function. get_coverage() is a map of
+the source: runs per line (0 for lines whose statements never ran), per node and
+per function, ready for json.dump.
+
+    python brewstats.py program.br [--engine=<name>] [--coverage=<file>]
+"""
+
+import json
+import sys
+from collections import Counter
+
+from intbase import InterpreterBase
+from brewops import BINARY_OPERATORS, UNARY_OPERATORS
+from brewprofile import enclosing_statements, function_owners
+
+# Bumped whenever the layout of get_coverage()'s map changes
+COVERAGE_VERSION = 1
+
+
+class ExecutionCounts:
+    __slots__ = ('nodes', 'calls')
+
+    def __init__(self):
+        # statement or expression node -> times it ran
+        self.nodes = Counter()
+        # func node (named function or lambda) -> times it was called
+        self.calls = Counter()
+
+    # Every run starts from zero. Engines hold on to the counters, so they're emptied rather than replaced
+    def reset(self):
+        self.nodes.clear()
+        self.calls.clear()
+
+
+# Totals for a run, everything in it is a plain number, string, list or dict
+def execution_stats(counts, ast, positions=None):
+    nodes = counts.nodes
+    operations = Counter()
+    io = Counter({'print': 0, 'inputi': 0})
+    statements = 0
+    expressions = 0
+    reads = 0
+    writes = 0
+    enclosing = enclosing_statements(ast)
+    for node, count in nodes.items():
+        kind = node.elem_type
+        if enclosing.get(node) is node:
+            statements += count
+        else:
+            expressions += count
+        if kind in BINARY_OPERATORS or kind in UNARY_OPERATORS:
+            operations[kind] += count
+        elif kind == InterpreterBase.QUALIFIED_NAME_NODE:
+            reads += count
+        elif kind == InterpreterBase.ASSIGNMENT_NODE:
+            writes += count
+        elif kind == InterpreterBase.FCALL_NODE and node.get('name') in io:
+            io[node.get('name')] += count
+    return {
+        'statements': statements,
+        'expressions': expressions,
+        'operations': dict(operations.most_common()),
+        'variable_reads': reads,
+        'variable_writes': writes,
+        'io': dict(io),
+        'functions': function_rows(counts, ast, positions),
+    }
+
+
+# One row per function that was called, with the statements that ran directly in it, busiest first
+def function_rows(counts, ast, positions):
+    statements = Counter()
+    for statement, func_node in function_owners(ast).items():
+        statements[func_node] += counts.nodes.get(statement, 0)
+    rows = [
+        {**function_entry(func_node, positions), 'calls': calls, 'statements': statements[func_node]}
+        for func_node, calls in counts.calls.items()
+    ]
+    rows.sort(key=lambda row: -row['statements'])
+    return rows
+
+
+# Runs of every line, node and function in the program, including the ones that never ran.
+# Only nodes with a position show up, so this needs the run's SourcePositions
+def coverage_map(counts, ast, positions):
+    lines = {}
+    nodes = []
+    enclosing = enclosing_statements(ast)
+    for node, statement in enclosing.items():
+        position = positions.position(node)
+        if position is None:
+            continue
+        count = counts.nodes.get(node, 0)
+        nodes.append({'line': position[0], 'column': position[1], 'kind': node.elem_type, 'count': count})
+        # A line ran as many times as the busiest statement on it
+        if statement is node:
+            lines[position[0]] = max(lines.get(position[0], 0), count)
+    nodes.sort(key=lambda entry: (entry['line'], entry['column']))
+    lambdas = [node for node in enclosing if node.elem_type == InterpreterBase.FUNC_NODE]
+    functions = [
+        {**function_entry(func_node, positions), 'calls': counts.calls.get(func_node, 0)}
+        for func_node in [*(ast.get('functions') or []), *lambdas]
+    ]
+    return {
+        'version': COVERAGE_VERSION,
+        'lines': {line: lines[line] for line in sorted(lines)},
+        'nodes': nodes,
+        'functions': functions,
+    }
+
+
+def function_entry(func_node, positions):
+    line = positions.line(func_node) if positions is not None else None
+    return {'name': func_node.get('name'), 'arity': len(func_node.get('args') or []), 'line': line}
+
+
+def main(argv):
+    # Imported here since the interpreter imports this module
+    from interpreterv1 import Interpreter
+
+    options = {"engine": "tree", "coverage": None}
+    files = []
+    for arg in argv:
+        if arg.startswith("--") and "=" in arg:
+            name, value = arg[2:].split("=", 1)
+            options[name] = value
+        else:
+            files.append(arg)
+    if len(files) != 1:
+        print(__doc__.strip().splitlines()[-1].strip(), file=sys.stderr)
+        return 2
+    with open(files[0], encoding="utf-8") as handle:
+        program = handle.read()
+    interpreter = Interpreter(engine=options["engine"], stats=True)
+    try:
+        interpreter.run(program)
+    finally:
+        # Stats go to stderr so they don't get mixed into the program's output
+        print(json.dumps(interpreter.get_stats(), indent=2), file=sys.stderr)
+        if options["coverage"] is not None:
+            with open(options["coverage"], "w", encoding="utf-8") as handle:
+                json.dump(interpreter.get_coverage(), handle, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,88 @@
+"""
+Superinstruction mining and fusion report for the bytecode engine.
+
+Compiles every .br program in some directories (v1/tests and v1/fails by default)
+twice. The first compile turns fusion off and counts every run of 2 to 4
+instructions that stays inside one basic block, which is how the sequences the
+fusion pass in brewbytecode.py handles were picked. The second compile is the
+normal one, and its fusion counts are added up into a report of which
+superinstructions fired and how often.
+
+    python brewsuper.py [directory ...]
+"""
+
+import sys
+from collections import Counter
+from os import listdir, path
+
+from brewparse import parse_program
+from brewoptimize import fold_constants
+from brewbytecode import BytecodeCompiler, OPCODE_NAMES, JUMP, JUMP_IF_FALSE, RETURN, RETURN_CONST, HALT, FAIL
+from interpreterv1 import Interpreter
+
+DEFAULT_CORPUS = ("v1/tests", "v1/fails")
+SEQUENCE_LENGTHS = (2, 3, 4)
+# Instructions that end a basic block, nothing after them runs straight on from them
+BLOCK_ENDS = (JUMP, JUMP_IF_FALSE, RETURN, RETURN_CONST, HALT, FAIL)
+
+
+# Compiles a program to bytecode, or returns None if it doesn't parse or resolve
+def compile_source(source, superinstructions):
+    interpreter = Interpreter(console_output=False, engine="bytecode")
+    try:
+        ast = fold_constants(parse_program(source))
+        return BytecodeCompiler(interpreter, superinstructions).compile_program(ast)
+    except Exception:
+        return None
+
+
+# Every run of length instructions in the program that doesn't cross into another basic block, as opcode names
+def instruction_sequences(program, length):
+    code = program.code
+    instructions = [(code[pc], code[pc + 1]) for pc in range(0, len(code), 2)]
+    targets = {arg // 2 for op, arg in instructions if op == JUMP or op == JUMP_IF_FALSE}
+    targets.update(function.entry // 2 for function in program.functions)
+    for i in range(len(instructions) - length + 1):
+        window = instructions[i:i + length]
+        if any(j in targets for j in range(i + 1, i + length)):
+            continue
+        if any(op in BLOCK_ENDS for op, _ in window[:-1]):
+            continue
+        yield tuple(OPCODE_NAMES[op] for op, _ in window)
+
+
+def corpus_sources(directories):
+    for directory in directories:
+        for name in sorted(listdir(directory)):
+            if name.endswith(".br"):
+                with open(path.join(directory, name)) as source_file:
+                    yield source_file.read()
+
+
+# (sequence counts before fusion, superinstruction counts after it) over every program in the directories
+def mine(directories):
+    sequences = Counter()
+    fusions = Counter()
+    for source in corpus_sources(directories):
+        program = compile_source(source, False)
+        if program is None:
+            continue
+        for length in SEQUENCE_LENGTHS:
+            sequences.update(instruction_sequences(program, length))
+        fusions.update(compile_source(source, True).fusions)
+    return sequences, fusions
+
+
+def main(argv):
+    sequences, fusions = mine(argv or DEFAULT_CORPUS)
+    print("Most common instruction sequences:")
+    for sequence, count in sequences.most_common(25):
+        print(f"{count:6}  {' '.join(sequence)}")
+    print()
+    print("Superinstructions fused:")
+    for name, count in fusions.most_common():
+        print(f"{count:6}  {name}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,187 @@
+"""
+Structured execution trace for Brewin programs.
+
+Interpreter(trace_output=True) (or a number, the capacity) keeps the last
+TRACE_CAPACITY events of every run in a Trace: each statement as it starts,
+each assignment with the value it stores, each line of output, and the error
+the run ended with if it had one. The buffer is a deque with a maxlen, so
+it never grows past the capacity however long the program runs, and old events
+just fall off the front.
+
+Recording has to be cheap enough to leave on, so records are as small as they
+can be and nothing is formatted while the program runs. A statement is just its
+node, a write is (assignment node, value), output is the string that was printed
+and an error is the exception. Lines, names and values are only worked out when
+the trace is dumped, with write_jsonl() (one JSON object per line) or
+write_binary(), a compact versioned format read_binary() reads back.
+
+Like the counters in brewstats.py, recording is built in when a program is set
+up for its engine, so it costs nothing when tracing is off. The iterative
+walker picks its instrumented loop instead of the plain one.
+"""
+
+import json
+import struct
+from collections import deque
+
+from element import Element
+from brewobjects import BrewinObject, FunctionValue
+
+# Events kept when trace_output=True
+TRACE_CAPACITY = 10000
+
+# Binary format: MAGIC, then a version byte and the number of events, then the events
+MAGIC = b"BRWTRACE"
+VERSION = 1
+HEADER = struct.Struct("<BI")
+# Event: kind and line (0 when there isn't one)
+EVENT = struct.Struct("<BI")
+LENGTH = struct.Struct("<I")
+INT = struct.Struct("<q")
+
+# Event kinds in the binary format
+STATEMENT = 0
+WRITE = 1
+OUTPUT = 2
+ERROR = 3
+EVENT_KINDS = ("statement", "write", "output", "error")
+
+# Value tags in the binary format. Ints too big for 8 bytes and values that aren't plain data are
+# written as their description
+NIL_VALUE = 0
+INT_VALUE = 1
+BOOL_VALUE = 2
+STRING_VALUE = 3
+OTHER_VALUE = 4
+
+
+class Trace:
+    def __init__(self, capacity=TRACE_CAPACITY):
+        self.records = deque(maxlen=capacity)
+        # The run's SourcePositions, for the lines of statements and writes
+        self.positions = None
+
+    # Every run starts with an empty buffer
+    def reset(self):
+        self.records.clear()
+        self.positions = None
+
+    # The run ended with an exception, which is kept with the line the interpreter found for it
+    def record_error(self, exception, line):
+        self.records.append((exception, line))
+
+    # The events in the buffer as dicts, oldest first
+    def events(self):
+        return [self.event(record) for record in self.records]
+
+    def event(self, record):
+        if isinstance(record, Element):
+            return {'event': "statement", 'line': self.line(record), 'kind': record.elem_type}
+        if type(record) is str:
+            return {'event': "output", 'text': record}
+        first, second = record
+        if isinstance(first, Element):
+            return {'event': "write", 'line': self.line(first), 'name': first.get('var'), 'value': plain_value(second)}
+        return {'event': "error", 'line': second, 'message': str(first)}
+
+    def line(self, node):
+        return self.positions.line(node) if self.positions is not None else None
+
+    # One JSON object per line, to a text stream
+    def write_jsonl(self, stream):
+        for event in self.events():
+            stream.write(json.dumps(event))
+            stream.write("\n")
+
+    # The binary format, to a binary stream
+    def write_binary(self, stream):
+        events = self.events()
+        stream.write(MAGIC)
+        stream.write(HEADER.pack(VERSION, len(events)))
+        for event in events:
+            kind = EVENT_KINDS.index(event['event'])
+            stream.write(EVENT.pack(kind, event.get('line') or 0))
+            if kind == STATEMENT:
+                write_string(stream, event['kind'])
+            elif kind == WRITE:
+                write_string(stream, event['name'])
+                write_value(stream, event['value'])
+            elif kind == OUTPUT:
+                write_string(stream, event['text'])
+            else:
+                write_string(stream, event['message'])
+
+
+# The events in a trace written by write_binary, as dicts like Trace.events() gives
+def read_binary(stream):
+    if stream.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a Brewin trace")
+    version, count = HEADER.unpack(stream.read(HEADER.size))
+    if version != VERSION:
+        raise ValueError(f"Unsupported trace version {version}")
+    events = []
+    for _ in range(count):
+        kind, line = EVENT.unpack(stream.read(EVENT.size))
+        line = line or None
+        if kind == STATEMENT:
+            events.append({'event': "statement", 'line': line, 'kind': read_string(stream)})
+        elif kind == WRITE:
+            name = read_string(stream)
+            events.append({'event': "write", 'line': line, 'name': name, 'value': read_value(stream)})
+        elif kind == OUTPUT:
+            events.append({'event': "output", 'text': read_string(stream)})
+        else:
+            events.append({'event': "error", 'line': line, 'message': read_string(stream)})
+    return events
+
+
+# A Brewin value as JSON can hold it. Objects and functions are described rather than dumped
+def plain_value(value):
+    if value is None or type(value) in (int, bool, str):
+        return value
+    if type(value) is BrewinObject:
+        return "@object"
+    if type(value) is FunctionValue:
+        return f"function {value.name}/{value.arity}"
+    return repr(value)
+
+
+def write_string(stream, text):
+    data = text.encode("utf-8")
+    stream.write(LENGTH.pack(len(data)))
+    stream.write(data)
+
+
+def read_string(stream):
+    (length,) = LENGTH.unpack(stream.read(LENGTH.size))
+    return stream.read(length).decode("utf-8")
+
+
+def write_value(stream, value):
+    if value is None:
+        stream.write(bytes([NIL_VALUE]))
+    elif type(value) is bool:
+        stream.write(bytes([BOOL_VALUE, value]))
+    elif type(value) is int and -2 ** 63 <= value < 2 ** 63:
+        stream.write(bytes([INT_VALUE]))
+        stream.write(INT.pack(value))
+    elif type(value) is str:
+        stream.write(bytes([STRING_VALUE]))
+        write_string(stream, value)
+    else:
+        stream.write(bytes([OTHER_VALUE]))
+        write_string(stream, str(value))
+
+
+def read_value(stream):
+    tag = stream.read(1)[0]
+    if tag == NIL_VALUE:
+        return None
+    if tag == BOOL_VALUE:
+        return bool(stream.read(1)[0])
+    if tag == INT_VALUE:
+        return INT.unpack(stream.read(INT.size))[0]
+    if tag == STRING_VALUE:
+        return read_string(stream)
+    # Big ints come back as their digits, like anything else that wasn't plain data
+    return read_string(stream)
@@ -0,0 +1,535 @@
+"""
+Brewin-to-Python transpiler.
+
+PythonTranspiler turns the AST from parse_program into Python source with one def
+per Brewin function, where every Brewin variable is a Python local and arithmetic
+whose operand types are known at compile time is a plain CPython operation. Calls
+are direct calls of those defs, picked from the (name, arity) function table at
+transpile time, and CPython's own frames serve as the activation frames. The source
+is compiled with compile() and the code object is cached in TRANSPILED_PROGRAMS by
+the folded AST it came from (ASTs are shared through Interpreter's PARSED_PROGRAMS)
+and the instrumentation compiled into it, so running the same program again in any
+Interpreter skips both transpiling and compiling. Field accesses go through per-site
+FieldCache objects that live in the namespace the code runs in, which keeps them out
+of the source, so each compile just makes new ones.
+
+Lambdas become defs of their own whose extra parameters, after the Brewin ones,
+are the cells they captured. A captured variable is a local holding a Cell, and
+its static type is always UNKNOWN since any closure sharing it could change it.
+"""
+
+import bisect
+
+from intbase import InterpreterBase, ErrorType
+from brewresolve import resolve_program
+from brewcache import ProgramCache
+from brewobjects import BrewinObject, FieldCache, FunctionValue, Cell, check_callable
+from brewops import (
+    ARITHMETIC_OPERATORS,
+    INT_COMPARISON_OPERATORS,
+    LOGICAL_OPERATORS,
+    BINARY_OPERATORS,
+    evaluate_binary,
+    evaluate_unary,
+    convert,
+    to_string,
+    check_condition,
+)
+
+# (ast, budget?, stats?, trace?) -> (code, field cache names, named nodes, line statements, statement lines)
+# for the programs transpiled last by any Interpreter. Sizes are in statements
+TRANSPILED_PROGRAM_LIMIT = 256
+TRANSPILED_STATEMENT_LIMIT = 250000
+TRANSPILED_PROGRAMS = ProgramCache(TRANSPILED_PROGRAM_LIMIT, TRANSPILED_STATEMENT_LIMIT)
+
+# Static type of an expression we can't pin down at compile time
+UNKNOWN = None
+NIL_TYPE = type(None)
+
+# Python operator to use once both operand types are known to be right
+# && and || use & and | so both sides are always evaluated, like everywhere else
+NATIVE_OPERATORS = {
+    '+': '+',
+    '-': '-',
+    '*': '*',
+    '/': '/',
+    '<': '<',
+    '<=': '<=',
+    '>': '>',
+    '>=': '>=',
+    '==': '==',
+    '!=': '!=',
+    '&&': '&',
+    '||': '|',
+}
+
+CONVERT_TYPES = {
+    "int": int,
+    "str": str,
+    "bool": bool,
+}
+
+# Literal nodes, nil has no 'val' so it becomes None
+VALUE_NODES = (InterpreterBase.INT_NODE, InterpreterBase.STRING_NODE, InterpreterBase.BOOL_NODE, InterpreterBase.NIL_NODE)
+
+
+# Static types of slots after two paths join, anything they disagree on becomes UNKNOWN
+def merge_types(types, other_types):
+    return {slot: static_type if other_types.get(slot) is static_type else UNKNOWN for slot, static_type in types.items()}
+
+
+class PythonTranspiler:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+
+    # Program Node
+    def compile_program(self, ast):
+        interpreter = self.interpreter
+        # Budget costs only depend on the nodes, so whether there's a budget is all that changes the source
+        key = (ast, interpreter.budget is not None, interpreter.counts is not None, interpreter.trace is not None)
+        transpiled = TRANSPILED_PROGRAMS.get(key)
+        if transpiled is None:
+            source = self.transpile(ast)
+            # The key keeps the AST alive, so no other program's code gets its id while this is cached
+            code = compile(source, f"<brewin {id(ast):x}>", "exec")
+            transpiled = (
+                code, [cache.name for cache in self.field_caches], self.named_nodes, self.line_statements,
+                self.statement_lines,
+            )
+            TRANSPILED_PROGRAMS.put(key, transpiled, len(self.line_statements))
+        code, field_names, self.named_nodes, self.line_statements, self.statement_lines = transpiled
+        self.field_caches = [FieldCache(name) for name in field_names]
+        namespace = self.make_namespace()
+        # The name the generated code's frames have, for the profiler
+        self.filename = code.co_filename
+        exec(code, namespace)
+        return namespace['_run']
+
+    # For the profiler: the statement the innermost frame of generated code is on. Every statement's
+    # code starts on a new line, so it's the last statement that starts at or before the line
+    def locate_statement(self, frame):
+        while frame is not None and frame.f_code.co_filename != self.filename:
+            frame = frame.f_back
+        if frame is None:
+            return None
+        index = bisect.bisect_right(self.statement_lines, frame.f_lineno) - 1
+        return self.line_statements[self.statement_lines[index]] if index >= 0 else None
+
+    # Returns the Python source for the whole program
+    def transpile(self, ast):
+        self.resolution = resolve_program(ast, self.interpreter.error)
+        self.function_names = {
+            key: f"f{index}_{key[0]}" for index, key in enumerate(self.resolution.functions)
+        }
+        self.function_names_by_node = {
+            func: self.function_names[key] for key, func in self.resolution.functions.items()
+        }
+        # One FieldCache per field access site, the generated code refers to them as _c0, _c1, ...
+        self.field_caches = []
+        # Node -> its name in the namespace (_n0, _n1, ...), for the counters and the trace
+        self.named_nodes = {}
+        # lambda func node -> the name of its def. They're transpiled after the named functions
+        self.lambda_names = {}
+        self.lambdas = []
+        self.lines = []
+        # Line of the generated source (counting from 1) -> the statement whose code starts there
+        self.line_statements = {}
+        for key, func in self.resolution.functions.items():
+            self.transpile_func(self.function_names[key], func)
+        while self.lambdas:
+            self.transpile_func(*self.lambdas.pop())
+
+        # Function values, for function names used as values. They're made once the defs exist
+        for (name, arity), python_name in self.function_names.items():
+            self.lines.append(f"_v{python_name} = _FunctionValue({name!r}, {arity}, {python_name})")
+
+        # Same rules as Interpreter.get_main_func_node. No statement is running while main is looked up
+        self.line_statements[len(self.lines) + 1] = None
+        self.lines.append("def _run():")
+        self.indent = 1
+        if ('main', 0) in self.function_names:
+            self.emit(f"{self.function_names[('main', 0)]}()")
+        else:
+            self.emit_error(ErrorType.NAME_ERROR, "No main() function was found")
+        self.statement_lines = sorted(self.line_statements)
+        return "\n".join(self.lines) + "\n"
+
+    # Function Definition Node. Parameters could be anything, so their types start out UNKNOWN
+    # A lambda's captured cells are passed in after its parameters
+    def transpile_func(self, python_name, func_node):
+        params = [f"v{slot}_{arg_node.get('name')}" for slot, arg_node in enumerate(func_node.get('args') or [])]
+        for name, _ in self.resolution.captures.get(func_node, ()):
+            params.append(f"v{len(params)}_{name}")
+        # Setting up the call isn't any statement
+        self.line_statements[len(self.lines) + 1] = None
+        self.lines.append(f"def {python_name}({', '.join(params)}):")
+        self.indent = 1
+        for slot in self.resolution.cell_params[func_node]:
+            self.emit(f"{params[slot]} = _Cell({params[slot]})")
+        self.emit_charge(func_node)
+        if self.interpreter.counts is not None:
+            self.emit(f"_calls[{self.node_name(func_node)}] += 1")
+        self.indent = 0
+        # Static type of every slot assigned so far, UNKNOWN if it could be anything
+        self.slot_types = {slot: UNKNOWN for slot in range(len(params))}
+        self.transpile_block(func_node.get('statements'))
+        self.lines.append("")
+
+    # Runtime helpers the generated code calls, bound to this interpreter
+    def make_namespace(self):
+        error = self.interpreter.error
+        output = self.interpreter.output
+        get_input = self.interpreter.get_input
+        budget = self.interpreter.budget
+        counts = self.interpreter.counts
+        record = self.interpreter.trace.records.append if self.interpreter.trace is not None else None
+
+        def inputi_prompt(prompt):
+            output(to_string(prompt))
+            return int(get_input())
+
+        # Counts an expression node before it's evaluated, (_count(n) or x) is just x
+        def count(node):
+            counts.nodes[node] += 1
+
+        # Records the value an assignment stores and passes it through
+        def traced(node, value):
+            record((node, value))
+            return value
+
+        return {
+            "ErrorType": ErrorType,
+            "_error": error,
+            "_output": output,
+            "_str": to_string,
+            "_inputi": lambda: int(get_input()),
+            "_inputi_prompt": inputi_prompt,
+            "_binary": lambda op, a, b: evaluate_binary(op, a, b, error),
+            "_unary": lambda kind, a: evaluate_unary(kind, a, error),
+            "_convert": lambda to_type, value: convert(to_type, value, error),
+            "_condition": lambda value: check_condition(value, error),
+            "_object": BrewinObject,
+            "_FunctionValue": FunctionValue,
+            "_Cell": Cell,
+            "_callable": lambda value, arity: check_callable(value, arity, error),
+            # Calls a function value, a closure's cells go after the arguments
+            "_invoke": lambda function, *args: function.target(*args, *function.cells),
+            # Only called from code transpiled with a budget
+            "_charge": budget.charge if budget is not None else None,
+            **{f"_c{index}": cache for index, cache in enumerate(self.field_caches)},
+            # Only used by code transpiled with stats on
+            "_nodes": counts.nodes if counts is not None else None,
+            "_calls": counts.calls if counts is not None else None,
+            "_count": count if counts is not None else None,
+            # Only used by code transpiled with trace_output on
+            "_record": record,
+            "_traced": traced if record is not None else None,
+            **{name: node for node, name in self.named_nodes.items()},
+        }
+
+    # Emitting helpers
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    # Steps a function call or loop iteration takes off the budget, when the interpreter has one
+    def emit_charge(self, node):
+        budget = self.interpreter.budget
+        if budget is not None:
+            self.emit(f"_charge({budget.cost(node)})")
+
+    # The name a node goes by in the namespace, so generated code can count or trace it
+    def node_name(self, node):
+        name = self.named_nodes.get(node)
+        if name is None:
+            name = self.named_nodes[node] = f"_n{len(self.named_nodes)}"
+        return name
+
+    def error_call(self, error_type, description):
+        return f"_error(ErrorType.{error_type.name}, {description!r})"
+
+    def emit_error(self, error_type, description):
+        self.emit(self.error_call(error_type, description))
+
+    # One Python local per resolver slot. Brewin names can clash with Python keywords, hence the prefix
+    def local_name(self, node):
+        slot = self.resolution.slot(node)
+        return f"v{slot}_{(node.get('name') or node.get('var')).split('.')[0]}"
+
+    # Statement Nodes
+    def transpile_statements(self, statements):
+        for statement_node in statements or []:
+            self.transpile_statement(statement_node)
+
+    # An indented block, Python needs at least a pass in it
+    def transpile_block(self, statements):
+        self.indent += 1
+        start = len(self.lines)
+        self.transpile_statements(statements)
+        if len(self.lines) == start:
+            self.emit("pass")
+        self.indent -= 1
+
+    def transpile_statement(self, statement_node):
+        self.line_statements[len(self.lines) + 1] = statement_node
+        if self.interpreter.counts is not None:
+            self.emit(f"_nodes[{self.node_name(statement_node)}] += 1")
+        if self.interpreter.trace is not None:
+            self.emit(f"_record({self.node_name(statement_node)})")
+        kind = statement_node.elem_type
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            self.transpile_definition(statement_node)
+        elif kind == InterpreterBase.ASSIGNMENT_NODE:
+            self.transpile_assignment(statement_node)
+        elif kind == InterpreterBase.FCALL_NODE:
+            self.transpile_func_call_statement(statement_node)
+        elif kind == InterpreterBase.IF_NODE:
+            self.transpile_if(statement_node)
+        elif kind == InterpreterBase.WHILE_NODE:
+            self.transpile_while(statement_node)
+        elif kind == InterpreterBase.RETURN_NODE:
+            expression_node = statement_node.get('expression')
+            if expression_node is None:
+                self.emit("return None")
+            else:
+                self.emit(f"return {self.transpile_expression(expression_node)[0]}")
+        else:
+            self.emit_error(ErrorType.TYPE_ERROR, f"Unknown statement type: {kind}")
+
+    # Conditions that aren't known to be bools get checked at run time
+    def transpile_condition(self, condition_node):
+        source, static_type = self.transpile_expression(condition_node)
+        if static_type is bool:
+            return source
+        return f"_condition({source})"
+
+    # If Statement. Afterwards a variable only keeps a static type if both branches agree on it
+    def transpile_if(self, statement_node):
+        self.emit(f"if {self.transpile_condition(statement_node.get('condition'))}:")
+        types_before = dict(self.slot_types)
+        self.transpile_block(statement_node.get('statements'))
+        types_after_if = self.slot_types
+        self.slot_types = dict(types_before)
+        if statement_node.get('else_statements') is not None:
+            self.emit("else:")
+            self.transpile_block(statement_node.get('else_statements'))
+        self.slot_types = merge_types(types_after_if, self.slot_types)
+
+    # While Statement. The static types at the top of the loop are the ones that hold both on entry and
+    # after any number of trips through the body, so the body is transpiled until they stop changing
+    def transpile_while(self, statement_node):
+        entry_types = dict(self.slot_types)
+        while True:
+            mark = len(self.lines)
+            self.slot_types = dict(entry_types)
+            self.transpile_loop(statement_node)
+            del self.lines[mark:]
+            for line in [line for line in self.line_statements if line > mark + 1]:
+                del self.line_statements[line]
+            merged_types = merge_types(entry_types, self.slot_types)
+            if merged_types == entry_types:
+                break
+            entry_types = merged_types
+        self.slot_types = dict(entry_types)
+        self.transpile_loop(statement_node)
+        # The loop can only be left from the condition check, where the entry types hold
+        self.slot_types = entry_types
+
+    def transpile_loop(self, statement_node):
+        self.emit(f"while {self.transpile_condition(statement_node.get('condition'))}:")
+        self.indent += 1
+        self.emit_charge(statement_node)
+        self.indent -= 1
+        self.transpile_block(statement_node.get('statements'))
+
+    # Variable Definition Statement
+    def transpile_definition(self, statement_node):
+        if self.resolution.in_cell(statement_node):
+            self.slot_types[self.resolution.slot(statement_node)] = UNKNOWN
+            self.emit(f"{self.local_name(statement_node)} = _Cell()")
+            return
+        self.slot_types[self.resolution.slot(statement_node)] = NIL_TYPE
+        self.emit(f"{self.local_name(statement_node)} = None")
+
+    # Assignment Statement
+    def transpile_assignment(self, statement_node):
+        source, static_type = self.transpile_expression(statement_node.get('expression'))
+        if self.interpreter.trace is not None:
+            source = f"_traced({self.node_name(statement_node)}, {source})"
+        field_names = self.resolution.path(statement_node)[1]
+        if field_names:
+            # a.b.c = ... changes an object, not the variable, so a keeps its static type. The
+            # value is evaluated before the object, like in the other engines
+            cache = self.field_cache(field_names[-1])
+            # A literal can go straight in, unless it's counted or traced, which has to happen before the object's read
+            instrumented = self.interpreter.counts is not None or self.interpreter.trace is not None
+            if statement_node.get('expression').elem_type in VALUE_NODES and not instrumented:
+                obj = self.transpile_field_path(self.variable_value(statement_node), field_names[:-1])
+                self.emit(f"{cache}.set({obj}, {source}, _error)")
+            else:
+                self.emit(f"_value = {source}")
+                obj = self.transpile_field_path(self.variable_value(statement_node), field_names[:-1])
+                self.emit(f"{cache}.set({obj}, _value, _error)")
+            return
+        if self.resolution.in_cell(statement_node):
+            self.emit(f"{self.local_name(statement_node)}.value = {source}")
+            return
+        self.slot_types[self.resolution.slot(statement_node)] = static_type
+        self.emit(f"{self.local_name(statement_node)} = {source}")
+
+    # A new inline cache for one field access site, returns its name in the namespace
+    def field_cache(self, name):
+        self.field_caches.append(FieldCache(name))
+        return f"_c{len(self.field_caches) - 1}"
+
+    # Reads a chain of fields starting from some Python expression, each one through its own cache
+    def transpile_field_path(self, source, names):
+        for name in names:
+            source = f"{self.field_cache(name)}.get({source}, _error)"
+        return source
+
+    # Variable Expression. Names of functions used as values are the function values made after the defs
+    def transpile_variable(self, node):
+        func_node = self.resolution.function_refs.get(node)
+        if func_node is not None:
+            return f"_v{self.function_names_by_node[func_node]}", UNKNOWN
+        field_names = self.resolution.path(node)[1]
+        if field_names:
+            return self.transpile_field_path(self.variable_value(node), field_names), UNKNOWN
+        if self.resolution.in_cell(node):
+            return self.variable_value(node), UNKNOWN
+        return self.local_name(node), self.slot_types[self.resolution.slot(node)]
+
+    # The variable a node refers to, out of its cell if it's captured
+    def variable_value(self, node):
+        if self.resolution.in_cell(node):
+            return f"{self.local_name(node)}.value"
+        return self.local_name(node)
+
+    # Lambda Expression. Its def gets queued the first time it's seen (loop bodies are transpiled
+    # more than once), and the expression makes a FunctionValue with the captured cells
+    def transpile_lambda(self, func_node):
+        python_name = self.lambda_names.get(func_node)
+        if python_name is None:
+            python_name = f"f{len(self.function_names) + len(self.lambda_names)}_{func_node.get('name')}"
+            self.lambda_names[func_node] = python_name
+            self.lambdas.append((python_name, func_node))
+        cells = ''.join(f"v{slot}_{name}, " for name, slot in self.resolution.captures[func_node])
+        arity = len(func_node.get('args') or [])
+        return f"_FunctionValue({func_node.get('name')!r}, {arity}, {python_name}, ({cells}))", UNKNOWN
+
+    # Function Call Statement
+    def transpile_func_call_statement(self, statement_node):
+        func_name = statement_node.get('name')
+        args = statement_node.get('args') or []
+        if func_name == 'print':
+            parts = []
+            for arg in args:
+                source, static_type = self.transpile_expression(arg)
+                if static_type is str:
+                    parts.append(source)
+                elif static_type is int:
+                    parts.append(f"str({source})")
+                else:
+                    parts.append(f"_str({source})")
+            self.emit(f"_output(''.join([{', '.join(parts)}]))")
+        elif func_name == 'inputi':
+            self.emit(self.transpile_inputi(args)[0])
+        else:
+            self.emit(self.transpile_user_call(statement_node)[0])
+
+    # Calls to user functions, whose return type isn't tracked
+    def transpile_user_call(self, call_node):
+        func_name = call_node.get('name')
+        args = call_node.get('args') or []
+        if self.resolution.is_value_call(call_node):
+            # f(...) where f is a variable, or obj.method(...). The function is found and checked
+            # before the arguments are evaluated, Python evaluates the callee first too
+            callee = self.transpile_variable(call_node)[0]
+            arg_sources = ''.join(f", {self.transpile_expression(arg)[0]}" for arg in args)
+            return f"_invoke(_callable({callee}, {len(args)}){arg_sources})", UNKNOWN
+        python_name = self.function_names.get((func_name, len(args)))
+        if python_name is None:
+            return self.error_call(ErrorType.NAME_ERROR, f"Function {func_name} undefined"), UNKNOWN
+        return f"{python_name}({', '.join(self.transpile_expression(arg)[0] for arg in args)})", UNKNOWN
+
+    # Handles user input (integer)
+    def transpile_inputi(self, args):
+        if len(args) > 1:
+            return self.error_call(ErrorType.NAME_ERROR, "No inputi() function found that takes > 1 parameter"), UNKNOWN
+        if len(args) == 1:
+            return f"_inputi_prompt({self.transpile_expression(args[0])[0]})", int
+        return "_inputi()", int
+
+    # Expression Nodes, returns (python source, static type). With stats on the source counts the node
+    # first, like the other engines
+    def transpile_expression(self, expression_node):
+        source, static_type = self.transpile_expression_kind(expression_node)
+        if self.interpreter.counts is not None:
+            source = f"(_count({self.node_name(expression_node)}) or {source})"
+        return source, static_type
+
+    def transpile_expression_kind(self, expression_node):
+        kind = expression_node.elem_type
+        if kind in VALUE_NODES:
+            value = expression_node.get('val')
+            return repr(value), type(value)
+        elif kind == InterpreterBase.QUALIFIED_NAME_NODE:
+            return self.transpile_variable(expression_node)
+        elif kind in BINARY_OPERATORS:
+            return self.transpile_binary_operator(expression_node)
+        elif kind == InterpreterBase.NEG_NODE or kind == InterpreterBase.NOT_NODE:
+            return self.transpile_unary_operator(expression_node)
+        elif kind == InterpreterBase.CONVERT_NODE:
+            to_type = expression_node.get('to_type')
+            source = self.transpile_expression(expression_node.get('expr'))[0]
+            return f"_convert({to_type!r}, {source})", CONVERT_TYPES[to_type]
+        elif kind == InterpreterBase.FCALL_NODE and expression_node.get('name') == 'inputi':
+            return self.transpile_inputi(expression_node.get('args') or [])
+        elif kind == InterpreterBase.FCALL_NODE:
+            return self.transpile_user_call(expression_node)
+        elif kind == InterpreterBase.EMPTY_OBJ_NODE:
+            return "_object()", BrewinObject
+        elif kind == InterpreterBase.FUNC_NODE:
+            return self.transpile_lambda(expression_node)
+        elif kind == InterpreterBase.CLOSURE_NODE:
+            return f"_v{self.function_names_by_node[self.resolution.function_refs[expression_node]]}", UNKNOWN
+        return self.error_call(ErrorType.TYPE_ERROR, f"Unknown expression type: {kind}"), UNKNOWN
+
+    # Handles binary operators. If the operand types are known to be fine it's a native operator,
+    # otherwise a call to the checked helper
+    def transpile_binary_operator(self, expression_node):
+        op = expression_node.elem_type
+        op1, type1 = self.transpile_expression(expression_node.get('op1'))
+        op2, type2 = self.transpile_expression(expression_node.get('op2'))
+
+        if op in ARITHMETIC_OPERATORS:
+            result_type = float if op == '/' else int
+            divisor = expression_node.get('op2')
+            divisor_is_safe = op != '/' or (divisor.elem_type == InterpreterBase.INT_NODE and divisor.get('val') != 0)
+            is_native = type1 is int and type2 is int and divisor_is_safe
+        elif op in INT_COMPARISON_OPERATORS:
+            result_type = bool
+            is_native = type1 is int and type2 is int
+        elif op in LOGICAL_OPERATORS:
+            result_type = bool
+            is_native = type1 is bool and type2 is bool
+        else:
+            # == and != only compare values of the same type natively
+            result_type = bool
+            is_native = type1 is not UNKNOWN and type1 is type2
+
+        if is_native:
+            return f"({op1} {NATIVE_OPERATORS[op]} {op2})", result_type
+        return f"_binary({op!r}, {op1}, {op2})", result_type
+
+    # Handles - and !
+    def transpile_unary_operator(self, expression_node):
+        kind = expression_node.elem_type
+        op1, type1 = self.transpile_expression(expression_node.get('op1'))
+        if kind == InterpreterBase.NEG_NODE:
+            if type1 is int:
+                return f"(-{op1})", int
+            return f"_unary({kind!r}, {op1})", int
+        if type1 is bool:
+            return f"(not {op1})", bool
+        return f"_unary({kind!r}, {op1})", bool
@@ -0,0 +1,685 @@
+"""
+Checks for the parts of the interpreter that aren't visible from a Brewin program (caches, AST containers,
+files and printing, budgets, the profiler, counters and coverage, traces, superinstructions), run next to the
+.br suites in v1.
+
+    python checks.py            runs every check
+    python checks.py cache      runs the checks with "cache" in their names
+
+Each check is a function named check_<something> that raises AssertionError (or anything else) when it fails.
+"""
+
+import errno
+import glob
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import traceback
+
+import brewastfile
+import brewcache
+from brewastfile import write_ast, read_ast, load_ast
+from brewcache import ParseCache, ProgramCache
+from brewcolumns import ColumnarAST, NodeView
+from brewoptimize import fold_constants
+from brewparse import parse_program, GRAMMAR_SIGNATURE
+from brewpositions import SourcePositions
+from brewstats import COVERAGE_VERSION
+from brewsuper import compile_source, instruction_sequences, mine
+from brewtrace import read_binary
+from brewtranspile import TRANSPILED_PROGRAMS
+from element import Element, Program, Func, FCall, Int, String, Bool, Neg, BinaryOperation, write_element
+from interpreterv1 import Interpreter, BudgetExceeded, PARSED_PROGRAMS, program_size
+
+ENGINES = ("tree",) + tuple(Interpreter.COMPILERS)
+
+PROGRAM = """
+def main() {
+  var x;
+  x = 5;
+  while (x > 0) {
+    print("x is ", x);
+    x = x - 1;
+  }
+}
+"""
+
+
+# The AST of a program parsed without a cache, with its positions
+def parse_uncached(program):
+    positions = SourcePositions(program)
+    return parse_program(program, positions=positions), positions
+
+
+# (name, source) of every v1 test program that parses
+def test_programs():
+    programs = []
+    for path in sorted(glob.glob("v1/*/*.br")):
+        with open(path, encoding="utf-8") as handle:
+            source = handle.read()
+        try:
+            parse_program(source)
+        except SyntaxError:
+            continue
+        programs.append((path, source))
+    return programs
+
+
+# Every node of a tree in preorder, the order ColumnarAST numbers them in
+def preorder(root):
+    nodes = []
+    pending = [root]
+    while pending:
+        node = pending.pop()
+        nodes.append(node)
+        children = []
+        for key in node.field_names:
+            value = getattr(node, key)
+            if isinstance(value, Element):
+                children.append(value)
+            elif isinstance(value, list):
+                children.extend(child for child in value if isinstance(child, Element))
+        pending.extend(reversed(children))
+    return nodes
+
+
+# A disk that's full when the entry is written still gives the parsed program, and leaves nothing behind
+def check_cache_failed_store():
+    expected, _ = parse_uncached(PROGRAM)
+    write_ast = brewcache.write_ast
+
+    def full_disk(ast, stream, positions=None):
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+    with tempfile.TemporaryDirectory() as directory:
+        brewcache.write_ast = full_disk
+        try:
+            positions = SourcePositions(PROGRAM)
+            ast = parse_program(PROGRAM, positions=positions, cache_dir=directory)
+        finally:
+            brewcache.write_ast = write_ast
+        assert str(ast) == str(expected)
+        assert positions.offsets
+        assert not os.listdir(directory), os.listdir(directory)
+
+
+# A cache directory that can't be made is no cache at all
+def check_cache_unwritable_directory():
+    expected, _ = parse_uncached(PROGRAM)
+    with tempfile.NamedTemporaryFile() as handle:
+        # Under a file, so not even root can make it
+        directory = os.path.join(handle.name, "cache")
+        assert str(parse_program(PROGRAM, cache_dir=directory)) == str(expected)
+        assert not ParseCache(directory, GRAMMAR_SIGNATURE).store(PROGRAM, expected)
+
+
+# A corrupt entry is a miss, the program is parsed again and the entry replaced with a good one
+def check_cache_corrupt_entry():
+    expected, expected_positions = parse_uncached(PROGRAM)
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ParseCache(directory, GRAMMAR_SIGNATURE)
+        assert cache.store(PROGRAM, expected, expected_positions)
+        path = cache.path(PROGRAM)
+        with open(path, "r+b") as handle:
+            handle.truncate(os.path.getsize(path) // 2)
+        assert cache.load(PROGRAM) is None
+
+        positions = SourcePositions(PROGRAM)
+        ast = parse_program(PROGRAM, positions=positions, cache_dir=directory)
+        assert str(ast) == str(expected)
+        assert len(positions.offsets) == len(expected_positions.offsets)
+
+        positions = SourcePositions(PROGRAM)
+        loaded = cache.load(PROGRAM, positions)
+        assert loaded is not None and str(loaded) == str(expected)
+        assert positions.line(loaded.functions[0]) == expected_positions.line(expected.functions[0])
+
+
+# Past max_entries the least recently used entry goes, and a get counts as a use
+def check_program_cache_entries():
+    cache = ProgramCache(3, 100)
+    for key in "abc":
+        cache.put(key, key.upper(), 10)
+    assert cache.get("a") == "A"
+    cache.put("d", "D", 10)
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in "acd"] == ["A", "C", "D"]
+    assert cache.stats() == {'entries': 3, 'size': 30, 'hits': 4, 'misses': 1, 'evictions': 1}, cache.stats()
+
+
+# Past max_size entries go until the rest fit, and one too big on its own isn't kept
+def check_program_cache_size():
+    cache = ProgramCache(10, 100)
+    cache.put("x", "X", 60)
+    cache.put("y", "Y", 30)
+    cache.put("z", "Z", 30)
+    assert cache.get("x") is None and cache.get("y") == "Y" and cache.get("z") == "Z"
+    assert cache.stats()['size'] == 60 and cache.stats()['evictions'] == 1
+    # Storing a key again replaces its size rather than adding to it
+    cache.put("y", "Y2", 50)
+    assert cache.stats()['size'] == 80 and cache.get("y") == "Y2"
+    cache.put("huge", "H", 101)
+    assert cache.get("huge") is None and cache.stats()['size'] == 80
+    cache.clear()
+    stats = cache.stats()
+    assert (stats['entries'], stats['size']) == (0, 0) and cache.get("y") is None
+
+
+# What an interpreter's get_cache_stats() counts as it runs programs, against the shared parsed programs and
+# its own compiled ones
+def check_program_cache_stats():
+    # A source no other check has run, so it starts out of PARSED_PROGRAMS
+    program = PROGRAM.replace("x is ", f"stats check {time.time()} ")
+
+    def change(before, after):
+        return {cache: {key: after[cache][key] - before[cache][key] for key in ('hits', 'misses')} for cache in after}
+
+    interpreter = Interpreter(False, None, False, engine="closure")
+    before = interpreter.get_cache_stats()
+    interpreter.run(program)
+    after_first = interpreter.get_cache_stats()
+    assert change(before, after_first) == {
+        'parsed': {'hits': 0, 'misses': 1}, 'compiled': {'hits': 0, 'misses': 1},
+    }, change(before, after_first)
+    interpreter.run(program)
+    after_second = interpreter.get_cache_stats()
+    assert change(after_first, after_second) == {
+        'parsed': {'hits': 0, 'misses': 0}, 'compiled': {'hits': 1, 'misses': 0},
+    }, change(after_first, after_second)
+    assert after_second['compiled']['entries'] == 1
+
+    # Another interpreter parses nothing, but has its own compiled programs
+    other = Interpreter(False, None, False, engine="closure")
+    before = other.get_cache_stats()
+    other.run(program)
+    assert change(before, other.get_cache_stats()) == {
+        'parsed': {'hits': 1, 'misses': 0}, 'compiled': {'hits': 0, 'misses': 1},
+    }, change(before, other.get_cache_stats())
+    assert other.get_output() == interpreter.get_output()[:len(other.get_output())]
+
+    # The tree walker reuses the parsed program, and then its own Resolution of it
+    tree = Interpreter(False, None, False)
+    before = tree.get_cache_stats()
+    tree.run(program)
+    assert change(before, tree.get_cache_stats()) == {
+        'parsed': {'hits': 1, 'misses': 0}, 'compiled': {'hits': 0, 'misses': 1},
+    }, change(before, tree.get_cache_stats())
+    assert PARSED_PROGRAMS.get(program) is not None
+    resolution = tree.resolution
+    before = tree.get_cache_stats()
+    tree.run(program)
+    assert change(before, tree.get_cache_stats()) == {
+        'parsed': {'hits': 0, 'misses': 0}, 'compiled': {'hits': 1, 'misses': 0},
+    }, change(before, tree.get_cache_stats())
+    assert tree.resolution is resolution
+    assert tree.get_output() == other.get_output() * 2
+
+
+# The transpiler's code is shared by every Interpreter running the same program with the same instrumentation
+def check_transpiled_programs():
+    program = PROGRAM.replace("x is ", f"transpile check {time.time()} ")
+
+    def run(**options):
+        interpreter = Interpreter(False, None, False, engine="python", **options)
+        before = TRANSPILED_PROGRAMS.stats()
+        interpreter.run(program)
+        after = TRANSPILED_PROGRAMS.stats()
+        return (after['hits'] - before['hits'], after['misses'] - before['misses']), interpreter
+
+    assert run()[0] == (0, 1)
+    change, interpreter = run()
+    assert change == (1, 0), change
+    assert interpreter.get_output()[0].startswith("transpile check"), interpreter.get_output()
+    # Stats and a budget are compiled into the code, so they get their own
+    assert run(stats=True)[0] == (0, 1)
+    change, interpreter = run(stats=True)
+    assert change == (1, 0) and interpreter.get_stats() is not None, change
+    assert run(max_steps=1000)[0] == (0, 1)
+
+
+# Folding leaves positions for the nodes of the folded tree and nothing else, so program_size counts what's cached
+def check_folded_positions():
+    program = """
+def main() {
+  var x;
+  x = 2 * 3 + 4 - 0;
+  print(x + (1 + 1), !(true && false), -(-5));
+}
+"""
+    positions = SourcePositions(program)
+    ast = parse_program(program, positions=positions)
+    parsed_ids = {id(node) for node in preorder(ast)}
+    folded = fold_constants(ast, positions)
+    nodes = preorder(folded)
+    assert len(nodes) < len(parsed_ids)
+    assert set(positions.offsets) <= {id(node) for node in nodes}
+    assert all(positions.offset(node) is not None for node in nodes if node is not folded), [
+        str(node) for node in nodes if positions.offset(node) is None
+    ]
+    assert program_size(positions) == len(nodes)
+    # The folded literals start where the expressions they replaced did
+    assignment = folded.functions[0].statements[1]
+    assert str(assignment.expression) == "int: val: 10" and positions.position(assignment.expression) == (4, 7)
+
+
+# Packing a tree into columns and building it again gives the same tree, with the same positions
+def check_columns_round_trip():
+    for path, source in test_programs():
+        ast, positions = parse_uncached(source)
+        columns = ColumnarAST.from_element(ast, positions)
+        assert len(columns) == len(preorder(ast)), path
+        assert columns.nbytes() == 19 * len(columns), path
+        rebuilt_positions = SourcePositions(source)
+        rebuilt = columns.to_element(rebuilt_positions)
+        assert str(rebuilt) == str(ast), path
+        for old, new in zip(preorder(ast), preorder(rebuilt)):
+            assert type(new) is type(old) and new.kind == old.kind, path
+            assert rebuilt_positions.position(new) == positions.position(old), (path, str(old))
+
+
+# A view reads like the node it's for: same text, elem_type, kind, fields and get()
+def check_columns_views():
+    for path, source in test_programs():
+        ast = parse_program(source)
+        columns = ColumnarAST.from_element(ast)
+        assert str(columns.root()) == str(ast), path
+        for index, node in enumerate(preorder(ast)):
+            view = NodeView(columns, index)
+            assert (view.elem_type, view.kind) == (node.elem_type, node.kind), path
+            assert list(view.dict) == list(node.dict), (path, view.elem_type)
+            assert str(view) == str(node), path
+            for key in node.field_names + ('kind', 'elem_type', 'missing'):
+                value = node.get(key)
+                if isinstance(value, Element):
+                    assert str(view.get(key)) == str(value), (path, key)
+                elif isinstance(value, list):
+                    assert [str(child) for child in view.get(key)] == [str(child) for child in value], (path, key)
+                else:
+                    assert view.get(key) == value, (path, key, view.get(key), value)
+
+
+# Views of the same node are equal and hash the same, so they work as dict keys
+def check_columns_view_identity():
+    ast = parse_program(PROGRAM)
+    columns = ColumnarAST.from_element(ast)
+    other = ColumnarAST.from_element(ast)
+    assert NodeView(columns, 3) == NodeView(columns, 3)
+    assert hash(NodeView(columns, 3)) == hash(NodeView(columns, 3))
+    assert NodeView(columns, 3) != NodeView(columns, 4)
+    assert NodeView(columns, 3) != NodeView(other, 3)
+    seen = {NodeView(columns, index): index for index in range(len(columns))}
+    assert all(seen[NodeView(columns, index)] == index for index in range(len(columns)))
+    assert columns.root().functions[0] == NodeView(columns, 1)
+
+
+# The bytes write_ast writes for an AST
+def ast_bytes(ast, positions=None):
+    stream = io.BytesIO()
+    write_ast(ast, stream, positions)
+    return stream.getvalue()
+
+
+# Ints past 64 bits, at its edges and non-ASCII text all come back from a file as they went in
+def check_astfile_values():
+    ints = [0, -1, 2 ** 63 - 1, -2 ** 63, 2 ** 63, -2 ** 63 - 1, 10 ** 40, -(10 ** 40)]
+    texts = ["", "plain", "héllo wörld", "日本語", "emoji 🍺 and \u00e9", "tab\tnewline\n"]
+    values = [Int(value) for value in ints] + [String(text) for text in texts] + [Bool(True), Bool(False)]
+    ast = Program([Func("main", [], [FCall("print", values), FCall("naïve_名前", [Neg(Int(10 ** 30))])])])
+    loaded = read_ast(ast_bytes(ast)).to_element()
+    assert str(loaded) == str(ast)
+    printed = loaded.functions[0].statements[0].args
+    assert [node.val for node in printed] == ints + texts + [True, False]
+    assert [type(node.val) for node in printed] == [int] * len(ints) + [str] * len(texts) + [bool, bool]
+
+    # Parsed from source too, through a mapped file, with its positions
+    source = 'def main() { print(123456789012345678901234567890, "ünïcödé ✓"); }'
+    ast, positions = parse_uncached(source)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.ast")
+        with open(path, "wb") as handle:
+            write_ast(ast, handle, positions)
+        loaded_positions = SourcePositions(source)
+        with load_ast(path) as mapped:
+            loaded = mapped.to_element(loaded_positions)
+    assert str(loaded) == str(ast)
+    args = loaded.functions[0].statements[0].args
+    assert (args[0].val, args[1].val) == (123456789012345678901234567890, "ünïcödé ✓")
+    assert loaded_positions.position(args[1]) == positions.position(ast.functions[0].statements[0].args[1])
+
+
+# Files that aren't a whole AST file of this version are refused with a ValueError, not read wrong
+def check_astfile_rejects():
+    ast = parse_program(PROGRAM)
+    data = ast_bytes(ast)
+    assert str(read_ast(data).to_element()) == str(ast)
+
+    def refused(bad, message):
+        try:
+            read_ast(bad)
+        except ValueError as exception:
+            assert message in str(exception), (message, str(exception))
+        else:
+            raise AssertionError(f"read {len(bad)} bytes that should have been refused")
+
+    refused(b"NOTANAST" + data[8:], "Not a Brewin AST file")
+    refused(b"", "Not a Brewin AST file")
+    start = len(brewastfile.MAGIC)
+    for version in (brewastfile.VERSION - 1, brewastfile.VERSION + 1):
+        refused(data[:start] + version.to_bytes(4, "little") + data[start + 4:], "version")
+    for cut in range(len(brewastfile.MAGIC), len(data)):
+        refused(data[:cut], "Truncated")
+    refused(data + b"\0", "past its end")
+
+    # load_ast goes through the same checks
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cut.ast")
+        with open(path, "wb") as handle:
+            handle.write(data[:len(data) // 2])
+        try:
+            load_ast(path)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("loaded a truncated file")
+
+
+LOOP_FOREVER = """
+def main() {
+  var i;
+  i = 0;
+  while (true) {
+    i = i + 1;
+    print(i);
+  }
+}
+"""
+
+RECURSE_FOREVER = """
+def down(n) {
+  print(n);
+  return down(n + 1);
+}
+
+def main() {
+  down(0);
+}
+"""
+
+
+# Printing a node doesn't recurse, so trees far deeper than Python's recursion limit print, and write_element
+# writes the same text as str()
+def check_write_element_deep():
+    small = Neg(BinaryOperation("+", Int(1), String("a")))
+    assert str(small) == "neg: op1: [+: op1: [int: val: 1], op2: [string: val: a]]", str(small)
+    depth = sys.getrecursionlimit() * 10
+    node = Int(1)
+    for _ in range(depth):
+        node = Neg(node)
+    assert str(node) == "neg: op1: [" * depth + "int: val: 1" + "]" * depth
+    chain = Int(0)
+    for index in range(depth):
+        chain = BinaryOperation("-", chain, Int(index))
+    stream = io.StringIO()
+    write_element(chain, stream)
+    assert stream.getvalue() == str(chain)
+    assert stream.getvalue().startswith("-: op1: [" * depth + "int: val: 0], op2: [int: val: 0]]")
+
+
+# Runs a program that never ends with a budget and gives the BudgetExceeded it stopped with and what it printed
+def run_out(program, engine, **budget):
+    interpreter = Interpreter(False, None, False, engine=engine, **budget)
+    try:
+        interpreter.run(program)
+    except BudgetExceeded as exception:
+        return exception, interpreter.get_output()
+    raise AssertionError(f"{engine} ran to the end with {budget}")
+
+
+# Every engine stops a loop and a recursion at max_steps, at the same place, and again on the next run
+def check_budget_max_steps():
+    for program in (LOOP_FOREVER, RECURSE_FOREVER):
+        stopped = {}
+        for engine in ENGINES:
+            exception, output = run_out(program, engine, max_steps=300)
+            assert exception.reason == "max_steps", (engine, exception.reason)
+            # The charge that goes past max_steps is counted, so it can go a little over
+            assert exception.steps >= 300, (engine, exception.steps)
+            stopped[engine] = (exception.steps, output[-1])
+        assert len(set(stopped.values())) == 1, stopped
+
+    # The budget starts over on every run
+    interpreter = Interpreter(False, None, False, max_steps=300)
+    stops = []
+    for _ in range(2):
+        try:
+            interpreter.run(LOOP_FOREVER)
+        except BudgetExceeded as exception:
+            stops.append((exception.reason, exception.steps, interpreter.get_output()[-1]))
+    assert len(stops) == 2 and stops[0] == stops[1], stops
+
+
+# A finished program doesn't notice its budget
+def check_budget_not_reached():
+    for engine in ENGINES:
+        interpreter = Interpreter(False, None, False, engine=engine, max_steps=10000, deadline=time.monotonic() + 60)
+        interpreter.run(PROGRAM)
+        assert interpreter.get_output()[-1] == "x is 1", (engine, interpreter.get_output())
+
+
+# Every engine stops at its deadline, not long after it
+def check_budget_deadline():
+    for engine in ENGINES:
+        start = time.monotonic()
+        exception, output = run_out(LOOP_FOREVER, engine, deadline=start + 0.2)
+        assert exception.reason == "deadline", (engine, exception.reason)
+        assert output, engine
+        assert time.monotonic() - start < 2, (engine, time.monotonic() - start)
+
+
+# The iterative engine doesn't recurse in any pass, so blocks nested far past Python's recursion limit resolve and run
+def check_iterative_deep_nesting():
+    depth = 5000
+    program = (
+        "def main() { var x; x = 0; "
+        + "if (x < 1) { var y; y = x + 1; while (y > 0) { y = y - 1; " * depth
+        + "print(x, y); "
+        + "} } " * depth
+        + "}"
+    )
+    interpreter = Interpreter(False, None, False, engine="iterative")
+    interpreter.run(program)
+    assert interpreter.get_output() == ["00"], interpreter.get_output()[:3]
+
+
+# A loop that calls a function, so samples land on jumps back to the condition and on calls
+PROFILED_LOOP = """
+def step(n) {
+  return n + 1;
+}
+
+def main() {
+  var i;
+  var total;
+  i = 0;
+  total = 0;
+  while (i < 100000) {
+    total = total + i;
+    i = step(i);
+  }
+  print(total);
+}
+"""
+
+
+# Every engine puts the samples of a hot loop on the loop, its body and the function it calls, never on the
+# statements that ran before it
+def check_profile_loop():
+    for engine in ENGINES:
+        interpreter = Interpreter(False, None, False, engine=engine, profile=True)
+        interpreter.run(PROFILED_LOOP)
+        profile = interpreter.get_profile()
+        step, main = interpreter.ast.functions
+        loop = main.statements[-2]
+        hot = [loop, *loop.statements, *step.statements]
+        assert sum(profile.counts.values()) > 0, engine
+        elsewhere = {str(node).split("\n")[0]: samples for node, samples in profile.counts.items() if node not in hot}
+        assert not elsewhere, (engine, elsewhere)
+
+
+# A loop calling a function three times, and a branch that never runs
+COUNTED_PROGRAM = """
+def add(a, b) {
+  return a + b;
+}
+
+def main() {
+  var i;
+  i = 0;
+  while (i < 3) {
+    i = add(i, 1);
+  }
+  if (i == 5) {
+    print("never");
+  }
+  print(i);
+}
+"""
+
+
+# Every engine counts the same statements, operations, reads, writes, io and calls, and the coverage map survives
+# a trip through JSON with 0 for the line that never ran
+def check_stats_counts():
+    for engine in ENGINES:
+        interpreter = Interpreter(False, None, False, engine=engine, stats=True)
+        interpreter.run(COUNTED_PROGRAM)
+        stats = interpreter.get_stats()
+        assert stats["statements"] == 11, (engine, stats)
+        assert stats["operations"] == {"<": 4, "+": 3, "==": 1}, (engine, stats)
+        assert (stats["variable_reads"], stats["variable_writes"]) == (15, 4), (engine, stats)
+        assert stats["io"] == {"print": 1, "inputi": 0}, (engine, stats)
+        assert stats["functions"] == [
+            {"name": "main", "arity": 0, "line": 6, "calls": 1, "statements": 8},
+            {"name": "add", "arity": 2, "line": 2, "calls": 3, "statements": 3},
+        ], (engine, stats)
+        coverage = json.loads(json.dumps(interpreter.get_coverage()))
+        assert coverage["version"] == COVERAGE_VERSION, (engine, coverage)
+        expected = {"3": 3, "7": 1, "8": 1, "9": 1, "10": 3, "12": 1, "13": 0, "15": 1}
+        assert coverage["lines"] == expected, (engine, coverage["lines"])
+        calls = {entry["name"]: entry["calls"] for entry in coverage["functions"]}
+        assert calls == {"add": 3, "main": 1}, (engine, coverage["functions"])
+
+
+# A loop that prints and assigns, then a type error
+TRACED_PROGRAM = """
+def main() {
+  var x;
+  x = 0;
+  while (x < 3) {
+    print("x is ", x);
+    x = x + 1;
+  }
+  x = x + "a";
+}
+"""
+
+
+# Every engine keeps only the last events of a run in the ring buffer, and both dumps give those events back
+def check_trace_dumps():
+    error = "ErrorType.TYPE_ERROR on line 9: Incompatible types for arithmetic operation"
+    expected = [
+        {"event": "output", "text": "x is 2"},
+        {"event": "statement", "line": 7, "kind": "="},
+        {"event": "write", "line": 7, "name": "x", "value": 3},
+        {"event": "statement", "line": 9, "kind": "="},
+        {"event": "error", "line": 9, "message": error},
+    ]
+    for engine in ENGINES:
+        interpreter = Interpreter(False, None, 5, engine=engine)
+        try:
+            interpreter.run(TRACED_PROGRAM)
+        except Exception as exception:  # pylint: disable=broad-except
+            assert str(exception) == error, (engine, exception)
+        else:
+            raise AssertionError(f"{engine} ran to the end")
+        trace = interpreter.get_trace()
+        assert trace.events() == expected, (engine, trace.events())
+        text = io.StringIO()
+        trace.write_jsonl(text)
+        assert [json.loads(line) for line in text.getvalue().splitlines()] == expected, (engine, text.getvalue())
+        data = io.BytesIO()
+        trace.write_binary(data)
+        data.seek(0)
+        assert read_binary(data) == expected, engine
+    try:
+        read_binary(io.BytesIO(b"NOTATRACE" + bytes(16)))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("read_binary took a stream without the magic")
+
+
+# A loop with a compare, a print of a variable, x = x + 1, a store of a constant and a constant return
+FUSED_PROGRAM = """
+def one() {
+  return 1;
+}
+
+def main() {
+  var i;
+  i = 0;
+  while (i < 10) {
+    print(i);
+    i = i + 1;
+  }
+  print(one());
+}
+"""
+
+
+# The fusion pass makes the superinstructions its sequences call for and reports them, the mined sequences stay
+# inside basic blocks, and mining a directory adds the fusions of its programs up
+def check_superinstruction_report():
+    expected = {"RETURN_CONST": 3, "STORE_CONST": 1, "COMPARE_JUMP": 1, "PRINT_VAR": 1, "ARITH_VAR_CONST": 1}
+    program = compile_source(FUSED_PROGRAM, True)
+    assert program.fusions == expected, program.fusions
+    report = [line.split() for line in program.fusion_report().splitlines()]
+    assert report[0] == ["RETURN_CONST", "3"] and {name: int(count) for name, count in report} == expected, report
+    unfused = compile_source(FUSED_PROGRAM, False)
+    assert unfused.fusions == {} and unfused.fusion_report() == "no superinstructions"
+    pairs = set(instruction_sequences(unfused, 2))
+    assert {("LESS", "JUMP_IF_FALSE"), ("LOAD_VAR", "PRINT"), ("LOAD_CONST", "RETURN")} <= pairs, pairs
+    assert not any(first in ("JUMP", "JUMP_IF_FALSE", "RETURN") for first, _ in pairs), pairs
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ("a.br", "b.br"):
+            with open(os.path.join(directory, name), "w", encoding="utf-8") as handle:
+                handle.write(FUSED_PROGRAM)
+        sequences, fusions = mine([directory])
+    assert fusions == {name: count * 2 for name, count in expected.items()}, fusions
+    assert sequences[("LESS", "JUMP_IF_FALSE")] == 2, sequences
+
+
+def main():
+    patterns = sys.argv[1:]
+    checks = [
+        (name, function) for name, function in globals().items()
+        if name.startswith("check_") and callable(function) and (not patterns or any(p in name for p in patterns))
+    ]
+    failed = 0
+    for name, function in checks:
+        try:
+            function()
+        except Exception:  # pylint: disable=broad-except
+            failed += 1
+            print(f"{name}: FAILED")
+            traceback.print_exc()
+        else:
+            print(f"{name}: ok")
+    print(f"{len(checks) - failed} of {len(checks)} checks passed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,370 @@
+"""
+AST nodes.
+
+Every kind of node has its own class with __slots__ for its fields, so a node is
+one small object instead of an object, its __dict__ and a second dict of fields,
+and building one is a plain __init__. Every node also has an int kind code (the
+constants below) next to its elem_type string, for code that dispatches on the
+kind. The binary operators share one class, so they all have op1 and op2.
+
+The old interface still works on every node: elem_type, get(key), which gives
+None for a field the node doesn't have, and dict, which builds a dict of the
+fields in order. dict is a fresh copy every time, so it's read-only: writing to
+node.dict[key] changes the copy and not the node, set the attribute instead.
+make_element(elem_type, **fields) builds the right class from an
+elem_type, like Element(elem_type, **fields) used to. write_element(node, stream)
+writes what str(node) gives to a text stream, without recursing, so it works on
+trees of any depth.
+"""
+
+import io
+
+from intbase import InterpreterBase
+from brewops import BINARY_OPERATORS
+
+# Kind codes
+(
+    PROGRAM, INTERFACE, FIELD_FUNC, FIELD_VAR, FUNC, ARG, ASSIGNMENT, VAR_DEF, BVAR_DEF, IF, WHILE, RETURN, FCALL,
+    QUALIFIED_NAME, INT, STRING, BOOL, NIL, EMPTY_OBJ, CLOSURE, CONVERT, NEG, NOT,
+) = range(23)
+# Binary operators come after those, in BINARY_OPERATORS order
+BINARY_KINDS = {op: NOT + 1 + index for index, op in enumerate(BINARY_OPERATORS)}
+
+
 class Element:
-    def __init__(self, elem_type, **kwargs):
-        self.elem_type = elem_type
-        self.dict = {}
-        for key, value in kwargs.items():
-            self.dict[key] = value
+    # The kind code is kept on each node rather than the class, since Python reads a slot faster than a class
+    # attribute, and code that dispatches on it reads it a lot
+    __slots__ = ('kind',)
+    elem_type = None
+    # The node's fields in order, which is how they're printed and how dict has them
+    field_names = ()
+    # Fields left out of dict when they're None, because the parser used to leave them out
+    optional_fields = ()
 
+    # Only fields count, so get('kind') or get('elem_type') is None like it was when fields were a dict. Nil's val
+    # isn't a field and is None either way
     def get(self, key):
-        if key not in self.dict:
-            return None
-        return self.dict[key]
+        return getattr(self, key) if key in self.field_names else None
+
+    @property
+    def dict(self):
+        return {
+            key: getattr(self, key) for key in self.field_names
+            if key not in self.optional_fields or getattr(self, key) is not None
+        }
 
     def __str__(self):
-        s = f"{self.elem_type}: "
-        for key, value in self.dict.items():
-            s += key + ": " + self.__val(value) + ", "
-        return s[0:-2]
-
-    def __val(self, v):
-        if isinstance(v, Element):
-            return "[" + str(v) + "]"
-        if isinstance(v, list):
-            s = ""
-            for i in v:
-                s += str(i) + ", "
-            if len(s) > 0:
-                return "[" + s[0:-2] + "]"
-            return "[" + s + "]"
-        return str(v)
+        buffer = io.StringIO()
+        write_element(self, buffer)
+        return buffer.getvalue()
+
+
+# Pieces write_element collects before it writes them out
+WRITE_BATCH = 4096
+
+
+# Writes str(node) to a text stream a piece at a time. The tree is walked with an explicit stack of what's
+# still to be written, text and nodes, so deep trees don't hit the recursion limit and nothing is built up by
+# concatenating whole subtrees
+def write_element(node, stream):
+    pieces = []
+    pending = [node]
+    while pending:
+        item = pending.pop()
+        if type(item) is str:
+            pieces.append(item)
+        else:
+            # The node's text, with its child nodes in between. Text runs up to the next child in text
+            ahead = []
+            text = str(item.elem_type)
+            separator = ": "
+            optional = item.optional_fields
+            for key in item.field_names:
+                value = getattr(item, key)
+                if value is None and key in optional:
+                    continue
+                text += separator + key + ": "
+                separator = ", "
+                if isinstance(value, Element):
+                    ahead += (text + "[", value)
+                    text = "]"
+                elif isinstance(value, list):
+                    text += "["
+                    for index, child in enumerate(value):
+                        if index:
+                            text += ", "
+                        if isinstance(child, Element):
+                            ahead += (text, child)
+                            text = ""
+                        else:
+                            text += str(child)
+                    text += "]"
+                else:
+                    text += str(value)
+            if not ahead:
+                pieces.append(text)
+                continue
+            ahead.append(text)
+            ahead.reverse()
+            pending += ahead
+        if len(pieces) >= WRITE_BATCH:
+            stream.write("".join(pieces))
+            pieces.clear()
+    stream.write("".join(pieces))
+
+
+class Program(Element):
+    __slots__ = field_names = ('interfaces', 'functions')
+    elem_type = InterpreterBase.PROGRAM_NODE
+    optional_fields = ('interfaces',)
+
+    def __init__(self, functions, interfaces=None):
+        self.kind = PROGRAM
+        self.interfaces = interfaces
+        self.functions = functions
+
+
+class Interface(Element):
+    __slots__ = field_names = ('name', 'fields')
+    elem_type = InterpreterBase.INTERFACE_NODE
+
+    def __init__(self, name, fields):
+        self.kind = INTERFACE
+        self.name = name
+        self.fields = fields
+
+
+class FieldFunc(Element):
+    __slots__ = field_names = ('name', 'params')
+    elem_type = InterpreterBase.FIELD_FUNC_NODE
+
+    def __init__(self, name, params):
+        self.kind = FIELD_FUNC
+        self.name = name
+        self.params = params
+
+
+class FieldVar(Element):
+    __slots__ = field_names = ('name',)
+    elem_type = InterpreterBase.FIELD_VAR_NODE
+
+    def __init__(self, name):
+        self.kind = FIELD_VAR
+        self.name = name
+
+
+# Named functions and lambdas, a lambda's name is the keyword it was written with
+class Func(Element):
+    __slots__ = field_names = ('name', 'args', 'statements')
+    elem_type = InterpreterBase.FUNC_NODE
+
+    def __init__(self, name, args, statements):
+        self.kind = FUNC
+        self.name = name
+        self.args = args
+        self.statements = statements
+
+
+class Arg(Element):
+    __slots__ = field_names = ('name', 'ref')
+    elem_type = InterpreterBase.ARG_NODE
+
+    def __init__(self, name, ref):
+        self.kind = ARG
+        self.name = name
+        self.ref = ref
+
+
+class Assignment(Element):
+    __slots__ = field_names = ('var', 'expression')
+    elem_type = InterpreterBase.ASSIGNMENT_NODE
+
+    def __init__(self, var, expression):
+        self.kind = ASSIGNMENT
+        self.var = var
+        self.expression = expression
+
+
+class VarDef(Element):
+    __slots__ = field_names = ('name',)
+    elem_type = InterpreterBase.VAR_DEF_NODE
+
+    def __init__(self, name):
+        self.kind = VAR_DEF
+        self.name = name
+
+
+class BvarDef(Element):
+    __slots__ = field_names = ('name',)
+    elem_type = InterpreterBase.BVAR_DEF_NODE
+
+    def __init__(self, name):
+        self.kind = BVAR_DEF
+        self.name = name
+
+
+class If(Element):
+    __slots__ = field_names = ('condition', 'statements', 'else_statements')
+    elem_type = InterpreterBase.IF_NODE
+
+    def __init__(self, condition, statements, else_statements=None):
+        self.kind = IF
+        self.condition = condition
+        self.statements = statements
+        self.else_statements = else_statements
+
+
+class While(Element):
+    __slots__ = field_names = ('condition', 'statements')
+    elem_type = InterpreterBase.WHILE_NODE
+
+    def __init__(self, condition, statements):
+        self.kind = WHILE
+        self.condition = condition
+        self.statements = statements
+
+
+class Return(Element):
+    __slots__ = field_names = ('expression',)
+    elem_type = InterpreterBase.RETURN_NODE
+
+    def __init__(self, expression=None):
+        self.kind = RETURN
+        self.expression = expression
+
+
+class FCall(Element):
+    __slots__ = field_names = ('name', 'args')
+    elem_type = InterpreterBase.FCALL_NODE
+
+    def __init__(self, name, args):
+        self.kind = FCALL
+        self.name = name
+        self.args = args
+
+
+class QualifiedName(Element):
+    __slots__ = field_names = ('name',)
+    elem_type = InterpreterBase.QUALIFIED_NAME_NODE
+
+    def __init__(self, name):
+        self.kind = QUALIFIED_NAME
+        self.name = name
+
+
+class Int(Element):
+    __slots__ = field_names = ('val',)
+    elem_type = InterpreterBase.INT_NODE
+
+    def __init__(self, val):
+        self.kind = INT
+        self.val = val
+
+
+class String(Element):
+    __slots__ = field_names = ('val',)
+    elem_type = InterpreterBase.STRING_NODE
+
+    def __init__(self, val):
+        self.kind = STRING
+        self.val = val
+
+
+class Bool(Element):
+    __slots__ = field_names = ('val',)
+    elem_type = InterpreterBase.BOOL_NODE
+
+    def __init__(self, val):
+        self.kind = BOOL
+        self.val = val
+
+
+# nil has no fields, but its 'val' is None like the other literals' values
+class Nil(Element):
+    __slots__ = ()
+    elem_type = InterpreterBase.NIL_NODE
+    val = None
+
+    def __init__(self):
+        self.kind = NIL
+
+
+class EmptyObj(Element):
+    __slots__ = ()
+    elem_type = InterpreterBase.EMPTY_OBJ_NODE
+
+    def __init__(self):
+        self.kind = EMPTY_OBJ
+
+
+# closure f, the function's name is kept in 'args'
+class Closure(Element):
+    __slots__ = field_names = ('args',)
+    elem_type = InterpreterBase.CLOSURE_NODE
+
+    def __init__(self, args):
+        self.kind = CLOSURE
+        self.args = args
+
+
+class Convert(Element):
+    __slots__ = field_names = ('to_type', 'expr')
+    elem_type = InterpreterBase.CONVERT_NODE
+
+    def __init__(self, to_type, expr):
+        self.kind = CONVERT
+        self.to_type = to_type
+        self.expr = expr
+
+
+class Neg(Element):
+    __slots__ = field_names = ('op1',)
+    elem_type = InterpreterBase.NEG_NODE
+
+    def __init__(self, op1):
+        self.kind = NEG
+        self.op1 = op1
+
+
+class Not(Element):
+    __slots__ = field_names = ('op1',)
+    elem_type = InterpreterBase.NOT_NODE
+
+    def __init__(self, op1):
+        self.kind = NOT
+        self.op1 = op1
+
+
+# All the binary operators share this class, so the operator is kept on the node. site isn't a field, it's
+# where the tree walker keeps the node's brewquicken.BinarySite
+class BinaryOperation(Element):
+    __slots__ = ('elem_type', 'op1', 'op2', 'site')
+    field_names = ('op1', 'op2')
+
+    def __init__(self, elem_type, op1, op2):
+        self.kind = BINARY_KINDS[elem_type]
+        self.elem_type = elem_type
+        self.op1 = op1
+        self.op2 = op2
+        self.site = None
+
+
+# Node classes in kind code order, BinaryOperation covers the codes after them
+KIND_CLASSES = (
+    Program, Interface, FieldFunc, FieldVar, Func, Arg, Assignment, VarDef, BvarDef, If, While, Return, FCall,
+    QualifiedName, Int, String, Bool, Nil, EmptyObj, Closure, Convert, Neg, Not,
+)
+# elem_type -> node class
+NODE_CLASSES = {cls.elem_type: cls for cls in KIND_CLASSES}
+# kind code -> elem_type
+ELEM_TYPES = tuple(cls.elem_type for cls in KIND_CLASSES) + BINARY_OPERATORS
+
+
+# A node from its elem_type and fields, for code that only has those
+def make_element(elem_type, **fields):
+    if elem_type in BINARY_KINDS:
+        return BinaryOperation(elem_type, **fields)
+    cls = NODE_CLASSES.get(elem_type)
+    if cls is None:
+        raise ValueError(f"Unknown node type: {elem_type}")
+    return cls(**fields)
@@ -5,6 +5,7 @@ test management.
 
 import asyncio
 import json
+import time
 from os import makedirs
 from os.path import exists
 from abc import ABC, abstractmethod
@@ -38,6 +39,8 @@ async def run_test_wrapper(interpreter, test_case, timeout):
     Uses asyncio to enforce timeout, not for concurrency.
     """
     print(f'Running {test_case["srcfile"]}... ', end="")
+    # The worker thread can't be cancelled, so the scaffold gets the deadline to stop the program itself
+    test_case = {**test_case, "deadline": time.monotonic() + timeout}
     try:
         async with asyncio.timeout(timeout):
             result = await asyncio.to_thread(run_test, interpreter, test_case)
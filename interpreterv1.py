@@ -1,80 +1,426 @@
 from brewparse import parse_program
 from intbase import InterpreterBase, ErrorType
+from brewclosure import ClosureCompiler
+from brewbytecode import BytecodeCompiler
+from brewtranspile import PythonTranspiler
+from brewregister import RegisterCompiler
+from brewiterative import IterativeWalker
+from brewresolve import resolve_program
+from brewoptimize import fold_constants
+from brewquicken import BinarySite
+from brewbudget import Budget, BudgetExceeded  # BudgetExceeded is what callers catch, so it's importable from here too
+from brewprofile import Profiler, SAMPLE_INTERVAL, find_frame, enclosing_statements
+from brewpositions import SourcePositions, innermost_node
+from brewstats import ExecutionCounts, execution_stats, coverage_map
+from brewtrace import Trace, TRACE_CAPACITY
+from brewcache import ProgramCache
+from brewobjects import BrewinObject, FieldCache, FunctionValue, Cell, get_cached_path, check_callable
+from element import (
+    VAR_DEF, ASSIGNMENT, FCALL, IF, WHILE, RETURN, QUALIFIED_NAME, INT, STRING, BOOL, NIL, EMPTY_OBJ, FUNC, CLOSURE,
+    CONVERT, NEG, NOT, BINARY_KINDS,
+)
+from brewops import evaluate_unary, convert, to_string, check_condition
+
+# Literal nodes, their value is just stored in 'val' (nil has none, so it comes back as None)
+VALUE_KINDS = (INT, STRING, BOOL, NIL)
+BINARY_KIND_CODES = frozenset(BINARY_KINDS.values())
+
+# Parsed programs kept for every Interpreter in the process, and compiled ones kept by each Interpreter.
+# Sizes are in AST nodes
+PARSED_PROGRAM_LIMIT = 256
+PARSED_NODE_LIMIT = 1000000
+COMPILED_PROGRAM_LIMIT = 16
+COMPILED_NODE_LIMIT = 250000
+PARSED_PROGRAMS = ProgramCache(PARSED_PROGRAM_LIMIT, PARSED_NODE_LIMIT)
+
+
+# Nodes in a folded program, near enough: the ones with a position, plus the program node
+def program_size(positions):
+    return len(positions.offsets) + 1
+
 
 class Interpreter(InterpreterBase):
+    # Engines that prepare the AST once before running it, by name
+    # "tree" (the default) walks the AST directly and isn't in here
+    # "iterative" walks it too, but with explicit stacks so deep recursion doesn't hit Python's limit
+    COMPILERS = {
+        "closure": ClosureCompiler,
+        "bytecode": BytecodeCompiler,
+        "python": PythonTranspiler,
+        "register": RegisterCompiler,
+        "iterative": IterativeWalker,
+    }
+
     # Init
-    def __init__(self, console_output=True, inp=None, trace_output=False):
+    # max_steps and deadline (a time.monotonic() timestamp) cap how long a run can go, past either one it
+    # raises BudgetExceeded. Without them nothing gets counted
+    # profile=True (or a sampling interval in seconds) runs the sampling profiler, see get_profile()
+    # stats=True counts what every node and function does, see get_stats() and get_coverage()
+    # trace_output=True (or how many events to keep) records the last events of every run, see get_trace()
+    # parse_cache is a directory where parsed programs are kept between runs and processes, see brewcache.py
+    def __init__(self, console_output=True, inp=None, trace_output=False, engine="tree", max_steps=None, deadline=None,
+                 profile=False, stats=False, parse_cache=None):
         super().__init__(console_output, inp)   # call InterpreterBase's constructor
+        if engine != "tree" and engine not in Interpreter.COMPILERS:
+            raise ValueError(f"Unknown engine: {engine}")
+        self.engine = engine
+        self.parse_cache = parse_cache
+        self.budget = Budget(max_steps, deadline) if max_steps is not None or deadline is not None else None
+        self.profiler = None
+        if profile:
+            self.profiler = Profiler(SAMPLE_INTERVAL if profile is True else profile)
+        # Profile of the last run
+        self.profile = None
+        # Counters the engines compile in, only there with stats=True
+        self.counts = ExecutionCounts() if stats else None
+        if self.counts is not None and engine == "tree":
+            self.count_tree_walker()
+        # AST of the last program parsed, what the counts get added up over
+        self.ast = None
+        # Ring buffer of what the program did, only there with trace_output on
+        self.trace = None
+        if trace_output:
+            self.trace = Trace(TRACE_CAPACITY if trace_output is True else trace_output)
+            self.trace_output_calls()
+            if engine == "tree":
+                self.trace_tree_walker()
+        # source -> (ast, positions, compiler, compiled program) for the programs this interpreter compiled
+        # last, so running one of them again skips parsing and compiling. The tree walker keeps
+        # (ast, positions, resolution) in here instead
+        self.compiled_programs = ProgramCache(COMPILED_PROGRAM_LIMIT, COMPILED_NODE_LIMIT)
+        self.compiler = None
+        # Where the nodes of the program being run are in its source
+        self.positions = None
 
     # Program Node
     def run(self, program):
+        if self.budget is not None:
+            self.budget.reset()
+        if self.counts is not None:
+            self.counts.reset()
+        if self.trace is not None:
+            self.trace.reset()
+        self.ast = None
+        try:
+            if self.engine != "tree":
+                self.run_compiled(program)
+            else:
+                self.run_tree(program)
+        except Exception as exception:
+            if self.trace is not None:
+                self.trace.record_error(exception, self.error_line)
+            raise
+
+    # Parses and runs a program with the tree walker. The tree walker has nothing to compile, but it keeps
+    # the program's Resolution in compiled_programs so running it again doesn't resolve it again
+    def run_tree(self, program):
         # Pretty much copied from provided pseudocode
         # Runs the main function
-        ast = parse_program(program)         # parse program into AST
-        self.variable_name_to_value = {}  # dict to hold variables
+        resolved = self.compiled_programs.get(program)
+        if resolved is None:
+            # parse program into AST, with constant subexpressions folded
+            ast, self.positions = self.parse(program)
+            resolution = None
+        else:
+            ast, self.positions, resolution = resolved
+        self.ast = ast
+        try:
+            if resolution is None:
+                # undefined/duplicate variables are reported before anything runs, and we get the function table
+                resolution = resolve_program(ast, super().error)
+                self.compiled_programs.put(program, (ast, self.positions, resolution), program_size(self.positions))
+            self.run_ast(ast, resolution)
+        except Exception as exception:
+            self.add_error_line(exception, self.locate_statement)
+            raise
+
+    # Runs the main function of a resolved program
+    def run_ast(self, ast, resolution):
+        self.resolution = resolution
+        self.functions = self.resolution.functions
+        # One value per function for when it's used as one, so f == f
+        self.function_values = {func: FunctionValue(name, arity, func) for (name, arity), func in self.functions.items()}
+        self.field_caches = {}  # node -> one inline cache per field in its dotted name
+        # func node -> frames its finished calls left behind, reused instead of making new ones
+        self.free_frames = {func_node: [] for func_node in self.resolution.frame_sizes}
+        self.frame = None  # the running call's variables, in the slots the resolver gave them
+        self.return_value = None
+        if self.trace is not None:
+            # assigned expression -> its assignment, for tracing what assignments store
+            self.traced_assignments = {
+                node.get('expression'): node for node in enclosing_statements(ast)
+                if node.elem_type == InterpreterBase.ASSIGNMENT_NODE
+            }
         main_func_node = self.get_main_func_node(ast)
-        self.run_func(main_func_node)
+        self.run_profiled(ast, self.locate_statement, lambda: self.run_func(main_func_node, []))
 
+    # The folded AST of a program and its SourcePositions. They're shared by every Interpreter in the process
+    # (nothing changes an AST once it's folded), so a program is only parsed again once it's fallen out of
+    # PARSED_PROGRAMS
+    def parse(self, program):
+        parsed = PARSED_PROGRAMS.get(program)
+        if parsed is None:
+            positions = SourcePositions(program)
+            ast = parse_program(program, positions=positions, cache_dir=self.parse_cache)
+            parsed = (fold_constants(ast, positions), positions)
+            PARSED_PROGRAMS.put(program, parsed, program_size(positions))
+        return parsed
 
-    # Function Definition Node
-    def get_main_func_node(self, ast):
-        # Get main function
-        if ast.elem_type != InterpreterBase.PROGRAM_NODE:
+    # Compiles the program with the selected engine (reusing it if it was compiled recently) and runs it
+    def run_compiled(self, program):
+        compiled = self.compiled_programs.get(program)
+        if compiled is None:
+            ast, self.positions = self.parse(program)
+            self.ast = ast
+            compiler = Interpreter.COMPILERS[self.engine](self)
+            try:
+                compiled_program = compiler.compile_program(ast)
+            except Exception as exception:
+                self.add_error_line(exception, None)
+                raise
+            compiled = (ast, self.positions, compiler, compiled_program)
+            self.compiled_programs.put(program, compiled, program_size(self.positions))
+        ast, self.positions, self.compiler, compiled_program = compiled
+        self.ast = ast
+        try:
+            self.run_profiled(ast, self.compiler.locate_statement, compiled_program)
+        except Exception as exception:
+            self.add_error_line(exception, self.compiler.locate_statement)
+            raise
+
+    # Runs a program that's ready to go, with the profiler sampling it if it's on
+    def run_profiled(self, ast, locate, run):
+        if self.trace is not None:
+            self.trace.positions = self.positions
+        if self.profiler is None:
+            run()
+            return
+        self.profiler.start(locate)
+        try:
+            run()
+        finally:
+            self.profile = self.profiler.stop(ast, self.positions)
+
+    # Brewin errors are raised without a line number, since nothing that raises them knows one. Once one
+    # gets here, the line comes from the statement the engine was on when it was raised (locate gets
+    # that out of the innermost frame of the traceback, same as for the profiler), or failing that the
+    # innermost node in the traceback's frames. Nothing is looked up unless there's an error
+    def add_error_line(self, exception, locate):
+        message = str(exception)
+        if self.error_type is None or self.error_line is not None or not message.startswith(str(self.error_type)):
+            return
+        traceback = exception.__traceback__
+        while traceback.tb_next is not None:
+            traceback = traceback.tb_next
+        node = locate(traceback.tb_frame) if locate is not None else None
+        if node is None:
+            node = innermost_node(traceback.tb_frame, self.positions)
+        line = self.positions.line(node) if node is not None else None
+        if line is not None:
+            # Same message InterpreterBase.error makes when it's given the line
+            self.error_line = line
+            exception.args = (f"{self.error_type} on line {line}{message[len(str(self.error_type)):]}",)
+
+    # Hits, misses and evictions of the parsed programs shared by every Interpreter and of this one's compiled programs
+    def get_cache_stats(self):
+        return {'parsed': PARSED_PROGRAMS.stats(), 'compiled': self.compiled_programs.stats()}
+
+    # The Profile of the last run, None unless the interpreter was made with profile=True
+    def get_profile(self):
+        return self.profile
+
+    # Totals from the counters for the last run (see brewstats.py), None unless the interpreter was made with stats=True
+    def get_stats(self):
+        if self.counts is None or self.ast is None:
             return None
-        
-        functions = ast.get('functions')
+        return execution_stats(self.counts, self.ast, self.positions)
 
-        if functions is None:
+    # Runs per line, node and function of the last run's source, as a dict json.dump can write out
+    def get_coverage(self):
+        if self.counts is None or self.ast is None:
             return None
-        for func in functions:
-            if func.elem_type == InterpreterBase.FUNC_NODE:
-                func_name = func.get('name')
-                if func_name == 'main':
-                    return func
-                else:
-                    super().error(ErrorType.NAME_ERROR, "No main() function was found")
-                    
-        return None
-
-    def run_func(self, func_node):
-        # Also mostly copied from pseudocode, added check for no statements
-        # Go through statements in the function and run them
-        statements = func_node.get('statements')
-        if statements is None:
-            return
+        return coverage_map(self.counts, self.ast, self.positions)
+
+    # Counting versions of the methods every statement, expression and call goes through, put on this
+    # instance only, so an interpreter made without stats=True runs the plain methods
+    def count_tree_walker(self):
+        nodes = self.counts.nodes
+        calls = self.counts.calls
+        run_statement = self.run_statement
+        evaluate_expression = self.evaluate_expression
+        run_func = self.run_func
+
+        def count_statement(statement_node):
+            nodes[statement_node] += 1
+            return run_statement(statement_node)
+
+        def count_expression(expression_node):
+            nodes[expression_node] += 1
+            return evaluate_expression(expression_node)
+
+        def count_call(func_node, arg_values, cells=()):
+            calls[func_node] += 1
+            return run_func(func_node, arg_values, cells)
+
+        self.run_statement = count_statement
+        self.evaluate_expression = count_expression
+        self.run_func = count_call
+
+    # The Trace of the last run, None unless the interpreter was made with trace_output on
+    def get_trace(self):
+        return self.trace
+
+    # Everything every engine prints goes through output, so that's where output gets recorded
+    def trace_output_calls(self):
+        record = self.trace.records.append
+        output = self.output
+
+        def trace_output(value):
+            record(value)
+            output(value)
+
+        self.output = trace_output
+
+    # Tracing versions of the methods statements and assigned values go through, put on this instance
+    # only, like the counters
+    def trace_tree_walker(self):
+        record = self.trace.records.append
+        run_statement = self.run_statement
+        evaluate_expression = self.evaluate_expression
+
+        def trace_statement(statement_node):
+            record(statement_node)
+            return run_statement(statement_node)
+
+        # The value is recorded once it's worked out, before it's stored
+        def trace_expression(expression_node):
+            value = evaluate_expression(expression_node)
+            assignment = self.traced_assignments.get(expression_node)
+            if assignment is not None:
+                record((assignment, value))
+            return value
+
+        self.run_statement = trace_statement
+        self.evaluate_expression = trace_expression
+
+    # For the profiler: the statement the innermost run_statement in a frame stack is running
+    def locate_statement(self, frame):
+        frame = find_frame(frame, Interpreter.run_statement.__code__)
+        return frame.f_locals['statement_node'] if frame is not None else None
+
+    # Function Definition Node
+    def get_main_func_node(self, ast):
+        # Functions are looked up in the table by (name, arity), main takes no parameters
+        main_func_node = self.functions.get(('main', 0))
+        if main_func_node is None:
+            super().error(ErrorType.NAME_ERROR, "No main() function was found")
+        return main_func_node
+
+    # Runs a function with already evaluated arguments and returns what it returned (nil if nothing)
+    # cells are the captured variables of a lambda
+    def run_func(self, func_node, arg_values, cells=()):
+        # Each call gets its own frame, parameters take the first slots and a lambda's captured cells come
+        # right after them
+        caller_frame = self.frame
+        pool = self.free_frames[func_node]
+        frame = pool.pop() if pool else [None] * self.resolution.frame_size(func_node)
+        arity = len(arg_values)
+        frame[:arity] = arg_values
+        if cells:
+            frame[arity:arity + len(cells)] = cells
+        # Parameters some lambda captures live in cells, like any captured variable
+        for slot in self.resolution.cell_params[func_node]:
+            frame[slot] = Cell(frame[slot])
+        self.frame = frame
+        self.return_value = None
+        if self.budget is not None:
+            self.budget.charge(self.budget.cost(func_node))
+        self.run_block(func_node.get('statements') or [])
+        pool.append(frame)
+        self.frame = caller_frame
+        return_value = self.return_value
+        self.return_value = None
+        return return_value
+
+    # Runs the statements of a block, returns True if a return statement ran. Scoping was all worked out by
+    # the resolver, a block's variables just have slots of their own in the frame
+    def run_block(self, statements):
         for statement_node in statements:
-            self.run_statement(statement_node)
+            if self.run_statement(statement_node):
+                return True
+        return False
 
 
     # Statement Nodes
     def run_statement(self, statement_node):
         # I dedicate this code to my best friend, Provided Pseudocode. It has never let me down.
-        # Checks type of statement and runs it
-        if statement_node.elem_type == InterpreterBase.VAR_DEF_NODE:
+        # Checks type of statement and runs it, returns True once a return statement has run
+        kind = statement_node.kind
+        if kind == VAR_DEF:
             self.do_definition(statement_node)
-        elif statement_node.elem_type == InterpreterBase.ASSIGNMENT_NODE:
+        elif kind == ASSIGNMENT:
             self.do_assignment(statement_node)
-        elif statement_node.elem_type == InterpreterBase.FCALL_NODE:
+        elif kind == FCALL:
             self.do_func_call(statement_node)
+        elif kind == IF:
+            return self.do_if(statement_node)
+        elif kind == WHILE:
+            return self.do_while(statement_node)
+        elif kind == RETURN:
+            return self.do_return(statement_node)
         else:
             super().error(ErrorType.TYPE_ERROR, f"Unknown statement type: {statement_node.elem_type}")
-        
-    # Variable Definition Statement
+        return False
+
+    # Variable Definition Statement, duplicates were reported by the resolver
     def do_definition(self, statement_node):
-        var_name = statement_node.get('name')
-        if var_name in self.variable_name_to_value:
-            super().error(ErrorType.NAME_ERROR, f"Variable {var_name} already defined")
-        self.variable_name_to_value[var_name] = None
+        # Each time a definition runs its variable is a new one, so lambdas made in a loop don't share it
+        self.frame[self.resolution.slot(statement_node)] = Cell() if self.resolution.in_cell(statement_node) else None
        
     # Assignemnt Statement
     def do_assignment(self, statement_node):
         # Credit to pseudocode!
-        target_var_name = statement_node.get('var')
-        if not (target_var_name in self.variable_name_to_value):
-            super().error(ErrorType.NAME_ERROR, f"Variable {target_var_name} not defined")
+        # a.b.c = ... assigns field c of whatever a.b is, a itself stays the same
+        # The target is always defined, the resolver reports undefined ones before the program runs
+        slot = self.resolution.slot(statement_node)
         source_node = statement_node.get('expression')
         resulting_value = self.evaluate_expression(source_node)
-        self.variable_name_to_value[target_var_name] = resulting_value
+        if self.resolution.path(statement_node)[1]:
+            caches = self.get_field_caches(statement_node)
+            value = self.frame[slot]
+            if self.resolution.in_cell(statement_node):
+                value = value.value
+            obj = get_cached_path(value, caches[:-1], super().error)
+            caches[-1].set(obj, resulting_value, super().error)
+        elif self.resolution.in_cell(statement_node):
+            self.frame[slot].value = resulting_value
+        else:
+            self.frame[slot] = resulting_value
+
+    # If Statement
+    def do_if(self, statement_node):
+        condition = check_condition(self.evaluate_expression(statement_node.get('condition')), super().error)
+        if condition:
+            return self.run_block(statement_node.get('statements'))
+        elif statement_node.get('else_statements') is not None:
+            return self.run_block(statement_node.get('else_statements'))
+        return False
+
+    # While Statement, the body gets a fresh scope every time around
+    def do_while(self, statement_node):
+        budget = self.budget
+        while check_condition(self.evaluate_expression(statement_node.get('condition')), super().error):
+            if budget is not None:
+                budget.charge(budget.cost(statement_node))
+            if self.run_block(statement_node.get('statements')):
+                return True
+        return False
+
+    # Return Statement, the value is picked up by run_func
+    def do_return(self, statement_node):
+        expression_node = statement_node.get('expression')
+        self.return_value = self.evaluate_expression(expression_node) if expression_node is not None else None
+        return True
 
     # Function Call Statment
     def do_func_call(self, statement_node):
@@ -87,7 +433,7 @@ class Interpreter(InterpreterBase):
         elif func_name == 'inputi':
             self.do_inputi(args)
         else:
-            super().error(ErrorType.NAME_ERROR, f"Function {func_name} undefined")
+            self.call_user_function(statement_node)
 
     # Handles user input (integer)
     def do_inputi(self, args):
@@ -97,7 +443,7 @@ class Interpreter(InterpreterBase):
         # Needs to be separate if statement
         if len(args) == 1:
             prompt = self.evaluate_expression(args[0])
-            super().output(str(prompt))
+            self.output(to_string(prompt))
         elif len(args) > 1:
             super().error(ErrorType.NAME_ERROR, "No inputi() function found that takes > 1 parameter")
         # Else would be no args, which is valid and nothing needs to happen
@@ -113,31 +459,47 @@ class Interpreter(InterpreterBase):
         all_args = []
         for arg in args:
             value = self.evaluate_expression(arg)
-            all_args.append(str(value))
+            all_args.append(to_string(value))
         # Print all args together
         result = ''.join(all_args)
-        super().output(result)
+        self.output(result)
 
 
     # Expression Nodes
     def evaluate_expression(self, expression_node):
         # Pseudocode
+        kind = expression_node.kind
         # Value
-        if expression_node.elem_type in [InterpreterBase.INT_NODE, InterpreterBase.STRING_NODE]:
+        if kind in VALUE_KINDS:
             return self.get_value(expression_node)
         # Variable
-        elif expression_node.elem_type == InterpreterBase.QUALIFIED_NAME_NODE:
+        elif kind == QUALIFIED_NAME:
             return self.get_value_of_variable(expression_node)
         # Operator
-        elif expression_node.elem_type in ['+', '-', '*', '/']:
+        elif kind in BINARY_KIND_CODES:
             return self.binary_operator(expression_node)
+        elif kind == NEG or kind == NOT:
+            return evaluate_unary(expression_node.elem_type, self.evaluate_expression(expression_node.get('op1')), super().error)
+        # int(), str(), bool()
+        elif kind == CONVERT:
+            value = self.evaluate_expression(expression_node.get('expr'))
+            return convert(expression_node.get('to_type'), value, super().error)
         # Function call
-        elif expression_node.elem_type == InterpreterBase.FCALL_NODE:
+        elif kind == FCALL:
             return self.function_call(expression_node)
+        # @, a new object with no fields
+        elif kind == EMPTY_OBJ:
+            return BrewinObject()
+        # lambdai(x) { ... }
+        elif kind == FUNC:
+            return self.make_closure(expression_node)
+        # closure f, the function f as a value
+        elif kind == CLOSURE:
+            return self.function_values[self.resolution.function_refs[expression_node]]
         else:
             super().error(ErrorType.TYPE_ERROR, f"Unknown expression type: {expression_node.elem_type}")
     
-    # Handles arithmetic
+    # Handles arithmetic, comparisons and && / ||
     def binary_operator(self, expression_node):
         op = expression_node.elem_type
         # This splits the expression into two, then runs eval on both parts
@@ -148,24 +510,17 @@ class Interpreter(InterpreterBase):
         # So 5 + 7 and 10 - 4 will be evaluated, then it'll subtract them
         op1 = self.evaluate_expression(expression_node.get('op1'))
         op2 = self.evaluate_expression(expression_node.get('op2'))
-        
-        if not isinstance(op1, int) or not isinstance(op2, int):
-            super().error(ErrorType.TYPE_ERROR, "Incompatible types for arithmetic operation")
-        
-        if op == '+':
-            return op1 + op2
-        elif op == '-':
-            return op1 - op2
-        # Extra multiplication + division for next project?
-        elif op == '*':
-            return op1 * op2
-        elif op == '/':
-            if op2 == 0:
-                # Not really a fault error, but didn't want to change intbase to add new error type in case that messes with grading
-                super().error(ErrorType.FAULT_ERROR, "Cannot divide by 0. Fool.")
-            return op1 / op2
-        else:
-            super().error(ErrorType.TYPE_ERROR, f"Unsupported operator: {op}")
+
+        # Once the node has quickened, operands of its guard type go straight to the specialized handler. The site
+        # is on the node, so there's nothing to look up
+        site = expression_node.site
+        if site is None:
+            site = expression_node.site = BinarySite(op)
+        guard, handler = site.quick
+        if type(op1) is guard and type(op2) is guard:
+            return handler(op1, op2)
+        # Otherwise type checks and the actual operation come from brewops so every engine agrees on them
+        return site.evaluate(op1, op2, super().error)
 
     # Function call
     def function_call(self, expression_node):
@@ -176,15 +531,52 @@ class Interpreter(InterpreterBase):
         if func_name == 'inputi':
             return self.do_inputi(args)
         else:
-            super().error(ErrorType.NAME_ERROR, f"Function {func_name} undefined")
+            return self.call_user_function(expression_node)
+
+    # Calls a function from the table, or the one in a variable/field for f(...) where f is a variable
+    # and obj.method(...). Arguments are evaluated left to right in the caller's scopes, after the function is found
+    def call_user_function(self, call_node):
+        func_name = call_node.get('name')
+        args = call_node.get('args') or []
+        cells = ()
+        if self.resolution.is_value_call(call_node):
+            function_value = check_callable(self.get_value_of_variable(call_node), len(args), super().error)
+            func_node = function_value.target
+            cells = function_value.cells
+        else:
+            func_node = self.functions.get((func_name, len(args)))
+            if func_node is None:
+                super().error(ErrorType.NAME_ERROR, f"Function {func_name} undefined")
+        arg_values = [self.evaluate_expression(arg) for arg in args]
+        return self.run_func(func_node, arg_values, cells)
+
+    # A lambda's value only holds the cells of the variables it uses, the resolver worked out which
+    def make_closure(self, func_node):
+        cells = tuple(self.frame[slot] for _, slot in self.resolution.captures[func_node])
+        return FunctionValue(func_node.get('name'), len(func_node.get('args') or []), func_node, cells)
 
     # Variable Expression
     def get_value_of_variable(self, expression_node):
-        var_name = expression_node.get('name')
-        # Can't read an unassigned var
-        if not var_name in self.variable_name_to_value:
-            super().error(ErrorType.NAME_ERROR, f"Variable {var_name} undefined")
-        return self.variable_name_to_value[var_name]
+        # A function's name, when there's no variable called that
+        func_node = self.resolution.function_refs.get(expression_node)
+        if func_node is not None:
+            return self.function_values[func_node]
+        # a.b.c reads variable a, then its field b, then that object's field c
+        # Undefined variables never get here, the resolver reports them before the program runs
+        value = self.frame[self.resolution.slot(expression_node)]
+        if self.resolution.in_cell(expression_node):
+            value = value.value
+        if self.resolution.path(expression_node)[1]:
+            return get_cached_path(value, self.get_field_caches(expression_node), super().error)
+        return value
+
+    # The inline caches for the fields of a dotted name, made the first time it runs
+    def get_field_caches(self, node):
+        caches = self.field_caches.get(node)
+        if caches is None:
+            caches = tuple(FieldCache(name) for name in self.resolution.path(node)[1])
+            self.field_caches[node] = caches
+        return caches
 
     # Value Nodes
     def get_value(self, expression_node):
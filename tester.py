@@ -4,7 +4,9 @@ Implements all CS 131-related test logic; is entry-point for testing framework.
 
 import asyncio
 import importlib
+import inspect
 from os import environ, listdir, getcwd
+from os.path import isdir
 import sys
 import traceback
 from operator import itemgetter
@@ -20,8 +22,9 @@ from harness import (
 class TestScaffold(AbstractTestScaffold):
     """Implement scaffold for Brewin' interpreter; load file, validate syntax, run testcase."""
 
-    def __init__(self, interpreter_lib):
+    def __init__(self, interpreter_lib, engine=None):
         self.interpreter_lib = interpreter_lib
+        self.engine = engine
 
     def setup(self, test_case):
         srcfile = itemgetter("srcfile")(
@@ -42,12 +45,22 @@ class TestScaffold(AbstractTestScaffold):
             "program": program,
         }
 
+    def __takes(self, option):
+        return option in inspect.signature(self.interpreter_lib.Interpreter).parameters
+
     def run_test_case(self, test_case, environment):
         expect_failure = itemgetter("expect_failure")(test_case)
         stdin, expected, program = itemgetter("stdin", "expected", "program")(
             environment
         )
-        interpreter = self.interpreter_lib.Interpreter(False, stdin, False)
+        # A program still running at the harness's timeout stops itself instead of using up the thread. Only
+        # passed when there is one and the interpreter takes it, so older interpreter versions still run
+        options = {}
+        if test_case.get("deadline") is not None and self.__takes("deadline"):
+            options["deadline"] = test_case["deadline"]
+        if self.engine:
+            options["engine"] = self.engine
+        interpreter = self.interpreter_lib.Interpreter(False, stdin, False, **options)
         try:
             interpreter.run(program)
         except Exception as exception:  # pylint: disable=broad-except
@@ -141,6 +154,16 @@ def generate_test_suite_v1():
         fails,
     )
 
+def generate_engine_test_suite(version, engine):
+    """tests only one engine is expected to pass, from v<version>/tests_<engine> and fails_<engine> if they exist"""
+    suite = []
+    for folder, expect_failure in (("tests", False), ("fails", True)):
+        directory = f"v{version}/{folder}_{engine}/"
+        if isdir(getcwd() + "/" + directory):
+            names = __get_file_names(getcwd() + "/" + directory)
+            suite += __generate_test_case_structure(names, directory, f"{engine}", expect_failure)
+    return suite
+
 def generate_test_suite_v2():
     """wrapper for generate_test_suite for v2"""
     tests = __get_file_names(getcwd() + "/v2/tests/")
@@ -176,11 +199,17 @@ async def main():
     if not sys.argv:
         raise ValueError("Error: Missing version number argument")
     version = sys.argv[1]
-    zero_credit = len(sys.argv) > 2 and sys.argv[2] == '--zero-credit'
+    zero_credit = '--zero-credit' in sys.argv[2:]
+    # --engine=<name> runs the suite on one of the interpreter's alternative engines, plus the engine's own
+    # tests in v<version>/tests_<name> and fails_<name>
+    engine = None
+    for arg in sys.argv[2:]:
+        if arg.startswith('--engine='):
+            engine = arg[len('--engine='):]
     module_name = f"interpreterv{version}"
     interpreter = importlib.import_module(module_name)
 
-    scaffold = TestScaffold(interpreter)
+    scaffold = TestScaffold(interpreter, engine)
 
     match version:
         case "1":
@@ -193,6 +222,9 @@ async def main():
             tests = generate_test_suite_v4()
         case _:
             raise ValueError("Unsupported version; expect one of {1, 2, 3, 4}")
+    # Some behavior belongs to one engine, like recursion deeper than Python's limit on the iterative one
+    if engine:
+        tests += generate_engine_test_suite(version, engine)
 
     results = await run_all_tests(scaffold, tests, zero_credit=zero_credit)
     total_score = get_score(results) / len(results) * 100.0